@@ -0,0 +1,277 @@
+"""
+オフラインのベンチマーク
+
+一時ディレクトリに合成データのDBを作り、yfinanceをスタンドインに差し替えた状態で主要な処理の時間を計測する。
+ネットワークと本番の survey.db は使わない。結果はJSONで保存し、--compare で以前の結果と比較できる。
+
+    python -m benchmarks.run [--days 180] [--tickers 100] [--voters 30] [--repeat 3]
+                             [--only simulate_investment,calculate_pnl] [--output benchmark_results.json]
+                             [--compare 前回のbenchmark_results.json]
+
+各処理は --repeat 回実行する。1回目はprice_cacheが空の状態（コールド）、2回目以降は
+price_cacheに保存済みでプロセス内のキャッシュ（lru_cache / st.cache_data）だけを消去した状態で計測する。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import date, datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from streamlit import logger as streamlit_logger
+from benchmarks.synthetic import (
+    SyntheticScale, generate_moomoo_trades, generate_price_frames, offline_yfinance, populate_database
+)
+
+# スコアリングに渡す投票上位の銘柄数（run_batch_analysis の既定値と同じ）
+SCORING_TOP_N = 20
+
+# 初期資金（円）
+INITIAL_JPY = 5000000
+INITIAL_USD = 5000000
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _clear_process_caches():
+    """lru_cache と st.cache_data のキャッシュを消去（price_cacheテーブルとアーカイブは残す）"""
+    from pages import investment_simulation
+    from utils import simulation
+    simulation.get_stock_price_cached.cache_clear()
+    simulation.get_exchange_rate.cache_clear()
+    investment_simulation.calculate_pnl_breakdown.clear()
+
+
+def _top_vote_codes(vote_date_str, top_n):
+    from utils.db import get_vote_results_top_n
+    return [code for code, _ in get_vote_results_top_n(vote_date_str, top_n=top_n)]
+
+
+def _bench_simulate_investment(context):
+    from utils.simulation import DEFAULT_ALLOCATION, simulate_investment
+    scale = context['scale']
+    result = simulate_investment(
+        scale.start_date, scale.end_date, INITIAL_JPY, INITIAL_USD, DEFAULT_ALLOCATION, DEFAULT_ALLOCATION
+    )
+    results, history = result['simulation_results'], result['trade_history']
+    context['simulation'] = (results, history)
+    return {'days': len(results), 'trades': len(history), 'skipped_days': result['skipped_days']}
+
+
+def _bench_calculate_pnl_breakdown(context):
+    from pages.investment_simulation import calculate_pnl_breakdown
+    if 'simulation' not in context:
+        _bench_simulate_investment(context)
+    results, history = context['simulation']
+    breakdown = calculate_pnl_breakdown(results, history)
+    return {'days': len(breakdown)}
+
+
+def _bench_compute_scores(context):
+    from utils.common import get_ticker
+    from utils.scorer import StockScorer
+    scale = context['scale']
+    end = scale.end_date.strftime('%Y-%m-%d')
+    start = (scale.end_date - timedelta(days=180)).strftime('%Y-%m-%d')
+    stock_data = {}
+    for code in _top_vote_codes(context['last_vote_date'], SCORING_TOP_N):
+        frame = context['frames'][get_ticker(code)]
+        stock_data[code] = frame.loc[start:end]
+    results = StockScorer(stock_data).compute_scores()
+    return {'stocks': len(stock_data), 'scored': len(results)}
+
+
+def _bench_run_batch_analysis(context):
+    from utils.analysis_runner import run_batch_analysis
+    # 進捗のprintを計測結果に混ぜない
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = run_batch_analysis(context['last_vote_date'], top_n=SCORING_TOP_N)
+    return {'scored': len(results)}
+
+
+def _bench_moomoo_calculate_pnl(context):
+    from utils.moomoo_pnl import calculate_pnl
+    realized, holdings, warnings = calculate_pnl(context['moomoo_trades'])
+    return {'trades': len(context['moomoo_trades']), 'realized': len(realized), 'holdings': len(holdings)}
+
+
+def _bench_result_page_queries(context):
+    from utils.result_artifacts import get_vote_summary
+    total = 0
+    for vote_date in context['vote_dates']:
+        total_votes, vote_sessions, results = get_vote_summary(vote_date)
+        total += len(results)
+    return {'vote_dates': len(context['vote_dates']), 'rows': total}
+
+
+BENCHMARKS = {
+    'simulate_investment': _bench_simulate_investment,
+    'calculate_pnl_breakdown': _bench_calculate_pnl_breakdown,
+    'compute_scores': _bench_compute_scores,
+    'run_batch_analysis': _bench_run_batch_analysis,
+    'moomoo_calculate_pnl': _bench_moomoo_calculate_pnl,
+    'result_page_queries': _bench_result_page_queries,
+}
+
+
+def _run_benchmark(func, context, repeat):
+    timings = []
+    downloads = []
+    info = {}
+    for _ in range(repeat):
+        _clear_process_caches()
+        calls_before = context['market'].calls['download']
+        start = time.perf_counter()
+        info = func(context)
+        timings.append((time.perf_counter() - start) * 1000)
+        downloads.append(context['market'].calls['download'] - calls_before)
+    return {
+        'timings_ms': timings,
+        'cold_ms': timings[0],
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'yf_downloads': downloads,
+        'info': info,
+    }
+
+
+def run_benchmarks(scale, names=None, repeat=3, workdir=None):
+    """
+    合成データを作成してベンチマークを実行する
+
+    Parameters:
+    scale (SyntheticScale): データの規模
+    names (list): 実行するベンチマーク名（Noneの場合はすべて）
+    repeat (int): 各ベンチマークの実行回数
+    workdir (str): DBを作成するディレクトリ（Noneの場合は一時ディレクトリ）
+
+    Returns:
+    dict: 実行環境・規模・データ件数・ベンチマークごとの結果
+    """
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"不明なベンチマーク: {', '.join(unknown)}")
+
+    original_cwd = os.getcwd()
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix='discover_stocks_bench_'))
+        # utils.db.get_db_path はカレントディレクトリの survey.db を使う
+        os.chdir(workdir)
+        stack.callback(os.chdir, original_cwd)
+
+        counts = populate_database(scale)
+        frames = generate_price_frames(scale)
+        market = stack.enter_context(offline_yfinance(frames))
+
+        from utils.db import get_connection
+        conn = get_connection()
+        try:
+            vote_dates = [row[0] for row in conn.execute("SELECT DISTINCT vote_date FROM vote ORDER BY vote_date")]
+        finally:
+            conn.close()
+
+        context = {
+            'scale': scale,
+            'frames': frames,
+            'market': market,
+            'vote_dates': vote_dates,
+            'last_vote_date': vote_dates[-1],
+            'moomoo_trades': generate_moomoo_trades(scale, frames),
+        }
+        results = {name: _run_benchmark(BENCHMARKS[name], context, repeat) for name in names}
+
+    return {
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': {key: (value.isoformat() if isinstance(value, date) else value) for key, value in asdict(scale).items()},
+        'repeat': repeat,
+        'data': counts,
+        'benchmarks': results,
+    }
+
+
+def compare_results(current, baseline):
+    """
+    ベンチマークごとの中央値を以前の結果と比較
+
+    Returns:
+    list: [(ベンチマーク名, 以前の中央値ms, 今回の中央値ms, 比率), ...]
+    """
+    rows = []
+    for name, result in current['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        ratio = result['median_ms'] / previous['median_ms'] if previous['median_ms'] else None
+        rows.append((name, previous['median_ms'], result['median_ms'], ratio))
+    return rows
+
+
+def main(argv=None):
+    # Streamlitのランタイム外で実行するため、キャッシュ等の警告ログを抑える
+    streamlit_logger.set_log_level('error')
+
+    parser = argparse.ArgumentParser(description='合成データによるオフラインのベンチマーク')
+    parser.add_argument('--days', type=int, default=SyntheticScale.days)
+    parser.add_argument('--tickers', type=int, default=SyntheticScale.tickers)
+    parser.add_argument('--voters', type=int, default=SyntheticScale.voters)
+    parser.add_argument('--seed', type=int, default=SyntheticScale.seed)
+    parser.add_argument('--end-date', default=SyntheticScale.end_date.isoformat(), help='期間の最終日（YYYY-MM-DD）')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help=f"実行するベンチマーク（カンマ区切り）: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='比較する以前の結果のJSONファイル')
+    args = parser.parse_args(argv)
+
+    scale = SyntheticScale(
+        days=args.days, tickers=args.tickers, voters=args.voters, seed=args.seed,
+        end_date=date.fromisoformat(args.end_date)
+    )
+    names = args.only.split(',') if args.only else None
+    output = os.path.abspath(args.output)
+    result = run_benchmarks(scale, names, args.repeat)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"{'benchmark':<26} {'cold(ms)':>10} {'median(ms)':>11} {'downloads':>10}")
+    for name, entry in result['benchmarks'].items():
+        print(f"{name:<26} {entry['cold_ms']:>10.1f} {entry['median_ms']:>11.1f} {entry['yf_downloads'][0]:>10}")
+    print(f"saved: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {baseline.get('git_commit')} ({baseline.get('generated_at')})")
+        if baseline.get('scale') != result['scale']:
+            print(f"warning: データの規模が異なります（前回: {baseline.get('scale')}）")
+        for name, previous_ms, current_ms, ratio in compare_results(result, baseline):
+            ratio_text = f"{ratio:.2f}x" if ratio is not None else '-'
+            print(f"{name:<26} {previous_ms:>10.1f} -> {current_ms:>10.1f} ms ({ratio_text})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+ベンチマーク用の合成データ
+
+乱数のシードを固定して、投票・アンケート・銘柄マスタ・株価（OHLCV）・USD/JPYの系列を決定的に生成する。
+規模は日数・銘柄数・投票者数で調整する。
+yfinanceの代わりに生成した系列を返すスタンドイン（offline_yfinance）を使うと、
+ネットワークなしで株価を取得する処理を計測できる。
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from utils.common import MAX_VOTE_SELECTION, get_ticker
+from utils.db import get_connection, init_db, init_price_cache_table
+from utils.fx_rates import FX_TICKER
+from utils.market_calendar import get_market, is_trading_day
+
+
+@dataclass
+class SyntheticScale:
+    """合成データの規模"""
+    days: int = 180       # 期間の日数（end_dateを含む）
+    tickers: int = 100    # 銘柄数（半分ずつ日本株・米国株）
+    voters: int = 30      # 投票日ごとの投票者数
+    seed: int = 42
+    end_date: date = date(2025, 11, 28)
+
+    @property
+    def start_date(self):
+        return self.end_date - timedelta(days=self.days - 1)
+
+
+# 株価の系列は期間の前にも余分に生成する（スコアリングは過去180日分を使う）
+PRICE_HISTORY_PADDING_DAYS = 200
+
+# 1人が投票する銘柄数
+VOTES_PER_VOTER = MAX_VOTE_SELECTION
+
+# 1人がアンケートで登録する銘柄数
+SURVEY_CODES_PER_VOTER = 5
+
+
+def generate_stock_codes(n_tickers):
+    """日本株（4桁の数字）と米国株（英字）の銘柄コードを半分ずつ生成"""
+    n_jp = (n_tickers + 1) // 2
+    jp_codes = [str(1300 + i * 7) for i in range(n_jp)]
+    us_codes = []
+    for i in range(n_tickers - n_jp):
+        code = ''
+        value = i
+        for _ in range(3):
+            code = chr(ord('A') + value % 26) + code
+            value //= 26
+        us_codes.append(code)
+    return jp_codes + us_codes
+
+
+def _random_walk(rng, index, start_price, daily_vol):
+    """幾何ブラウン運動で終値の系列を作り、始値・高値・安値・出来高を付ける"""
+    n = len(index)
+    returns = rng.normal(0.0004, daily_vol, n)
+    close = start_price * np.exp(np.cumsum(returns))
+    open_ = close * np.exp(rng.normal(0, daily_vol / 3, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, daily_vol / 2, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, daily_vol / 2, n)))
+    volume = rng.lognormal(12, 0.5, n).round()
+    return pd.DataFrame(
+        {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume},
+        index=pd.DatetimeIndex(index, name='Date')
+    )
+
+
+def _trading_days(start, end, market):
+    days = pd.date_range(start, end, freq='D')
+    return [d for d in days if is_trading_day(d.date(), market)]
+
+
+def generate_price_frames(scale):
+    """
+    銘柄ごとの日次OHLCVとUSD/JPYの系列を生成
+
+    Returns:
+    dict: {yfinanceのティッカー: DataFrame(Open, High, Low, Close, Volume)}（USD/JPYは FX_TICKER）
+    """
+    rng = np.random.default_rng(scale.seed)
+    start = scale.start_date - timedelta(days=PRICE_HISTORY_PADDING_DAYS)
+    end = scale.end_date
+    frames = {}
+    calendars = {market: _trading_days(start, end, market) for market in ('JP', 'US', 'FX')}
+    for code in generate_stock_codes(scale.tickers):
+        market = get_market(code)
+        start_price = rng.uniform(500, 5000) if market == 'JP' else rng.uniform(10, 300)
+        frames[get_ticker(code)] = _random_walk(rng, calendars[market], start_price, rng.uniform(0.01, 0.03))
+    frames[FX_TICKER] = _random_walk(rng, calendars['FX'], 150.0, 0.004)
+    return frames
+
+
+def _vote_days(start, end):
+    """投票日（火曜日・土曜日）"""
+    day = start
+    while day <= end:
+        if day.weekday() in (1, 5):
+            yield day
+        day += timedelta(days=1)
+
+
+def populate_database(scale):
+    """
+    現在のDB（utils.db.get_db_path）に銘柄マスタ・アンケート・投票を書き込む
+
+    人気の偏りを再現するため、銘柄はZipf分布に近い重みで選ぶ。
+
+    Returns:
+    dict: {'stock_master': 行数, 'survey': 行数, 'vote': 行数}
+    """
+    init_db()
+    init_price_cache_table()
+    rng = np.random.default_rng(scale.seed + 1)
+    codes = generate_stock_codes(scale.tickers)
+    weights = 1.0 / np.arange(1, len(codes) + 1)
+    weights /= weights.sum()
+
+    survey_rows = []
+    vote_rows = []
+    for vote_day in _vote_days(scale.start_date, scale.end_date):
+        day_str = vote_day.strftime('%Y-%m-%d')
+        popularity = rng.permutation(len(codes))
+        for voter in range(scale.voters):
+            created_at = datetime.combine(vote_day, datetime.min.time()) + timedelta(hours=20, seconds=voter)
+            created_at_str = created_at.strftime('%Y-%m-%d %H:%M:%S')
+            n_votes = min(VOTES_PER_VOTER, len(codes))
+            for index in rng.choice(len(codes), size=n_votes, replace=False, p=weights):
+                vote_rows.append((day_str, codes[popularity[index]], created_at_str))
+            n_survey = min(SURVEY_CODES_PER_VOTER, len(codes))
+            for index in rng.choice(len(codes), size=n_survey, replace=False, p=weights):
+                survey_rows.append((day_str, codes[popularity[index]], created_at_str))
+
+    conn = get_connection()
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO stock_master (stock_code, stock_name) VALUES (?, ?)",
+            [(code, f"銘柄{code}") for code in codes]
+        )
+        conn.executemany("INSERT INTO survey (survey_date, stock_code, created_at) VALUES (?, ?, ?)", survey_rows)
+        conn.executemany("INSERT INTO vote (vote_date, stock_code, created_at) VALUES (?, ?, ?)", vote_rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return {'stock_master': len(codes), 'survey': len(survey_rows), 'vote': len(vote_rows)}
+
+
+def generate_moomoo_trades(scale, frames, n_trades=None):
+    """
+    moomoo証券の約定（utils.moomoo_pnl.parse_moomoo_csv の結果と同じ列）を生成
+
+    米国株を買い→一部売りの順で売買し、売り数量は保有数量を超えないようにする。
+    """
+    rng = np.random.default_rng(scale.seed + 2)
+    us_codes = [code for code in generate_stock_codes(scale.tickers) if get_market(code) == 'US']
+    n_trades = n_trades or scale.voters * 20
+    held = {code: 0 for code in us_codes}
+    rows = []
+    for i in range(n_trades):
+        code = us_codes[rng.integers(len(us_codes))]
+        frame = frames[get_ticker(code)]
+        frame = frame[frame.index.date >= scale.start_date]
+        bar = frame.index[min(i * len(frame) // n_trades, len(frame) - 1)]
+        if held[code] > 0 and rng.random() < 0.4:
+            side = '売り'
+            qty = float(rng.integers(1, held[code] + 1))
+            held[code] -= int(qty)
+        else:
+            side = '買い'
+            qty = float(rng.integers(1, 50))
+            held[code] += int(qty)
+        trade_datetime = bar + pd.Timedelta(hours=23, seconds=i)
+        rows.append({
+            'date': trade_datetime.date(),
+            'datetime': trade_datetime,
+            'ticker': code,
+            'name': f"銘柄{code}",
+            'side': side,
+            'currency': 'USD',
+            'qty': qty,
+            'price': float(frame.loc[bar, 'Close']),
+            'fee': 1.0,
+            'original_line': i + 2,
+        })
+    return pd.DataFrame(rows)
+
+
+class OfflineTicker:
+    """yfinance.Ticker のスタンドイン（info と history のみ）"""
+
+    def __init__(self, market, ticker):
+        self._market = market
+        self.ticker = ticker
+
+    @property
+    def info(self):
+        return {'shortName': f"Synthetic {self.ticker}"} if self.ticker in self._market.frames else {}
+
+    def history(self, period=None, start=None, end=None, auto_adjust=True, **kwargs):
+        return self._market.slice(self.ticker, start, end, period).copy()
+
+
+class OfflineMarket:
+    """
+    生成した系列から yfinance.download / yfinance.Ticker と同じ形のデータを返す
+
+    download の結果は現行のyfinanceと同じく (Price, Ticker) のMultiIndex列を持つ。
+    呼び出し回数は calls に記録する。
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.calls = {'download': 0, 'Ticker': 0}
+
+    def slice(self, ticker, start=None, end=None, period=None):
+        frame = self.frames.get(ticker)
+        if frame is None:
+            return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        if period is not None:
+            days = int(str(period).rstrip('d')) if str(period).endswith('d') else 365
+            return frame.iloc[-days:]
+        if start is not None:
+            frame = frame[frame.index >= pd.Timestamp(start)]
+        if end is not None:
+            # yfinanceの end は含まない
+            frame = frame[frame.index < pd.Timestamp(end)]
+        return frame
+
+    def download(self, tickers, start=None, end=None, period=None, group_by='column', **kwargs):
+        self.calls['download'] += 1
+        if isinstance(tickers, str):
+            tickers = tickers.split()
+        parts = {ticker: self.slice(ticker, start, end, period) for ticker in tickers}
+        parts = {ticker: df for ticker, df in parts.items() if not df.empty}
+        if not parts:
+            return pd.DataFrame()
+        combined = pd.concat(parts, axis=1)  # 列は (Ticker, Price)
+        if group_by == 'ticker':
+            return combined
+        return combined.swaplevel(0, 1, axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+    def ticker(self, ticker):
+        self.calls['Ticker'] += 1
+        return OfflineTicker(self, ticker)
+
+
+@contextmanager
+def offline_yfinance(frames):
+    """
+    yfinance.download と yfinance.Ticker を OfflineMarket に差し替える
+
+    各モジュールは `import yfinance as yf` した後に yf.download を呼び出し時に参照するため、
+    モジュールの属性を差し替えれば読み込み済みのページにも反映される。
+    """
+    import yfinance as yf
+    market = OfflineMarket(frames)
+    original = (yf.download, yf.Ticker)
+    yf.download = market.download
+    yf.Ticker = market.ticker
+    try:
+        yield market
+    finally:
+        yf.download, yf.Ticker = original
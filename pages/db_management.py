@@ -1,15 +1,19 @@
 import streamlit as st
-import sqlite3
-import json
-from datetime import datetime
-from io import BytesIO
+import os
 import pandas as pd
 from utils.db import get_connection
+from utils import maintenance, metrics, price_archive, profiler, session_store, snapshot
+from utils.db_transfer import (
+    EXPORT_FORMATS, EXPORT_PREVIEW_ROWS, create_export_file, get_existing_tables, import_database,
+    is_parquet_available
+)
 
 def show(selected_date):
     st.title("データベース管理")
     
-    tab1, tab2, tab3 = st.tabs(["エクスポート", "インポート", "データベース整理"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(
+        ["エクスポート", "インポート", "スナップショット", "データベース整理", "起動プロファイル", "計測", "セッションメモリ"]
+    )
     
     with tab1:
         show_export()
@@ -18,53 +22,82 @@ def show(selected_date):
         show_import()
 
     with tab3:
+        show_snapshot()
+
+    with tab4:
         show_maintenance_db()
 
+    with tab5:
+        show_startup_profile()
+
+    with tab6:
+        show_metrics()
+
+    with tab7:
+        show_session_memory()
+
 def show_export():
     st.subheader("データベースエクスポート")
-    
-    # データベースの内容を取得
-    conn = get_connection()
-    
-    # 各テーブルのデータを取得
-    tables = {
-        'stock_master': pd.read_sql_query("SELECT * FROM stock_master", conn),
-        'survey': pd.read_sql_query("SELECT * FROM survey", conn),
-        'vote': pd.read_sql_query("SELECT * FROM vote", conn)
-    }
-    
-    conn.close()
-    
-    # エクスポートファイル名
-    export_filename = f"db_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    
-    # JSONデータの作成
-    export_data = {
-        'export_date': datetime.now().isoformat(),
-        'tables': {
-            table_name: df.to_dict(orient='records')
-            for table_name, df in tables.items()
-        }
-    }
-    
-    # JSONファイルのダウンロードボタン
-    json_str = json.dumps(export_data, ensure_ascii=False, indent=2)
-    st.download_button(
-        "データベースをエクスポート",
-        data=json_str.encode('utf-8'),
-        file_name=export_filename,
-        mime="application/json"
+
+    # 出力形式の選択
+    format_options = ['ndjson', 'csv']
+    if is_parquet_available():
+        format_options.append('parquet')
+    export_format = st.radio(
+        "出力形式",
+        format_options,
+        format_func=lambda f: EXPORT_FORMATS[f][0],
+        horizontal=True,
+        key="export_format"
     )
-    
-    # テーブルの内容を表示
+
+    if st.button("エクスポートファイルを作成"):
+        with st.spinner("エクスポート中..."):
+            # テーブルをチャンク単位でZIPへ書き出す（古いファイルは保持する世代数を超えたら削除される）
+            try:
+                export_path, manifest = create_export_file(export_format)
+            except Exception as e:
+                st.error(f"エクスポートに失敗しました: {str(e)}")
+                return
+
+            st.session_state['db_export_path'] = export_path
+            st.session_state['db_export_filename'] = os.path.basename(export_path)
+            st.session_state['db_export_manifest'] = manifest
+
+    # 作成済みのエクスポートファイルのダウンロードボタン
+    export_path = st.session_state.get('db_export_path')
+    if export_path and os.path.exists(export_path):
+        manifest = st.session_state['db_export_manifest']
+        st.write(f"作成日時: {manifest['export_date']}（{EXPORT_FORMATS[manifest['format']][0]}）")
+        with open(export_path, 'rb') as f:
+            st.download_button(
+                "データベースをエクスポート",
+                data=f,
+                file_name=st.session_state['db_export_filename'],
+                mime="application/zip"
+            )
+    elif export_path:
+        st.info("作成したファイルは新しいエクスポートにより削除されました。再度作成してください。")
+
+    # テーブルの内容を表示（先頭のみプレビュー）
     st.markdown("---")
     st.write("現在のデータベース内容")
-    
-    for table_name, df in tables.items():
-        st.write(f"### {table_name}")
-        st.write(f"レコード数: {len(df)}")
-        if not df.empty:
-            st.dataframe(df)
+
+    conn = get_connection()
+    try:
+        for table_name in get_existing_tables(conn):
+            total = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            st.write(f"### {table_name}")
+            st.write(f"レコード数: {total}")
+            if total > 0:
+                df = pd.read_sql_query(
+                    f"SELECT * FROM {table_name} LIMIT ?", conn, params=(EXPORT_PREVIEW_ROWS,)
+                )
+                st.dataframe(df)
+                if total > EXPORT_PREVIEW_ROWS:
+                    st.caption(f"先頭{EXPORT_PREVIEW_ROWS}件のみ表示しています。")
+    finally:
+        conn.close()
 
 def show_import():
     st.subheader("データベースインポート")
@@ -75,88 +108,364 @@ def show_import():
     - バックアップを取ってから実行することをお勧めします
     """)
     
-    uploaded_file = st.file_uploader("バックアップファイルを選択", type=['json'])
+    uploaded_file = st.file_uploader("バックアップファイルを選択", type=['zip', 'json'])
     
     if uploaded_file is not None:
+        if st.button("インポートを実行"):
+            status_text = st.empty()
+
+            def on_progress(table_name, rows):
+                status_text.text(f"インポート中: {table_name} ({rows:,}件)")
+
+            with st.spinner("データをインポート中..."):
+                try:
+                    result = import_database(uploaded_file, on_progress=on_progress)
+                except Exception as e:
+                    # import_database内でロールバック済み
+                    st.error(f"インポート中にエラーが発生しました: {str(e)}")
+                    return
+
+            status_text.empty()
+            st.success(
+                f"データのインポートが完了しました。"
+                f"（{result['rows']:,}件 / {result['elapsed']:.1f}秒, {result['rows_per_sec']:,.0f}件/秒）"
+            )
+            st.dataframe(
+                pd.DataFrame(list(result['tables'].items()), columns=['テーブル', 'レコード数']),
+                hide_index=True
+            )
+
+def show_snapshot():
+    st.subheader("スナップショット")
+    st.write(
+        f"SQLiteのオンラインバックアップでDBファイルをそのまま複製します。"
+        f"コピー中も他のユーザーの書き込みは妨げません（最新{snapshot.SNAPSHOT_RETENTION}世代を保持）。"
+    )
+
+    def page_progress(progress_bar):
+        def on_progress(copied, total):
+            progress_bar.progress(min(copied / total, 1.0) if total else 1.0)
+        return on_progress
+
+    if st.button("スナップショットを作成"):
+        progress_bar = st.progress(0)
         try:
-            import_data = json.load(uploaded_file)
-            
-            # データの検証
-            if 'tables' not in import_data:
-                st.error("無効なバックアップファイルです。")
-                return
-            
-            if st.button("インポートを実行"):
-                with st.spinner("データをインポート中..."):
-                    conn = get_connection()
-                    c = conn.cursor()
-                    
-                    # トランザクション開始
-                    c.execute("BEGIN TRANSACTION")
-                    
-                    try:
-                        # 各テーブルのデータをインポート
-                        for table_name, records in import_data['tables'].items():
-                            # テーブルを空にする
-                            c.execute(f"DELETE FROM {table_name}")
-                            
-                            if records:  # レコードが存在する場合
-                                # カラム名を取得
-                                columns = records[0].keys()
-                                placeholders = ','.join(['?' for _ in columns])
-                                columns_str = ','.join(columns)
-                                
-                                # データを挿入
-                                for record in records:
-                                    values = [record[col] for col in columns]
-                                    c.execute(
-                                        f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})",
-                                        values
-                                    )
-
-                        # 統計情報の更新
-                        c.execute("ANALYZE;")
-
-                        # コミット
-                        conn.commit()
-                        st.success("データのインポートが完了しました。")
-
-                    except Exception as e:
-                        # エラー時はロールバック
-                        conn.rollback()
-                        st.error(f"インポート中にエラーが発生しました: {str(e)}")
-                    
-                    finally:
-                        conn.close()
-                        
+            path = snapshot.create_snapshot(on_progress=page_progress(progress_bar))
+            st.success(f"スナップショットを作成しました: {os.path.basename(path)}")
         except Exception as e:
-            st.error(f"ファイルの読み込みに失敗しました: {str(e)}") 
+            st.error(f"スナップショットの作成に失敗しました: {str(e)}")
+
+    snapshots = snapshot.list_snapshots()
+    if not snapshots:
+        st.info("スナップショットはまだありません。")
+        return
+
+    st.dataframe(
+        pd.DataFrame([
+            {
+                'ファイル名': s['name'],
+                '作成日時': s['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                'サイズ(MB)': round(s['size'] / 1024 / 1024, 2),
+            }
+            for s in snapshots
+        ]),
+        hide_index=True
+    )
+
+    selected_name = st.selectbox("対象のスナップショット", [s['name'] for s in snapshots])
+    selected = next(s for s in snapshots if s['name'] == selected_name)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("整合性チェック"):
+            with st.spinner("整合性をチェック中..."):
+                ok, messages = snapshot.check_integrity(selected['path'])
+            if ok:
+                st.success("整合性チェックOK")
+            else:
+                st.error("整合性チェックNG: " + "; ".join(messages[:5]))
+    with col2:
+        with open(selected['path'], 'rb') as f:
+            st.download_button(
+                "ダウンロード",
+                data=f,
+                file_name=selected['name'],
+                mime="application/vnd.sqlite3"
+            )
+    with col3:
+        confirm = st.checkbox("復元を許可する", key="snapshot_restore_confirm")
+        if st.button("このスナップショットから復元", disabled=not confirm):
+            progress_bar = st.progress(0)
+            try:
+                backup_path = snapshot.restore_snapshot(selected['path'], on_progress=page_progress(progress_bar))
+                st.success(f"復元しました。復元前の状態は {os.path.basename(backup_path)} に保存しています。")
+            except Exception as e:
+                st.error(f"復元に失敗しました: {str(e)}")
 
 def show_maintenance_db():
     st.subheader("データベース整理")
+    st.write(
+        f"WALチェックポイントと空きページの解放は、バックグラウンドで{maintenance.MAINTENANCE_INTERVAL}秒ごとに"
+        f"小さな単位で実行されています（最大{maintenance.MAINTENANCE_VACUUM_PAGES}ページ/回）。"
+    )
+
+    scheduler = maintenance.start_maintenance_scheduler()
+    if scheduler.last_run_at:
+        st.caption(f"前回のバックグラウンド実行: {scheduler.last_run_at.strftime('%Y-%m-%d %H:%M:%S')}")
+    if scheduler.last_error:
+        st.warning(f"前回のバックグラウンド実行でエラーが発生しました: {scheduler.last_error}")
+
+    status = maintenance.get_database_status()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("auto_vacuum", status['auto_vacuum'])
+    col2.metric("DBサイズ(MB)", f"{status['page_count'] * status['page_size'] / 1024 / 1024:,.1f}")
+    col3.metric("空きページ数", f"{status['freelist_count']:,}")
+
+    if status['auto_vacuum'] != 'INCREMENTAL':
+        st.warning(
+            "auto_vacuumがINCREMENTALではないため、空きページはバックグラウンドで解放されません。"
+            "切り替えにはVACUUMによるDB全体の書き直しが1回必要です（実行中は他のユーザーの操作が待たされます）。"
+        )
+        if st.button("INCREMENTALモードへ切り替え（VACUUM実行）"):
+            with st.spinner("VACUUMを実行中..."):
+                try:
+                    maintenance.enable_incremental_vacuum()
+                    st.success("auto_vacuumをINCREMENTALに切り替えました")
+                except Exception as e:
+                    st.error(f"切り替えに失敗しました: {str(e)}")
+
+    if st.button("メンテナンスを今すぐ1回実行"):
+        try:
+            maintenance.run_maintenance_slice(optimize=True)
+            st.success("データベース整理を実行しました")
+        except Exception as e:
+            # PRAGMA wal_checkpointはトランザクション外のコマンドのためRollBack不可
+            st.error(f"データベース整理に失敗しました: {str(e)}")
+
+    # 株価キャッシュの保持期間（ホット層/アーカイブ層）
+    st.write("#### 株価キャッシュ")
+    st.write(
+        f"直近{price_archive.PRICE_CACHE_HOT_DAYS}日分はデータベースに保持し、"
+        "それより古い値は1日1回、銘柄ごとのアーカイブファイルへ移動しています。"
+    )
+    storage = price_archive.get_price_storage_status()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("DB内の行数", f"{storage['hot_rows']:,}")
+    col2.metric("アーカイブ区間数", f"{storage['archive_runs']:,}")
+    col3.metric("アーカイブサイズ(KB)", f"{storage['archive_bytes'] / 1024:,.1f}")
+    if st.button("保持期間を過ぎた株価を今すぐアーカイブ"):
+        try:
+            summary = price_archive.archive_price_cache(max_tickers=None)
+            st.success(f"{summary['tickers']}銘柄・{summary['rows']:,}行をアーカイブへ移動しました")
+        except Exception as e:
+            st.error(f"アーカイブに失敗しました: {str(e)}")
+
+    # 各スライスがDBを占有した時間
+    slice_log = maintenance.get_slice_log()
+    if slice_log:
+        st.write("#### 実行履歴（直近）")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    '開始時刻': entry['started_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                    '処理': entry['task'],
+                    '占有時間(ms)': round(entry['duration_ms'], 1),
+                    '結果': entry['result'],
+                }
+                for entry in slice_log
+            ]),
+            hide_index=True
+        )
+
+def show_startup_profile():
+    st.subheader("起動プロファイル")
+    st.write(
+        f"環境変数 {profiler.PROFILE_ENV}=1 で起動すると、モジュールのimport時間、ページの表示時間、"
+        "init_db・ChatWork認証処理・サイドバーの累積時間を記録します。"
+    )
+
+    if profiler.is_enabled():
+        report = profiler.get_report()
+        st.caption(f"このプロセス（PID {report['pid']}）で {report['started_at']} から記録中")
+    else:
+        report = profiler.load_report()
+        if report is None:
+            st.info("プロファイルのレポートはまだありません。")
+            return
+        st.caption(f"プロファイリングは無効です。保存済みのレポート（{report['generated_at']}時点）を表示しています。")
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("importしたモジュール数", f"{report['import_count']:,}")
+    col2.metric("import時間合計(ms)", f"{report['import_total_ms']:,.0f}")
+    col3.metric("ページimport予算(ms)", f"{report['budget_ms']:,.0f}")
 
-    # データベース整理の実行
-    def run_maintenance_db():
-        conn = get_connection()
-        c = conn.cursor()
+    for violation in report['violations']:
+        st.error(
+            f"ページ {violation['page']} のコールドimportが予算を超えています: "
+            f"{violation['import_ms']:,.0f} ms（予算 {violation['budget_ms']:,.0f} ms）"
+        )
 
+    if report['pages']:
+        st.write("#### ページ")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'ページ': page,
+                    'import(ms)': round(entry['import_ms'], 1) if entry.get('import_ms') is not None else None,
+                    '表示回数': entry.get('show', {}).get('count', 0),
+                    '表示 平均(ms)': round(entry['show']['total_ms'] / entry['show']['count'], 1) if entry.get('show') else None,
+                    '表示 最大(ms)': round(entry['show']['max_ms'], 1) if entry.get('show') else None,
+                }
+                for page, entry in sorted(report['pages'].items())
+            ]),
+            hide_index=True
+        )
+
+    if report['sections']:
+        st.write("#### 起動処理（累積）")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    '処理': name,
+                    '回数': entry['count'],
+                    '合計(ms)': round(entry['total_ms'], 1),
+                    '最大(ms)': round(entry['max_ms'], 1),
+                }
+                for name, entry in report['sections'].items()
+            ]),
+            hide_index=True
+        )
+
+    if report['imports']:
+        st.write(f"#### import時間の上位{len(report['imports'])}モジュール")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'モジュール': entry['module'],
+                    '子を含む(ms)': round(entry['inclusive_ms'], 1),
+                    '自身(ms)': round(entry['self_ms'], 1),
+                    'import元': entry['parent'] or '',
+                }
+                for entry in report['imports']
+            ]),
+            hide_index=True
+        )
+
+def show_metrics():
+    st.subheader("計測")
+    st.write(
+        f"環境変数 {metrics.METRICS_SAMPLE_RATE_ENV}（0〜1）の割合で、SQL文の形ごと・yfinanceのエンドポイントごと・"
+        "ページ表示ごとの時間と、キャッシュのヒット率を集計します。"
+    )
+
+    sample_rate = st.number_input(
+        "サンプリング率（このプロセスのみ、0で無効）", min_value=0.0, max_value=1.0,
+        value=float(metrics.get_sample_rate()), step=0.1
+    )
+    if sample_rate != metrics.get_sample_rate():
+        metrics.set_sample_rate(sample_rate)
+        st.rerun()
+
+    metrics_snapshot = metrics.get_snapshot()
+    st.caption(f"{metrics_snapshot['started_at'].strftime('%Y-%m-%d %H:%M:%S')} からの集計（サンプリング率 {metrics_snapshot['sample_rate']:g}）")
+
+    col1, col2, col3 = st.columns(3)
+    if col1.button("Prometheus形式で保存"):
         try:
-            # WALチェックポイントを実行する関数
-            c.execute("PRAGMA wal_checkpoint(FULL);")
+            path = metrics.write_prometheus_file()
+            st.success(f"{path} に保存しました")
+        except Exception as e:
+            st.error(f"保存に失敗しました: {str(e)}")
+    if col2.button("metricsテーブルに保存"):
+        try:
+            rows = metrics.save_to_db()
+            st.success(f"{rows}件を保存しました")
+        except Exception as e:
+            st.error(f"保存に失敗しました: {str(e)}")
+    if col3.button("集計をリセット"):
+        metrics.reset()
+        st.rerun()
+
+    kind_labels = {'page': 'ページ表示', 'sql': 'SQL', 'yfinance': 'yfinance'}
+    for kind in ('page', 'sql', 'yfinance'):
+        entries = [e for e in metrics_snapshot['latencies'] if e['kind'] == kind]
+        if not entries:
+            continue
+        st.write(f"#### {kind_labels[kind]}（合計時間の降順）")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    '対象': entry['name'],
+                    '回数': entry['count'],
+                    '合計(ms)': round(entry['sum_ms'], 1),
+                    '平均(ms)': round(entry['avg_ms'], 1),
+                    '最大(ms)': round(entry['max_ms'], 1),
+                }
+                for entry in entries
+            ]),
+            hide_index=True
+        )
+
+    if metrics_snapshot['caches']:
+        st.write("#### キャッシュ")
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    'キャッシュ': cache['name'],
+                    'ヒット': cache['hits'],
+                    'ミス': cache['misses'],
+                    'ヒット率(%)': round(cache['hit_ratio'] * 100, 1) if cache['hit_ratio'] is not None else None,
+                }
+                for cache in metrics_snapshot['caches']
+            ]),
+            hide_index=True
+        )
 
-            # 統計情報の更新
-            c.execute("ANALYZE;")
+def show_session_memory():
+    st.subheader("セッションメモリ")
+    st.write(
+        "特定銘柄分析ページで取得した株価データとチャート画像は、このプロセス内の保管場所でセッション間で共有されます。"
+        f"メモリ上の合計が上限を超えると古いものから一時ディレクトリ（{session_store.SESSION_STORE_DIR}）に退避し、"
+        f"{session_store.SESSION_STORE_IDLE_SECONDS // 60}分間アクセスのないセッションの参照は解放されます。"
+    )
 
-            # DBファイルのサイズ最適化
-            c.execute("VACUUM;")
+    stats = session_store.get_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("メモリ使用量(MB)", f"{stats['memory_bytes'] / 1024 / 1024:,.1f}")
+    col2.metric("上限(MB)", f"{stats['max_bytes'] / 1024 / 1024:,.0f}")
+    col3.metric("退避済み(MB)", f"{stats['disk_bytes'] / 1024 / 1024:,.1f}")
+    col4.metric("データ数（退避済み / 参照なし）", f"{stats['entries']:,}（{stats['spilled']:,} / {stats['unreferenced']:,}）")
 
+    col1, col2 = st.columns(2)
+    if col1.button("アイドルのセッションを解放"):
+        released = session_store.release_idle_sessions()
+        st.success(f"{released}件のセッションを解放しました")
+        st.rerun()
+    if col2.button("すべて一時ディレクトリに退避"):
+        try:
+            spilled = session_store.spill_all()
+            st.success(f"{spilled}件を退避しました")
         except Exception as e:
-            # PRAGMA wal_checkpointはトランザクション外のコマンドのためRollBack不可
-            st.error(f"データベース整理に失敗しました: {str(e)}") 
+            st.error(f"退避に失敗しました: {str(e)}")
 
-        finally:
-            conn.close()
+    if not stats['sessions']:
+        st.info("データを保管しているセッションはありません。")
+        return
 
-    if st.button("データベース整理実行"):
-        run_maintenance_db()
-        st.success("データベース整理を実行しました")
+    st.write("#### セッションごとの使用量")
+    st.caption("共有(MB)は、他のセッションも参照している（同じ銘柄・期間を取得した）データの分です。")
+    current_session_id = session_store.get_session_id()
+    st.dataframe(
+        pd.DataFrame([
+            {
+                'セッション': session['session_id'][:8] + ('（このセッション）' if session['session_id'] == current_session_id else ''),
+                '最終アクセス': session['last_seen'].strftime('%Y-%m-%d %H:%M:%S'),
+                'データ数': session['handles'],
+                'メモリ(MB)': round(session['memory_bytes'] / 1024 / 1024, 2),
+                '退避済み(MB)': round(session['disk_bytes'] / 1024 / 1024, 2),
+                '共有(MB)': round(session['shared_bytes'] / 1024 / 1024, 2),
+            }
+            for session in stats['sessions']
+        ]),
+        hide_index=True
+    )
@@ -1,1034 +1,18 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta, date
-import yfinance as yf
+from datetime import datetime, date
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import calendar
-from utils.db import get_connection, init_price_cache_table
-from utils.common import get_stock_name, get_ticker
-from functools import lru_cache
+from utils.common import get_stock_name
+from utils import simulation
+from utils.simulation import DEFAULT_ALLOCATION, calculate_risk_metrics, get_stock_price_cached, simulate_investment
+from utils.market_calendar import is_calendar_covered
 
-# デフォルトの投資配分比率
-DEFAULT_ALLOCATION = [25, 20, 15, 10, 5, 5, 5, 5, 5, 5]
-
-# 取引コスト設定
-TRADING_COSTS = {
-    'commission_rate': 0.001,  # 0.1%の手数料
-    'slippage_rate': 0.0005,   # 0.05%のスリッページ
-    'spread_rate': 0.0002       # 0.02%のスプレッド
-}
-
-# リスクフリーレート（シャープレシオ計算用）
-# 日本の10年国債利回りを想定。市場環境に応じて調整が必要
-RISK_FREE_RATE = 0.02  # 2%
-
-def get_price_from_cache(stock_code, date_str):
-    """
-    キャッシュから株価を取得
-
-    引数:
-        stock_code (str): 銘柄コード（為替の場合は'USDJPY=X'）
-        date_str (str): 日付（例: 'YYYY-MM-DD' 形式）
-
-    戻り値:
-        float: 株価、または該当データがない場合は None
-    """
-    conn = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT price FROM price_cache
-            WHERE stock_code = ? AND date = ?
-        """, (stock_code, date_str))
-
-        result = cursor.fetchone()
-
-        if result:
-            return float(result[0])
-        return None
-
-    except Exception as e:
-        return None
-    finally:
-        if conn is not None:
-            conn.close()
-
-def save_price_to_cache(stock_code, date_str, price, currency):
-    """
-    株価をキャッシュに保存
-
-    Parameters:
-    stock_code (str): 銘柄コード（為替の場合は'USDJPY=X'）
-    date_str (str): 日付（YYYY-MM-DD形式）
-    price (float): 株価
-    currency (str): 通貨（'JPY', 'USD', 'FX'）
-    """
-    conn = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # INSERT OR REPLACE を使用して更新
-        cursor.execute("""
-            INSERT OR REPLACE INTO price_cache
-            (stock_code, date, price, currency, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (stock_code, date_str, price, currency, updated_at))
-
-        conn.commit()
-
-    except Exception as e:
-        st.error(f"Failed to save price to cache for {stock_code} on {date_str}: {e}")
-    finally:
-        if conn is not None:
-            conn.close()
-
-@lru_cache(maxsize=1000)
-def get_exchange_rate(target_date):
-    """
-    指定日のUSD/JPY為替レートを取得する関数（キャッシュ付き）
-
-    Parameters:
-    target_date (str): 対象日（YYYY-MM-DD形式）
-
-    Returns:
-    float: USD/JPY為替レート または None
-    """
-    # 1. DBキャッシュから取得を試みる
-    cached_rate = get_price_from_cache("USDJPY=X", target_date)
-    if cached_rate is not None:
-        return cached_rate
-
-    # 2. キャッシュにない場合はyfinanceから取得
-    try:
-        # 前後3日間のデータを取得して、指定日に最も近い営業日の為替レートを取得
-        start_date = (pd.Timestamp(target_date) - pd.Timedelta(days=3)).strftime("%Y-%m-%d")
-        end_date = (pd.Timestamp(target_date) + pd.Timedelta(days=3)).strftime("%Y-%m-%d")
-
-        df = yf.download(
-            "USDJPY=X",
-            start=start_date,
-            end=end_date,
-            progress=False,
-            threads=False,
-            auto_adjust=True
-        )
-
-        if df.empty:
-            return None
-
-        # 指定日に最も近い営業日の終値を取得
-        target_timestamp = pd.Timestamp(target_date)
-        available_dates = df.index
-
-        # 指定日以前の最新の営業日を探す
-        valid_dates = available_dates[available_dates <= target_timestamp]
-        if len(valid_dates) > 0:
-            closest_date = valid_dates[-1]
-            close_value = df.loc[closest_date]["Close"]
-            if isinstance(close_value, pd.Series):
-                rate = float(close_value.iloc[0])
-            else:
-                rate = float(close_value)
-
-            # 3. 取得した値をDBキャッシュに保存
-            save_price_to_cache("USDJPY=X", target_date, rate, "FX")
-
-            return rate
-
-        return None
-
-    except Exception as e:
-        return None
-
-@lru_cache(maxsize=1000)
-def get_stock_price_cached(stock_code, target_date):
-    """
-    指定日の株価を取得する関数（キャッシュ付き）
-
-    Parameters:
-    stock_code (str): 銘柄コード
-    target_date (str): 対象日（YYYY-MM-DD形式）
-
-    Returns:
-    float: 終値 または None
-    """
-    # 1. DBキャッシュから取得を試みる
-    cached_price = get_price_from_cache(stock_code, target_date)
-    if cached_price is not None:
-        return cached_price
-
-    # 2. キャッシュにない場合はyfinanceから取得
-    try:
-        ticker = get_ticker(stock_code)
-
-        # 前後3日間のデータを取得して、指定日に最も近い営業日の株価を取得
-        start_date = (pd.Timestamp(target_date) - pd.Timedelta(days=3)).strftime("%Y-%m-%d")
-        end_date = (pd.Timestamp(target_date) + pd.Timedelta(days=3)).strftime("%Y-%m-%d")
-
-        df = yf.download(
-            ticker,
-            start=start_date,
-            end=end_date,
-            progress=False,
-            threads=False,
-            auto_adjust=True
-        )
-
-        if df.empty:
-            return None
-
-        # 指定日に最も近い営業日の終値を取得
-        target_timestamp = pd.Timestamp(target_date)
-        available_dates = df.index
-
-        # 指定日以前の最新の営業日を探す
-        valid_dates = available_dates[available_dates <= target_timestamp]
-        if len(valid_dates) > 0:
-            closest_date = valid_dates[-1]
-            close_value = df.loc[closest_date]["Close"]
-            if isinstance(close_value, pd.Series):
-                price = float(close_value.iloc[0])
-            else:
-                price = float(close_value)
-
-            # 異常に大きな価格をチェック（例：1株あたり100万円を超える場合は無効）
-            if price > 1000000 or price <= 0:
-                return None
-
-            # 3. 取得した値をDBキャッシュに保存
-            # 通貨を判定（日本株かどうか）
-            currency = 'JPY' if stock_code and stock_code[0].isdigit() else 'USD'
-            save_price_to_cache(stock_code, target_date, price, currency)
-
-            return price
-
-        return None
-
-    except Exception as e:
-        return None
-
-def get_next_business_day(date_obj):
-    """次の営業日を取得（土日をスキップ）"""
-    next_day = date_obj + timedelta(days=1)
-    while next_day.weekday() >= 5:  # 土曜日(5)または日曜日(6)
-        next_day += timedelta(days=1)
-    return next_day
-
-def get_latest_vote_date(trade_date):
-    """
-    取引日に対応する直近の投票日を取得（月曜日→土曜日、 水曜日→火曜日）
-
-    Parameters:
-    trade_date (date): 取引日
-
-    Returns:
-    date or None: 対応する投票日、該当しない場合はNone
-    """
-    if trade_date is None:
-        return None
-
-    weekday = trade_date.weekday()
-
-    # 水曜日の場合は前日の火曜日が投票日
-    if weekday == 2:
-        candidate = trade_date - timedelta(days=1)
-        if candidate.weekday() == 1:
-            return candidate
-
-    # 月曜日の場合は2日前の土曜日が投票日
-    if weekday == 0:
-        candidate = trade_date - timedelta(days=2)
-        if candidate.weekday() == 5:
-            return candidate
-
-    return None
-
-def get_vote_results_for_date_separated(vote_date):
-    """指定日の投票結果を日本株と米国株に分けて取得"""
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # 全投票結果を取得
-        cursor.execute("""
-            SELECT stock_code, COUNT(*) as vote_count
-            FROM vote
-            WHERE vote_date = ?
-            GROUP BY stock_code
-            ORDER BY vote_count DESC
-        """, (vote_date,))
-        
-        all_results = cursor.fetchall()
-        
-        # 日本株と米国株に分ける
-        jpy_stocks = []
-        usd_stocks = []
-        
-        for stock_code, vote_count in all_results:
-            if stock_code and stock_code[0].isdigit():  # 日本株
-                jpy_stocks.append((stock_code, vote_count))
-            elif stock_code:  # 米国株
-                usd_stocks.append((stock_code, vote_count))
-        
-        # それぞれのベスト10を返す
-        return jpy_stocks[:10], usd_stocks[:10]
-    finally:
-        conn.close()
-
-def get_vote_results_for_date(vote_date):
-    """指定日の投票結果を取得"""
-    conn = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT stock_code, COUNT(*) as vote_count
-            FROM vote
-            WHERE vote_date = ?
-            GROUP BY stock_code
-            ORDER BY vote_count DESC
-            LIMIT 10
-        """, (vote_date,))
-        
-        return cursor.fetchall()
-    finally:
-        if conn is not None:
-            conn.close()
-
-def calculate_trading_cost(trade_value, costs=TRADING_COSTS):
-    """取引コストを計算"""
-    total_cost_rate = costs['commission_rate'] + costs['slippage_rate'] + costs['spread_rate']
-    return trade_value * total_cost_rate
-
-def calculate_portfolio_value(portfolio, current_prices, exchange_rate=None):
-    """ポートフォリオの現在価値を計算（円換算）"""
-    total_value = 0
-    for i, (stock_code, shares) in enumerate(portfolio.items()):
-        if stock_code in current_prices and current_prices[stock_code] is not None:
-            price = current_prices[stock_code]
-            
-            # 異常な株価をチェック
-            if price <= 0 or price > 1000000:  # 0以下または100万円を超える場合は無効
-                continue
-            
-            stock_value = shares * price
-            
-            # 米国株の場合は円換算
-            if stock_code and not stock_code[0].isdigit() and exchange_rate is not None:
-                # 異常な為替レートをチェック
-                if exchange_rate <= 0 or exchange_rate > 1000:  # 0以下または1000を超える場合は無効
-                    continue
-                stock_value *= exchange_rate
-            
-            # 異常な評価額をチェック（10兆円を超える場合は無効）
-            if stock_value > 10000000000000:
-                continue
-                
-            total_value += stock_value
-    
-    return total_value
-
-def calculate_target_portfolio(stocks, allocation_ratios, investment_value, trade_date_str):
-    """
-    目標ポートフォリオを計算
-    
-    Args:
-        stocks: [(stock_code, vote_count), ...] の形式の株式リスト
-        allocation_ratios: 各銘柄の配分比率のリスト（%）
-        investment_value: 投資額（円またはドル）
-        trade_date_str: 取引日（株価取得用）
-    
-    Returns:
-        dict: {stock_code: target_shares, ...} の形式の目標ポートフォリオ
-    """
-    target_portfolio = {}
-    
-    for i, (stock_code, vote_count) in enumerate(stocks):
-        if i < len(allocation_ratios):
-            allocation_ratio = allocation_ratios[i] / 100.0
-            target_value = investment_value * allocation_ratio
-            
-            price = get_stock_price_cached(stock_code, trade_date_str)
-            if price is not None and price > 0:
-                trading_cost = calculate_trading_cost(target_value)
-                net_value = target_value - trading_cost
-                target_shares = int(net_value / price)
-                
-                if target_shares > 0:
-                    target_portfolio[stock_code] = target_shares
-    
-    return target_portfolio
-
-def calculate_required_sale_proceeds(current_portfolio, target_portfolio, current_prices):
-    """
-    減額売却が必要な場合の売却額を計算
-    
-    Args:
-        current_portfolio: 現在のポートフォリオ {stock_code: shares, ...}
-        target_portfolio: 目標ポートフォリオ {stock_code: shares, ...}
-        current_prices: 現在の株価 {stock_code: price, ...}
-    
-    Returns:
-        float: 売却による純現金増加額（取引コスト控除後）
-    """
-    total_proceeds = 0
-    
-    for stock_code, current_shares in current_portfolio.items():
-        target_shares = target_portfolio.get(stock_code, 0)
-        
-        if target_shares < current_shares:
-            shares_to_sell = current_shares - target_shares
-            
-            if stock_code in current_prices and current_prices[stock_code] is not None:
-                sell_price = current_prices[stock_code]
-                sell_value = shares_to_sell * sell_price
-                sell_cost = calculate_trading_cost(sell_value)
-                total_proceeds += sell_value - sell_cost
-    
-    return total_proceeds
-
-def calculate_total_asset_value(jpy_portfolio_value, jpy_cash, usd_portfolio_value, usd_cash, exchange_rate):
-    """
-    総資産価値を計算（すべて円換算）
-    
-    Args:
-        jpy_portfolio_value: 日本株ポートフォリオの価値（円）
-        jpy_cash: 日本円現金
-        usd_portfolio_value: 米国株ポートフォリオの価値（ドル建ての場合はドル、円換算済みの場合は円）
-        usd_cash: 米ドル現金
-        exchange_rate: 為替レート（円/ドル）。Noneの場合はusd値を0として扱う
-    
-    Returns:
-        float: 総資産価値（円）
-    """
-    total = jpy_portfolio_value + jpy_cash
-    if exchange_rate is not None:
-        # usd_portfolio_valueが既に円換算されている場合とドル建ての場合の両方に対応
-        # 通常、calculate_portfolio_valueからの戻り値は円換算済みなので、
-        # ここではusd_portfolio_valueをそのまま加算し、usd_cashのみを換算する
-        total += usd_portfolio_value + (usd_cash * exchange_rate)
-    return total
-
-def simulate_investment(start_date, end_date, initial_jpy, initial_usd, jpy_allocation_ratios, usd_allocation_ratios):
-    """投資シミュレーションを実行"""
-
-    # シミュレーション結果を格納するリスト
-    simulation_results = []
-
-    # 取引履歴を格納するリスト
-    trade_history = []
-
-    # 初期ポートフォリオ
-    jpy_portfolio = {}
-    usd_portfolio = {}
-    jpy_cash = initial_jpy
-
-    # 米国株の初期資金を円からドルに変換（開始日の為替レートを使用）
-    start_date_str = start_date.strftime("%Y-%m-%d")
-    initial_exchange_rate = get_exchange_rate(start_date_str)
-    if initial_exchange_rate is None or initial_exchange_rate <= 0:
-        st.error(f"開始日の為替レートが取得できませんでした: {start_date_str}")
-        return [], []
-
-    usd_cash = initial_usd / initial_exchange_rate  # 円→ドルに変換
-
-    # 初期価値を記録（円換算）
-    initial_total_value = initial_jpy + initial_usd
-
-    # 火曜日と土曜日の投票日を取得
-    current_date = start_date
-    previous_total_value = initial_total_value  # 前日の総資産価値を記録
-
-    # プログレスバー用の計算
-    total_days = (end_date - start_date).days + 1
-
-    # プログレスバーを初期化
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    while current_date <= end_date:
-        # 進捗を更新（現在の日付の位置で計算）
-        days_elapsed = (current_date - start_date).days + 1
-        progress = min(days_elapsed / total_days, 1.0)
-        progress_bar.progress(progress)
-        status_text.text(f"処理中: {current_date.strftime('%Y-%m-%d')} ({days_elapsed}/{total_days}日, {progress*100:.1f}%)")
-        
-        # 土日をスキップ（市場が開いていない日）
-        if current_date.weekday() >= 5:
-            current_date += timedelta(days=1)
-            continue
-
-        # 為替レートを取得（毎日必要）
-        exchange_rate = get_exchange_rate(current_date.strftime("%Y-%m-%d"))
-        if exchange_rate is None or exchange_rate <= 0:
-            current_date += timedelta(days=1)
-            continue
-
-        # 取引処理: 火曜日・土曜日の投票翌営業日（月曜・水曜）に取引を実施
-        vote_date = get_latest_vote_date(current_date)
-        is_trade_day = vote_date is not None
-
-        # 取引コストを初期化（取引日の場合のみ使用）
-        total_trading_cost = 0
-
-        if is_trade_day:
-            vote_date_str = vote_date.strftime("%Y-%m-%d")
-            jpy_stocks, usd_stocks = get_vote_results_for_date_separated(vote_date_str)
-
-            if jpy_stocks or usd_stocks:
-                # 今日が取引日
-                trade_date = current_date
-
-                # 現在のポートフォリオ価値を計算
-                current_jpy_prices = {}
-                current_usd_prices = {}
-
-                # 日本株の現在価格を取得
-                for stock_code in jpy_portfolio.keys():
-                    price = get_stock_price_cached(stock_code, trade_date.strftime("%Y-%m-%d"))
-                    if price is not None:
-                        current_jpy_prices[stock_code] = price
-                
-                # 米国株の現在価格を取得
-                for stock_code in usd_portfolio.keys():
-                    price = get_stock_price_cached(stock_code, trade_date.strftime("%Y-%m-%d"))
-                    if price is not None:
-                        current_usd_prices[stock_code] = price
-                
-                # --- 日本株の差分調整 ---
-                # 日本株の差分売買を実行
-                jpy_cash_from_sales = 0
-                jpy_cash_for_purchases = 0
-
-                # まず、売却が必要な銘柄を特定
-                # 1. 売却が必要な銘柄を処理（投票結果に含まれない銘柄を全売却）
-                temp_jpy_portfolio = jpy_portfolio.copy()
-                for stock_code, current_shares in jpy_portfolio.items():
-                    # 投票結果にこの銘柄が含まれているか確認
-                    in_vote_results = any(sc == stock_code for sc, _ in jpy_stocks)
-                    
-                    if not in_vote_results:
-                        # 投票結果に含まれていない銘柄は全売却
-                        if stock_code in current_jpy_prices and current_jpy_prices[stock_code] is not None:
-                            sell_price = current_jpy_prices[stock_code]
-                            sell_value = current_shares * sell_price
-                            sell_cost = calculate_trading_cost(sell_value)
-
-                            # 売却による現金増加（手数料を差し引く）
-                            jpy_cash_from_sales += sell_value - sell_cost
-                            total_trading_cost += sell_cost
-
-                            # 取引履歴に記録
-                            trade_history.append({
-                                'date': trade_date,
-                                'vote_date': vote_date,
-                                'stock_code': stock_code,
-                                'stock_name': get_stock_name(stock_code),
-                                'action': '売却',
-                                'shares': current_shares,
-                                'price': sell_price,
-                                'value': sell_value,
-                                'currency': 'JPY',
-                                'exchange_rate': None
-                            })
-
-                            # 一時ポートフォリオから削除
-                            del temp_jpy_portfolio[stock_code]
-
-                # 現金を更新（売却による現金増加を追加）
-                jpy_cash += jpy_cash_from_sales
-
-                # 2. 保有銘柄の調整を事前に計算（減額が必要な場合の売却額を把握）
-                # まず、現在のポートフォリオ価値と現金から投資額を計算（暫定）
-                temp_jpy_portfolio_value = calculate_portfolio_value(temp_jpy_portfolio, current_jpy_prices)
-                
-                if not temp_jpy_portfolio and not usd_portfolio:
-                    # 最初の取引
-                    temp_jpy_investment_value = initial_jpy  # 円
-                else:
-                    temp_jpy_investment_value = temp_jpy_portfolio_value + jpy_cash  # 円
-
-                # 暫定の目標ポートフォリオを計算
-                temp_target_jpy_portfolio = calculate_target_portfolio(
-                    jpy_stocks, jpy_allocation_ratios, temp_jpy_investment_value, trade_date.strftime("%Y-%m-%d")
-                )
-
-                # 減額売却が必要な場合の追加売却額を計算
-                additional_cash_from_sales = calculate_required_sale_proceeds(
-                    temp_jpy_portfolio, temp_target_jpy_portfolio, current_jpy_prices
-                )
-
-                # すべての売却後の最終投資額を計算
-                final_jpy_cash = jpy_cash + additional_cash_from_sales
-                
-                # 投資対象の総資産価値を決定（すべての売却後の価値を使用）
-                if not temp_jpy_portfolio and not usd_portfolio:
-                    # 最初の取引
-                    jpy_investment_value = initial_jpy  # 円
-                    usd_investment_value_usd = usd_cash  # ドル
-                else:
-                    # 減額売却後のポートフォリオ価値を計算
-                    final_jpy_portfolio_value = temp_jpy_portfolio_value
-                    # 減額売却される株の価値を差し引く
-                    for stock_code, current_shares in temp_jpy_portfolio.items():
-                        target_shares = temp_target_jpy_portfolio.get(stock_code, 0)
-                        if target_shares < current_shares:
-                            shares_to_sell = current_shares - target_shares
-                            if stock_code in current_jpy_prices and current_jpy_prices[stock_code] is not None:
-                                final_jpy_portfolio_value -= shares_to_sell * current_jpy_prices[stock_code]
-                    
-                    # すべての売却後のポートフォリオ価値に基づいて日本株と米国株の資金を配分
-                    jpy_investment_value = final_jpy_portfolio_value + final_jpy_cash  # 円
-                    # 米国株の価値をドルで計算
-                    usd_portfolio_value_usd = calculate_portfolio_value(usd_portfolio, current_usd_prices)  # ドル建て
-                    usd_investment_value_usd = usd_portfolio_value_usd + usd_cash  # ドル
-
-                # 新しい目標ポートフォリオを計算（すべての売却後の投資額を使用）
-                target_jpy_portfolio = calculate_target_portfolio(
-                    jpy_stocks, jpy_allocation_ratios, jpy_investment_value, trade_date.strftime("%Y-%m-%d")
-                )
-
-                # 3. 保有銘柄の調整（減額が必要な場合の売却）を実行
-                for stock_code, current_shares in temp_jpy_portfolio.items():
-                    target_shares = target_jpy_portfolio.get(stock_code, 0)
-
-                    if target_shares < current_shares:
-                        # 売却が必要
-                        shares_to_sell = current_shares - target_shares
-
-                        if stock_code in current_jpy_prices and current_jpy_prices[stock_code] is not None:
-                            sell_price = current_jpy_prices[stock_code]
-                            sell_value = shares_to_sell * sell_price
-                            sell_cost = calculate_trading_cost(sell_value)
-
-                            # 取引コストを記録
-                            total_trading_cost += sell_cost
-
-                            # 取引履歴に記録
-                            trade_history.append({
-                                'date': trade_date,
-                                'vote_date': vote_date,
-                                'stock_code': stock_code,
-                                'stock_name': get_stock_name(stock_code),
-                                'action': '売却',
-                                'shares': shares_to_sell,
-                                'price': sell_price,
-                                'value': sell_value,
-                                'currency': 'JPY',
-                                'exchange_rate': None
-                            })
-
-                            # 一時ポートフォリオを更新
-                            temp_jpy_portfolio[stock_code] = target_shares
-
-                # 追加売却による現金を更新
-                jpy_cash += additional_cash_from_sales
-
-                # 4. 購入が必要な銘柄を処理
-                for stock_code, target_shares in target_jpy_portfolio.items():
-                    current_shares = temp_jpy_portfolio.get(stock_code, 0)
-
-                    if target_shares > current_shares:
-                        # 購入が必要
-                        shares_to_buy = target_shares - current_shares
-
-                        price = get_stock_price_cached(stock_code, trade_date.strftime("%Y-%m-%d"))
-                        if price is not None and price > 0:
-                            buy_value = shares_to_buy * price
-                            buy_cost = calculate_trading_cost(buy_value)
-                            total_cost = buy_value + buy_cost
-
-                            # 現金が足りる場合のみ購入
-                            if total_cost <= jpy_cash:
-                                jpy_cash -= total_cost
-                                jpy_cash_for_purchases += total_cost
-                                total_trading_cost += buy_cost
-
-                                # 取引履歴に記録
-                                trade_history.append({
-                                    'date': trade_date,
-                                    'vote_date': vote_date,
-                                    'stock_code': stock_code,
-                                    'stock_name': get_stock_name(stock_code),
-                                    'action': '購入',
-                                    'shares': shares_to_buy,
-                                    'price': price,
-                                    'value': buy_value,
-                                    'currency': 'JPY',
-                                    'exchange_rate': None,
-                                    'buy_price': price,
-                                    'sell_price': None
-                                })
-
-                                # 一時ポートフォリオを更新
-                                temp_jpy_portfolio[stock_code] = target_shares
-                            else:
-                                # 現金が足りない場合は、購入できる分だけ購入
-                                available_shares = int((jpy_cash * 0.99) / (price * (1 + TRADING_COSTS['commission_rate'] + TRADING_COSTS['slippage_rate'] + TRADING_COSTS['spread_rate'])))
-                                if available_shares > 0:
-                                    shares_to_buy = available_shares
-                                    buy_value = shares_to_buy * price
-                                    buy_cost = calculate_trading_cost(buy_value)
-                                    total_cost = buy_value + buy_cost
-
-                                    if total_cost <= jpy_cash:
-                                        jpy_cash -= total_cost
-                                        jpy_cash_for_purchases += total_cost
-                                        total_trading_cost += buy_cost
-
-                                        # 取引履歴に記録
-                                        trade_history.append({
-                                            'date': trade_date,
-                                            'vote_date': vote_date,
-                                            'stock_code': stock_code,
-                                            'stock_name': get_stock_name(stock_code),
-                                            'action': '購入',
-                                            'shares': shares_to_buy,
-                                            'price': price,
-                                            'value': buy_value,
-                                            'currency': 'JPY',
-                                            'exchange_rate': None,
-                                            'buy_price': price,
-                                            'sell_price': None
-                                        })
-
-                                        # 一時ポートフォリオを更新
-                                        temp_jpy_portfolio[stock_code] = current_shares + shares_to_buy
-
-                # 日本株ポートフォリオを更新
-                jpy_portfolio = temp_jpy_portfolio.copy()
-
-                # --- 米国株の差分調整 ---
-                # 米国株の差分売買を実行
-                usd_cash_from_sales = 0
-                usd_cash_for_purchases = 0
-
-                # 1. 売却が必要な銘柄を処理（投票結果に含まれない銘柄を全売却）
-                temp_usd_portfolio = usd_portfolio.copy()
-                for stock_code, current_shares in usd_portfolio.items():
-                    # 投票結果にこの銘柄が含まれているか確認
-                    in_vote_results = any(sc == stock_code for sc, _ in usd_stocks)
-                    
-                    if not in_vote_results:
-                        # 投票結果に含まれていない銘柄は全売却
-                        if stock_code in current_usd_prices and current_usd_prices[stock_code] is not None:
-                            sell_price = current_usd_prices[stock_code]
-                            sell_value_usd = current_shares * sell_price
-                            sell_cost_usd = calculate_trading_cost(sell_value_usd)
-
-                            # 売却による現金増加（手数料を差し引く、ドル建て）
-                            usd_cash_from_sales += sell_value_usd - sell_cost_usd
-                            total_trading_cost += sell_cost_usd * exchange_rate  # 円換算
-
-                            # 取引履歴に記録
-                            trade_history.append({
-                                'date': trade_date,
-                                'vote_date': vote_date,
-                                'stock_code': stock_code,
-                                'stock_name': get_stock_name(stock_code),
-                                'action': '売却',
-                                'shares': current_shares,
-                                'price': sell_price,
-                                'value': sell_value_usd,
-                                'currency': 'USD',
-                                'exchange_rate': exchange_rate
-                            })
-
-                            # 一時ポートフォリオから削除
-                            del temp_usd_portfolio[stock_code]
-
-                # 現金を更新（売却による現金増加を追加、ドル建て）
-                usd_cash += usd_cash_from_sales
-
-                # 売却後のポートフォリオ価値を再計算（ドル建て）
-                temp_usd_portfolio_value_usd = calculate_portfolio_value(temp_usd_portfolio, current_usd_prices)  # ドル建て
-
-                # 投資対象の総資産価値を決定（売却後の価値を使用）
-                if not jpy_portfolio and not temp_usd_portfolio:
-                    # 最初の取引
-                    usd_investment_value_usd = usd_cash  # ドル
-                else:
-                    # 売却後のポートフォリオ価値に基づいて米国株の資金を配分（ドル建て）
-                    usd_investment_value_usd = temp_usd_portfolio_value_usd + usd_cash  # ドル
-
-                # 2. 保有銘柄の調整を事前に計算（減額が必要な場合の売却額を把握）
-                # まず、現在のポートフォリオ価値と現金から投資額を計算（暫定）
-                
-                if not jpy_portfolio and not temp_usd_portfolio:
-                    # 最初の取引
-                    temp_usd_investment_value_usd = initial_usd / initial_exchange_rate  # ドル
-                else:
-                    temp_usd_investment_value_usd = temp_usd_portfolio_value_usd + usd_cash  # ドル
-
-                # 暫定の目標ポートフォリオを計算
-                temp_target_usd_portfolio = calculate_target_portfolio(
-                    usd_stocks, usd_allocation_ratios, temp_usd_investment_value_usd, trade_date.strftime("%Y-%m-%d")
-                )
-
-                # 減額売却が必要な場合の追加売却額を計算
-                additional_usd_cash_from_sales = calculate_required_sale_proceeds(
-                    temp_usd_portfolio, temp_target_usd_portfolio, current_usd_prices
-                )
-
-                # すべての売却後の最終投資額を計算
-                final_usd_cash = usd_cash + additional_usd_cash_from_sales
-                
-                # 投資対象の総資産価値を決定（すべての売却後の価値を使用）
-                if not jpy_portfolio and not temp_usd_portfolio:
-                    # 最初の取引
-                    usd_investment_value_usd = initial_usd / initial_exchange_rate  # ドル
-                else:
-                    # 減額売却後のポートフォリオ価値を計算（ドル建て）
-                    final_usd_portfolio_value_usd = temp_usd_portfolio_value_usd
-                    # 減額売却される株の価値を差し引く
-                    for stock_code, current_shares in temp_usd_portfolio.items():
-                        target_shares = temp_target_usd_portfolio.get(stock_code, 0)
-                        if target_shares < current_shares:
-                            shares_to_sell = current_shares - target_shares
-                            if stock_code in current_usd_prices and current_usd_prices[stock_code] is not None:
-                                final_usd_portfolio_value_usd -= shares_to_sell * current_usd_prices[stock_code]
-                    
-                    # すべての売却後のポートフォリオ価値に基づいて米国株の資金を配分（ドル建て）
-                    usd_investment_value_usd = final_usd_portfolio_value_usd + final_usd_cash  # ドル
-
-                # 新しい目標ポートフォリオを計算（すべての売却後の投資額を使用）
-                target_usd_portfolio = calculate_target_portfolio(
-                    usd_stocks, usd_allocation_ratios, usd_investment_value_usd, trade_date.strftime("%Y-%m-%d")
-                )
-
-                # 3. 保有銘柄の調整（減額が必要な場合の売却）を実行
-                for stock_code, current_shares in temp_usd_portfolio.items():
-                    target_shares = target_usd_portfolio.get(stock_code, 0)
-
-                    if target_shares < current_shares:
-                        # 売却が必要
-                        shares_to_sell = current_shares - target_shares
-
-                        if stock_code in current_usd_prices and current_usd_prices[stock_code] is not None:
-                            sell_price = current_usd_prices[stock_code]
-                            sell_value_usd = shares_to_sell * sell_price
-                            sell_cost_usd = calculate_trading_cost(sell_value_usd)
-
-                            # 取引コストを記録
-                            total_trading_cost += sell_cost_usd * exchange_rate  # 円換算
-
-                            # 取引履歴に記録
-                            trade_history.append({
-                                'date': trade_date,
-                                'vote_date': vote_date,
-                                'stock_code': stock_code,
-                                'stock_name': get_stock_name(stock_code),
-                                'action': '売却',
-                                'shares': shares_to_sell,
-                                'price': sell_price,
-                                'value': sell_value_usd,
-                                'currency': 'USD',
-                                'exchange_rate': exchange_rate
-                            })
-
-                            # 一時ポートフォリオを更新
-                            temp_usd_portfolio[stock_code] = target_shares
-
-                # 追加売却による現金を更新（ドル建て）
-                usd_cash += additional_usd_cash_from_sales
-
-                # 4. 購入が必要な銘柄を処理
-                for stock_code, target_shares in target_usd_portfolio.items():
-                    current_shares = temp_usd_portfolio.get(stock_code, 0)
-
-                    if target_shares > current_shares:
-                        # 購入が必要
-                        shares_to_buy = target_shares - current_shares
-
-                        price = get_stock_price_cached(stock_code, trade_date.strftime("%Y-%m-%d"))
-                        if price is not None and price > 0:
-                            buy_value_usd = shares_to_buy * price
-                            buy_cost_usd = calculate_trading_cost(buy_value_usd)
-                            total_cost_usd = buy_value_usd + buy_cost_usd
-
-                            # 現金が足りる場合のみ購入（ドル建て）
-                            if total_cost_usd <= usd_cash:
-                                usd_cash -= total_cost_usd
-                                usd_cash_for_purchases += total_cost_usd
-                                total_trading_cost += buy_cost_usd * exchange_rate  # 円換算
-
-                                # 取引履歴に記録
-                                trade_history.append({
-                                    'date': trade_date,
-                                    'vote_date': vote_date,
-                                    'stock_code': stock_code,
-                                    'stock_name': get_stock_name(stock_code),
-                                    'action': '購入',
-                                    'shares': shares_to_buy,
-                                    'price': price,
-                                    'value': buy_value_usd,  # ドル建て
-                                    'currency': 'USD',
-                                    'exchange_rate': exchange_rate,
-                                    'buy_price': price,
-                                    'sell_price': None
-                                })
-
-                                # 一時ポートフォリオを更新
-                                temp_usd_portfolio[stock_code] = target_shares
-                            else:
-                                # 現金が足りない場合は、購入できる分だけ購入
-                                available_shares = int((usd_cash * 0.99) / (price * (1 + TRADING_COSTS['commission_rate'] + TRADING_COSTS['slippage_rate'] + TRADING_COSTS['spread_rate'])))
-                                if available_shares > 0:
-                                    shares_to_buy = available_shares
-                                    buy_value_usd = shares_to_buy * price
-                                    buy_cost_usd = calculate_trading_cost(buy_value_usd)
-                                    total_cost_usd = buy_value_usd + buy_cost_usd
-
-                                    if total_cost_usd <= usd_cash:
-                                        usd_cash -= total_cost_usd
-                                        usd_cash_for_purchases += total_cost_usd
-                                        total_trading_cost += buy_cost_usd * exchange_rate  # 円換算
-
-                                        # 取引履歴に記録
-                                        trade_history.append({
-                                            'date': trade_date,
-                                            'vote_date': vote_date,
-                                            'stock_code': stock_code,
-                                            'stock_name': get_stock_name(stock_code),
-                                            'action': '購入',
-                                            'shares': shares_to_buy,
-                                            'price': price,
-                                            'value': buy_value_usd,  # ドル建て
-                                            'currency': 'USD',
-                                            'exchange_rate': exchange_rate,
-                                            'buy_price': price,
-                                            'sell_price': None
-                                        })
-
-                                        # 一時ポートフォリオを更新
-                                        temp_usd_portfolio[stock_code] = current_shares + shares_to_buy
-
-                # 米国株ポートフォリオを更新
-                usd_portfolio = temp_usd_portfolio.copy()
-
-        # 毎日の終値でポートフォリオ価値を計算して記録
-        # 当日の終値を取得
-        daily_jpy_prices = {}
-        daily_usd_prices = {}
-
-        # 日本株の終値を取得
-        for stock_code in jpy_portfolio.keys():
-            price = get_stock_price_cached(stock_code, current_date.strftime("%Y-%m-%d"))
-            if price is not None:
-                daily_jpy_prices[stock_code] = price
-
-        # 米国株の終値を取得
-        for stock_code in usd_portfolio.keys():
-            price = get_stock_price_cached(stock_code, current_date.strftime("%Y-%m-%d"))
-            if price is not None:
-                daily_usd_prices[stock_code] = price
-
-        # 終値でのポートフォリオ価値を計算（円換算）
-        daily_jpy_portfolio_value = calculate_portfolio_value(jpy_portfolio, daily_jpy_prices)
-        daily_usd_portfolio_value = calculate_portfolio_value(usd_portfolio, daily_usd_prices, exchange_rate)
-
-        # 当日の総資産価値を計算（すべて円換算）
-        daily_total_value = daily_jpy_portfolio_value + jpy_cash + daily_usd_portfolio_value + (usd_cash * exchange_rate if exchange_rate else 0)
-
-        # 日次損益率を計算
-        daily_pnl_rate = 0
-
-        # 前日終値との比較（取引日も含む）
-        # 取引日の場合は、取引による影響（実現損益など）も含まれる
-        if previous_total_value > 0:
-            daily_pnl_rate = ((daily_total_value - previous_total_value) / previous_total_value) * 100
-
-        # 結果を記録
-        simulation_results.append({
-            'date': current_date,
-            'vote_date': vote_date if is_trade_day else None,
-            'jpy_portfolio': jpy_portfolio.copy(),
-            'usd_portfolio': usd_portfolio.copy(),
-            'jpy_cash': jpy_cash,  # 円
-            'usd_cash': usd_cash,  # ドル
-            'total_value': daily_total_value,  # 円換算の総資産
-            'exchange_rate': exchange_rate,
-            'jpy_portfolio_value': daily_jpy_portfolio_value,  # 円
-            'usd_portfolio_value': daily_usd_portfolio_value,  # 円換算
-            'trading_cost': total_trading_cost if is_trade_day else 0,  # 円換算
-            'daily_pnl_rate': daily_pnl_rate,  # 日次損益率
-            'is_trade_day': is_trade_day  # 取引日フラグ
-        })
-
-        # 次の日のために前日の総資産価値を更新
-        previous_total_value = daily_total_value
-
-        current_date += timedelta(days=1)
-    
-    # プログレスバーを完了状態にする
-    progress_bar.progress(1.0)
-    final_days = (end_date - start_date).days + 1
-    status_text.text(f"完了: {end_date.strftime('%Y-%m-%d')} ({final_days}/{total_days}日, 100%)")
-    
-    return simulation_results, trade_history
-
-@st.cache_data(max_entries=20, ttl=3600)
-def calculate_monthly_pnl(simulation_results, year, month):
-    """
-    指定月の月次損益を計算
-
-    Parameters:
-    simulation_results (list): シミュレーション結果
-    year (int): 年
-    month (int): 月
-
-    Returns:
-    dict: {'pnl_rate': 損益率, 'pnl_amount': 損益額} または None
-    """
-    # 指定月のデータをフィルタリング
-    month_data = []
-    for result in simulation_results:
-        if result['date'].year == year and result['date'].month == month:
-            month_data.append(result)
-
-    if not month_data:
-        return None
-
-    # 日付でソート
-    month_data.sort(key=lambda x: x['date'])
-
-    # 月末の価値を取得
-    end_value = month_data[-1]['total_value']
-
-    # 月初の価値を取得（前月末の価値、なければ月初の1日前の想定値）
-    # シミュレーション結果全体から前月末の価値を探す
-    start_value = None
-    month_start_date = month_data[0]['date']
-
-    # 前日の価値を探す
-    for result in simulation_results:
-        if result['date'] < month_start_date:
-            start_value = result['total_value']
-        else:
-            break
-
-    # 前日の価値が見つからない場合は、月初の最初の日の価値を使用
-    if start_value is None:
-        start_value = month_data[0]['total_value']
-
-    # 損益率と損益額を計算
-    if start_value > 0:
-        pnl_amount = end_value - start_value
-        pnl_rate = (pnl_amount / start_value) * 100
-        return {
-            'pnl_rate': pnl_rate,
-            'pnl_amount': pnl_amount
-        }
-
-    return None
+# 計算はutils.simulationで行い、このページでは表示とキャッシュだけを担う
+calculate_monthly_pnl = st.cache_data(max_entries=20, ttl=3600)(simulation.calculate_monthly_pnl)
+calculate_pnl_breakdown = st.cache_data(max_entries=20, ttl=3600)(simulation.calculate_pnl_breakdown)
 
 def create_calendar_heatmap(simulation_results, trade_history, year, month):
     """カレンダー形式のヒートマップを作成（実現損益 + 含み損益）"""
@@ -1235,68 +219,6 @@ def create_yearly_summary(simulation_results, year):
 
     return df
 
-def calculate_risk_metrics(simulation_results):
-    """リスク指標を計算"""
-    if len(simulation_results) < 2:
-        return {}
-    
-    values = [result['total_value'] for result in simulation_results]
-    
-    # 日次リターンを計算
-    daily_returns = []
-    for i in range(1, len(values)):
-        if values[i-1] > 0:
-            daily_return = (values[i] - values[i-1]) / values[i-1]
-            # 極端に大きな日次リターンを制限（±50%）
-            if daily_return > 0.5:
-                daily_return = 0.5
-            elif daily_return < -0.5:
-                daily_return = -0.5
-            daily_returns.append(daily_return)
-    
-    if not daily_returns:
-        return {}
-    
-    # 年率リターン
-    total_return = (values[-1] - values[0]) / values[0] if values[0] > 0 else 0
-    days = len(simulation_results)
-    
-    # オーバーフローを防ぐため、極端に大きなリターンの場合は制限
-    if total_return > 10:  # 1000%を超える場合は制限
-        total_return = 10
-    elif total_return < -0.9:  # -90%を下回る場合は制限
-        total_return = -0.9
-    
-    try:
-        annual_return = (1 + total_return) ** (365 / days) - 1 if days > 0 else 0
-    except OverflowError:
-        # オーバーフローが発生した場合は安全な値を使用
-        annual_return = 10 if total_return > 0 else -0.9
-    
-    # 年率ボラティリティ
-    daily_volatility = np.std(daily_returns)
-    annual_volatility = daily_volatility * np.sqrt(365)
-    
-    # シャープレシオ
-    sharpe_ratio = (annual_return - RISK_FREE_RATE) / annual_volatility if annual_volatility > 0 else 0
-    
-    # 最大ドローダウン
-    peak = values[0]
-    max_drawdown = 0
-    for value in values:
-        if value > peak:
-            peak = value
-        drawdown = (peak - value) / peak
-        max_drawdown = max(max_drawdown, drawdown)
-    
-    return {
-        'annual_return': annual_return * 100,
-        'annual_volatility': annual_volatility * 100,
-        'sharpe_ratio': sharpe_ratio,
-        'max_drawdown': max_drawdown * 100,
-        'total_trades': len(simulation_results)
-    }
-
 def create_performance_chart(simulation_results, initial_investment):
     """パフォーマンス推移チャートを作成"""
     if not simulation_results:
@@ -1369,9 +291,6 @@ def create_performance_chart(simulation_results, initial_investment):
     return fig
 
 def show(selected_date):
-    # 株価キャッシュテーブルを初期化
-    init_price_cache_table()
-
     st.title("投資シミュレーション")
 
     # 設定パネル
@@ -1454,16 +373,36 @@ def show(selected_date):
         if start_date > end_date:
             st.error("開始日は終了日より前である必要があります。")
         else:
+            if not (is_calendar_covered(start_date) and is_calendar_covered(end_date)):
+                st.warning("期間の一部が休場日テーブル(data/market_holidays.csv)の収録範囲外のため、土日のみを休場日として扱います。")
             with st.spinner("シミュレーションを実行中..."):
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+
+                def on_progress(days_elapsed, total_days, current_date):
+                    progress = min(days_elapsed / total_days, 1.0)
+                    progress_bar.progress(progress)
+                    status_text.text(f"処理中: {current_date.strftime('%Y-%m-%d')} ({days_elapsed}/{total_days}日, {progress*100:.1f}%)")
+
                 try:
-                    simulation_results, trade_history = simulate_investment(
+                    result = simulate_investment(
                         start_date,
                         end_date,
                         initial_jpy,
                         initial_usd,
                         jpy_allocation_ratios,
-                        usd_allocation_ratios
+                        usd_allocation_ratios,
+                        on_progress=on_progress
                     )
+                    simulation_results = result['simulation_results']
+                    trade_history = result['trade_history']
+
+                    # プログレスバーを完了状態にする
+                    total_days = (end_date - start_date).days + 1
+                    progress_bar.progress(1.0)
+                    status_text.text(f"完了: {end_date.strftime('%Y-%m-%d')} ({total_days}/{total_days}日, 100%)")
+                    if result['skipped_days']:
+                        st.warning(f"為替レートを取得できなかった{result['skipped_days']}日は評価から除外しました。")
 
                     if simulation_results:
                         st.session_state.simulation_results = simulation_results
@@ -1980,127 +919,3 @@ def show(selected_date):
             file_name=f"pnl_detail_{start_date.strftime('%Y%m%d')}.csv",
             mime='text/csv',
         )
-
-@st.cache_data(max_entries=20, ttl=3600)
-def calculate_pnl_breakdown(simulation_results, trade_history):
-    """
-    シミュレーション結果と取引履歴から、日別の実現損益・含み損益の内訳を計算する。
-    実現損益は「平均取得単価」法を用いて計算する。
-    
-    Args:
-        simulation_results (list): シミュレーション結果のリスト
-        trade_history (list): 取引履歴のリスト
-        
-    Returns:
-        dict: {date_obj: {
-            'total_pnl': float,
-            'realized_pnl': float,
-            'unrealized_pnl': float,
-            'realized_detail': list,
-            'unrealized_detail': list,
-            'daily_pnl_rate': float
-        }}
-    """
-    daily_pnl_data = {}
-    
-    # 日付順にソート
-    sorted_results = sorted(simulation_results, key=lambda x: x['date'])
-    sorted_trades = sorted(trade_history, key=lambda x: x['date'])
-    
-    # 状態管理用変数
-    holdings = {} # {stock_code: {'shares': 0, 'total_cost': 0, 'currency': 'JPY'/'USD'}}
-    cumulative_realized_pnl = 0
-    
-    # 前日の累積値を保持
-    prev_realized_pnl = 0
-    prev_unrealized_pnl = 0
-    
-    trade_idx = 0
-    
-    for result in sorted_results:
-        date_current = result['date']
-        date_str = date_current.strftime('%Y-%m-%d')
-        
-        realized_detail = []
-        
-        # 当日（またはそれ以前）の取引を処理
-        while trade_idx < len(sorted_trades) and sorted_trades[trade_idx]['date'] <= date_current:
-            trade = sorted_trades[trade_idx]
-            stock_code = trade['stock_code']
-            
-            if stock_code not in holdings:
-                holdings[stock_code] = {'shares': 0, 'total_cost': 0, 'currency': trade['currency']}
-            
-            if trade['action'] == '購入':
-                # 平均取得単価の計算のためにコストを加算
-                holdings[stock_code]['shares'] += trade['shares']
-                cost = trade['price'] * trade['shares']
-                if trade['currency'] == 'USD' and trade.get('exchange_rate'):
-                    cost *= trade['exchange_rate']
-                holdings[stock_code]['total_cost'] += cost
-                
-            elif trade['action'] == '売却':
-                if holdings[stock_code]['shares'] > 0:
-                    # 平均取得単価を計算
-                    avg_cost = holdings[stock_code]['total_cost'] / holdings[stock_code]['shares']
-                    
-                    # 実現損益を計算: (売却額 - 平均コスト * 売却株数)
-                    sell_value = trade['price'] * trade['shares']
-                    if trade['currency'] == 'USD' and trade.get('exchange_rate'):
-                        sell_value *= trade['exchange_rate']
-                    
-                    pnl = sell_value - (avg_cost * trade['shares'])
-                    cumulative_realized_pnl += pnl
-                    
-                    # 詳細を記録
-                    if trade['date'] == date_current:
-                        realized_detail.append({
-                            'stock_code': stock_code,
-                            'pnl': pnl
-                        })
-                    
-                    # 保有状況を更新（比例配分で減少）
-                    sell_ratio = trade['shares'] / holdings[stock_code]['shares']
-                    holdings[stock_code]['shares'] -= trade['shares']
-                    holdings[stock_code]['total_cost'] *= (1 - sell_ratio)
-            
-            trade_idx += 1
-            
-        # 含み損益の計算
-        cumulative_unrealized_pnl = 0
-        unrealized_detail = []
-        
-        for stock_code, holding in holdings.items():
-            if holding['shares'] > 0:
-                price = get_stock_price_cached(stock_code, date_str)
-                if price is not None and price > 0:
-                    current_value = price * holding['shares']
-                    if holding['currency'] == 'USD' and result.get('exchange_rate'):
-                        current_value *= result['exchange_rate']
-                    
-                    pnl = current_value - holding['total_cost']
-                    cumulative_unrealized_pnl += pnl
-                    
-                    unrealized_detail.append({
-                        'stock_code': stock_code,
-                        'pnl': pnl
-                    })
-        
-        # 日次変化を計算
-        daily_realized = cumulative_realized_pnl - prev_realized_pnl
-        daily_unrealized = cumulative_unrealized_pnl - prev_unrealized_pnl
-        total_change = daily_realized + daily_unrealized
-        
-        daily_pnl_data[date_current] = {
-            'total_pnl': total_change,
-            'realized_pnl': daily_realized,
-            'unrealized_pnl': daily_unrealized,
-            'realized_detail': realized_detail,
-            'unrealized_detail': unrealized_detail,
-            'daily_pnl_rate': result.get('daily_pnl_rate', 0)
-        }
-        
-        prev_realized_pnl = cumulative_realized_pnl
-        prev_unrealized_pnl = cumulative_unrealized_pnl
-        
-    return daily_pnl_data
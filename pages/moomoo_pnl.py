@@ -1,335 +1,22 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
-from datetime import datetime, timedelta
-import pytz
-import plotly.express as px
 import plotly.graph_objects as go
-from utils.db import get_connection
+from utils.moomoo_pnl import build_pnl_results, calculate_pnl, parse_moomoo_csv
+from utils import chatwork
+from utils.moomoo_store import delete_account, import_trades, load_trades, list_accounts, make_account_key
 
-# 定数
-TRADING_FEES_RATE = 0.0  # 必要に応じて調整
-TAX_RATE = 0.0 # 必要に応じて調整
-DEFAULT_EXCHANGE_RATE = 150.0  # 為替レート取得失敗時のデフォルト値
-QUANTITY_TOLERANCE = 0.0001  # 数量の誤差許容範囲
-
-def get_exchange_rate(date_str):
-    """
-    指定日のUSD/JPY為替レートを取得する関数（簡易キャッシュ）
-    """
-    try:
-        # yfinanceで取得
-        ticker = "USDJPY=X"
-        start_date = (pd.Timestamp(date_str) - pd.Timedelta(days=5)).strftime("%Y-%m-%d")
-        end_date = (pd.Timestamp(date_str) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
-        
-        df = yf.download(ticker, start=start_date, end=end_date, progress=False, auto_adjust=True)
-        
-        if df.empty:
-            return DEFAULT_EXCHANGE_RATE  # デフォルト値（エラー時）
-
-        # 指定日以前の最新のデータを取得
-        target_ts = pd.Timestamp(date_str)
-        valid_rows = df[df.index <= target_ts]
-        
-        if not valid_rows.empty:
-            close_value = valid_rows['Close'].iloc[-1]
-            # MultiIndex列の場合やSeriesの場合に対応
-            if hasattr(close_value, 'item'):
-                return float(close_value.item())
-            return float(close_value)
-        
-        return DEFAULT_EXCHANGE_RATE
-    except Exception as e:
-        # st.error(f"為替レート取得エラー: {e}")
-        return DEFAULT_EXCHANGE_RATE
-
-def get_current_price(ticker):
-    """
-    現在の株価を取得
+def get_account_owner():
     """
-    try:
-        # 日本株の場合（先頭文字が数字なら日本株として扱う）
-        if ticker[0].isdigit():
-            yf_ticker = f"{ticker}.T"
-        else:
-            yf_ticker = ticker
-            
-        stock = yf.Ticker(yf_ticker)
-        history = stock.history(period="1d")
-        if not history.empty:
-            close_value = history['Close'].iloc[-1]
-            # MultiIndex列の場合やSeriesの場合に対応
-            if hasattr(close_value, 'item'):
-                return float(close_value.item())
-            return float(close_value)
-        return None
-    except Exception:
-        return None
+    約定履歴の所有者（ChatWorkのアカウントID。セッションをまたいで同じ口座を使える）
 
-def parse_moomoo_csv(file):
+    ログインしていない場合はNone（セッションが終わると誰も参照・削除できなくなるため、約定は保存しない）。
     """
-    moomoo証券のCSVを解析する
-    """
-    try:
-        # CSVを読み込む（エンコーディングはShift-JISまたはUTF-8を想定）
-        # ファイルポインタを先頭に戻す
-        file.seek(0)
-        try:
-            df = pd.read_csv(file, encoding='shift_jis')
-        except UnicodeDecodeError:
-            file.seek(0)  # 再度先頭に戻す
-            df = pd.read_csv(file, encoding='utf-8')
-
-        # 必要なカラムが存在するか確認
-        required_columns = ['売買方向', '銘柄コード', '銘柄名', '注文状況', '約定数量', '約定価格', '約定日時', '通貨', '取引手数料', '消費税']
-        # カラム名の空白削除などの正規化
-        df.columns = [c.strip() for c in df.columns]
-        
-        # データ処理用のリスト
-        trades = []
-        
-        # 前行のデータを保持する変数（分割約定用）
-        last_valid_row = None
-        
-        for index, row in df.iterrows():
-            # 注文状況が「約定済」または空欄（分割約定の続き）の場合のみ処理
-            status = str(row['注文状況']).strip() if pd.notna(row['注文状況']) else ""
-            
-            # 約定数量がある行を有効な約定データとみなす
-            exec_qty = row['約定数量']
-            if pd.isna(exec_qty) or str(exec_qty).strip() == "":
-                continue
-                
-            try:
-                qty = float(str(exec_qty).replace(',', ''))
-            except ValueError:
-                continue
-                
-            if qty <= 0:
-                continue
-
-            # 親注文情報の補完
-            if status == "約定済":
-                last_valid_row = row
-            elif status == "" and last_valid_row is not None:
-                # 空欄の場合は前の行の情報を引き継ぐべき項目をコピー
-                # ただし、約定ごとの固有情報（数量、価格、日時など）は現在の行を使用
-                pass
-            else:
-                # 約定済でも分割の続きでもない（例：取消済など）はスキップ
-                continue
-
-            # データの抽出（親行の情報が必要な場合はlast_valid_rowを使用）
-            current_row_source = row if status == "約定済" else row
-            parent_row_source = last_valid_row if last_valid_row is not None else row
-            
-            # 銘柄コード、売買方向、通貨は親行から取得
-            ticker = str(parent_row_source['銘柄コード']).strip()
-            name = str(parent_row_source['銘柄名']).strip()
-            side = str(parent_row_source['売買方向']).strip()
-            currency = str(parent_row_source['通貨']).strip()
-            
-            # 約定価格、約定日時は現在の行から取得
-            try:
-                price = float(str(row['約定価格']).replace(',', ''))
-            except ValueError:
-                price = 0.0
-                
-            date_str = str(row['約定日時']).strip()
-            
-            # 手数料などは、行ごとに記載があれば加算、なければ親行につく場合もあるが、
-            # サンプルを見ると各行に手数料が書いてあるわけではなさそう？
-            # サンプル: Line 2 (約定済) has fees. Line 27 (約定済, split parent) has fees?
-            # Line 27: fees 0. Line 28: fees empty.
-            # 手数料は「約定済」の行にまとめて記載されている場合と、各約定にある場合があるかもしれない。
-            # 今回は行にある数値をそのまま使う。
-            
-            fee = 0.0
-            if '取引手数料' in row and pd.notna(row['取引手数料']) and str(row['取引手数料']).strip() != "":
-                fee += float(str(row['取引手数料']).replace(',', ''))
-            if '消費税' in row and pd.notna(row['消費税']) and str(row['消費税']).strip() != "":
-                fee += float(str(row['消費税']).replace(',', ''))
-            if 'システム利用料' in row and pd.notna(row['システム利用料']) and str(row['システム利用料']).strip() != "":
-                fee += float(str(row['システム利用料']).replace(',', ''))
-
-            # 日付のパース (ET/JSTの処理)
-            # 2025/11/25 08:38:23 ET -> 2025-11-25 08:38:23
-            try:
-                # タイムゾーン部分（ET/JST）を除去してパース
-                # 例: "2025/11/25 08:38:23 ET" -> "2025/11/25 08:38:23"
-                date_str_clean = date_str.replace(' ET', '').replace(' JST', '').strip()
-                trade_datetime = datetime.strptime(date_str_clean, "%Y/%m/%d %H:%M:%S")
-                trade_date = trade_datetime.date()
-            except ValueError:
-                # 時刻がない場合は日付のみ
-                try:
-                    date_part = date_str.split(' ')[0]
-                    trade_date = datetime.strptime(date_part, "%Y/%m/%d").date()
-                    trade_datetime = datetime.combine(trade_date, datetime.min.time())
-                except ValueError:
-                    continue
-
-            trades.append({
-                'date': trade_date,
-                'datetime': trade_datetime,  # ソート用に日時も保存
-                'ticker': ticker,
-                'name': name,
-                'side': side,
-                'currency': currency,
-                'qty': qty,
-                'price': price,
-                'fee': fee,
-                'original_line': index + 2 # 1-based index for header + 1
-            })
-            
-        return pd.DataFrame(trades)
-        
-    except Exception as e:
-        st.error(f"CSV読み込みエラー: {e}")
-        return pd.DataFrame()
-
-def calculate_pnl(df):
-    """
-    損益計算を行う
-    """
-    if df.empty:
-        return [], [], []
-
-    # 日時順にソート（古い順）- 同日の取引も正しい順序で処理
-    df = df.sort_values('datetime')
-    
-    # 保有ポジション {ticker: {'qty': 0, 'total_cost': 0.0, 'avg_cost': 0.0}}
-    holdings = {}
-    
-    realized_pnl = []
-    warnings = []  # 警告情報を記録
-    
-    for _, row in df.iterrows():
-        ticker = row['ticker']
-        side = row['side']
-        qty = row['qty']
-        price = row['price']
-        fee = row['fee']
-        currency = row['currency']
-        date = row['date']
-        
-        if ticker not in holdings:
-            holdings[ticker] = {'qty': 0, 'total_cost': 0.0, 'avg_cost': 0.0, 'currency': currency, 'name': row['name']}
-            
-        position = holdings[ticker]
-        
-        if side == '買い':
-            # 取得コスト計算（手数料含む）
-            cost = (price * qty) + fee
-            position['qty'] += qty
-            position['total_cost'] += cost
-            if position['qty'] > 0:
-                position['avg_cost'] = position['total_cost'] / position['qty']
-                
-        elif side == '売り':
-            if position['qty'] > 0:
-                # 売却コスト（手数料引く前の売却額 - コスト）
-                # 実現損益 = (売却単価 - 平均取得単価) * 数量 - 手数料
-                
-                # 売却前の平均取得単価を保存
-                avg_cost_at_sell = position['avg_cost']
-                
-                # 平均取得単価に基づくコスト
-                cost_basis = position['avg_cost'] * qty
-                
-                # 売却額
-                sell_proceeds = (price * qty)
-                
-                # 損益 (現地通貨ベース)
-                pnl_local = sell_proceeds - cost_basis - fee
-                
-                # 残高更新
-                position['qty'] -= qty
-                position['total_cost'] -= cost_basis # 平均法なので比例配分で減らす
-                
-                # 誤差修正（数量0ならコストも0）
-                if abs(position['qty']) < QUANTITY_TOLERANCE:
-                    position['qty'] = 0
-                    position['total_cost'] = 0
-                    position['avg_cost'] = 0
-                
-                # 円換算
-                rate = 1.0
-                if currency == 'USD':
-                    rate = get_exchange_rate(date.strftime("%Y-%m-%d"))
-                
-                pnl_jpy = pnl_local * rate
-                
-                realized_pnl.append({
-                    'month': date.strftime("%Y-%m"),
-                    'date': date,
-                    'ticker': ticker,
-                    'name': row['name'],
-                    'qty': qty,
-                    'avg_cost': avg_cost_at_sell,  # 売却前の平均取得単価
-                    'sell_price': price,
-                    'currency': currency,
-                    'pnl_local': pnl_local,
-                    'pnl_jpy': pnl_jpy,
-                    'rate': rate
-                })
-            else:
-                # 買い情報がない状態で売りが発生（データ欠損）
-                warnings.append({
-                    'type': '買い情報欠損',
-                    'ticker': ticker,
-                    'name': row['name'],
-                    'date': date,
-                    'qty': qty,
-                    'message': f'銘柄 {ticker}({row["name"]}) の売り注文に対応する買い情報がありません（{date}, {qty}株）'
-                })
-
-    # 含み損益計算
-    unrealized_pnl = []
-    current_rate = get_exchange_rate(datetime.now().strftime("%Y-%m-%d"))
-    
-    for ticker, pos in holdings.items():
-        if pos['qty'] > QUANTITY_TOLERANCE:
-            current_price = get_current_price(ticker)
-            
-            if current_price is not None:
-                market_value_local = current_price * pos['qty']
-                cost_basis_local = pos['total_cost']
-                pnl_local = market_value_local - cost_basis_local
-                
-                rate = 1.0
-                if pos['currency'] == 'USD':
-                    rate = current_rate
-                    
-                market_value_jpy = market_value_local * rate
-                cost_basis_jpy = cost_basis_local * rate
-                pnl_jpy = pnl_local * rate
-                
-                unrealized_pnl.append({
-                    'ticker': ticker,
-                    'name': pos['name'],
-                    'qty': pos['qty'],
-                    'avg_cost': pos['avg_cost'],
-                    'current_price': current_price,
-                    'market_value_jpy': market_value_jpy,
-                    'cost_basis_jpy': cost_basis_jpy,
-                    'pnl_jpy': pnl_jpy,
-                    'currency': pos['currency']
-                })
-            else:
-                # 株価取得失敗
-                warnings.append({
-                    'type': '株価取得失敗',
-                    'ticker': ticker,
-                    'name': pos['name'],
-                    'qty': pos['qty'],
-                    'avg_cost': pos['avg_cost'],
-                    'currency': pos['currency'],
-                    'message': f'銘柄 {ticker}({pos["name"]}) の現在株価を取得できませんでした（保有: {pos["qty"]}株）'
-                })
-                
-    return realized_pnl, unrealized_pnl, warnings
+    if 'moomoo_account_owner' not in st.session_state:
+        profile = chatwork.get_my_profile() if chatwork.is_logged_in() else None
+        if not profile or not profile.get('account_id'):
+            return None
+        st.session_state['moomoo_account_owner'] = f"chatwork:{profile['account_id']}"
+    return st.session_state['moomoo_account_owner']
 
 def show(selected_date=None):
     st.title("moomoo証券 損益分析")
@@ -340,16 +27,58 @@ def show(selected_date=None):
     - 含み損益は現在の株価と為替レートで計算されます。
     """)
     
+    # ログインしている場合は約定をユーザーの口座ごとに保存し、期間が重なるCSVを再アップロードしても新しい約定だけを追加する
+    owner = get_account_owner()
+    account = None
+    has_saved_trades = False
+    if owner is None:
+        st.caption("ChatWorkにログインしていないため、取引履歴は保存せず、アップロードしたCSVだけで計算します。")
+    else:
+        saved_accounts = {name: (count, last_trade) for name, count, last_trade in list_accounts(owner)}
+        account_name = st.text_input(
+            "口座名",
+            value=next(iter(saved_accounts), ""),
+            placeholder="例: メイン口座",
+            help="口座ごとに取引履歴を保存します"
+        ).strip()
+        if not account_name:
+            st.info("口座名を入力してください。")
+            return
+        account = make_account_key(owner, account_name)
+        if account_name in saved_accounts:
+            count, last_trade = saved_accounts[account_name]
+            st.caption(f"保存済みの約定: {count:,}件（最終約定: {last_trade}）")
+            has_saved_trades = True
+            with st.expander("保存済みの約定を削除"):
+                st.write("誤ったCSVを取り込んだ場合などに、この口座の約定をすべて削除します。")
+                confirmed = st.checkbox(f"口座「{account_name}」の約定{count:,}件を削除する")
+                if st.button("削除", disabled=not confirmed):
+                    deleted = delete_account(account)
+                    st.success(f"{deleted:,}件の約定を削除しました")
+                    has_saved_trades = False
+
     uploaded_file = st.file_uploader("取引履歴CSVをアップロード", type=['csv'])
     
-    if uploaded_file is not None:
+    if uploaded_file is not None or has_saved_trades:
         if st.button("計算実行"):
             with st.spinner("計算中..."):
-                df = parse_moomoo_csv(uploaded_file)
+                parsed = pd.DataFrame()
+                if uploaded_file is not None:
+                    try:
+                        parsed = parse_moomoo_csv(uploaded_file)
+                    except ValueError as e:
+                        st.error(str(e))
+
+                if account is None:
+                    # 保存せずにアップロードしたCSVの約定だけで計算
+                    realized, unrealized, warnings = calculate_pnl(parsed)
+                else:
+                    if not parsed.empty:
+                        summary = import_trades(account, parsed)
+                        st.info(f"新しい約定を{summary['added']:,}件保存しました（保存済みの{summary['skipped']:,}件はスキップ）")
+                    realized, unrealized, warnings = build_pnl_results(load_trades(account))
                 
-                if not df.empty:
-                    # st.dataframe(df) # デバッグ用
-                    realized, unrealized, warnings = calculate_pnl(df)
+                if realized or unrealized or warnings:
                     
                     # --- 警告情報 ---
                     if warnings:
@@ -360,9 +89,11 @@ def show(selected_date=None):
                                     st.warning(f"📉 **{w['type']}**: {w['ticker']} ({w['name']}) - 保有: {w['qty']}株, 平均取得単価: {w['avg_cost']:,.2f} {w['currency']}")
                                 elif w['type'] == '買い情報欠損':
                                     st.error(f"🚨 **{w['type']}**: {w['ticker']} ({w['name']}) - 日付: {w['date']}, 数量: {w['qty']}株")
+                                elif w['type'] == '為替レート取得失敗':
+                                    st.warning(f"💱 **{w['type']}**: {w['ticker']} ({w['name']}) - {w['message']}")
                     
-                    # --- 年初来サマリー ---
-                    st.header("📈 年初来サマリー")
+                    # --- 損益サマリー（保存済みの約定の全期間） ---
+                    st.header("📈 損益サマリー")
                     
                     # 実現損益合計
                     total_realized = sum([r['pnl_jpy'] for r in realized]) if realized else 0
@@ -434,7 +165,7 @@ def show(selected_date=None):
                             st.markdown(f"**勝率**: {us_win_rate:.1f}% ({us_wins}/{us_trades})")
                             st.markdown(f"**RR比率**: {us_rr:.2f}")
                     
-                    # --- 年初来累計損益の折れ線グラフ ---
+                    # --- 累計損益の折れ線グラフ ---
                     if realized:
                         df_realized = pd.DataFrame(realized)
                         # 日付順にソート
@@ -456,7 +187,7 @@ def show(selected_date=None):
                             df_us = df_us.sort_values('date')
                             df_us['cumulative_pnl_man'] = (df_us['pnl_jpy'].cumsum() / 10000).round(0)
                         
-                        st.subheader("年初来実現損益の推移")
+                        st.subheader("累計実現損益の推移")
                         fig_cumulative = go.Figure()
                         
                         # 全体の累計損益
@@ -3,8 +3,7 @@ import streamlit as st
 import altair as alt
 import datetime
 import pandas as pd
-import re
-from utils.db import get_connection
+from utils import vote_trends
 
 # 取得・表示の最大日数 (DB負荷考慮)
 MAX_DAYS=365
@@ -43,97 +42,35 @@ def draw_altair_line(df, value_col="投票数"):
     return chart
 
 
-## 期間がひらいて再度投票された時に無投票期間をNaN埋めしておく。
-def expand_on_vote_days(df, vote_days):
-    result = []
+@st.cache_data(ttl=None, max_entries=8)  # 投票データのバージョンが変わるまでキャッシュ有効
+def get_vote_matrix(start_date_str, end_date_str, market, data_version):
+    """市場ごとの 日付 × 銘柄 の投票数の行列（data_version はキャッシュのキー）"""
+    return vote_trends.build_vote_matrix(vote_trends.load_vote_counts(start_date_str, end_date_str, market))
 
-    for code, g in df.groupby("銘柄コード"):
-        g = g.set_index("日付").sort_index()
 
-        # 投票日だけを軸に reindex
-        g = g.reindex(vote_days)
-
-        g["銘柄コード"] = code
-        result.append(g.reset_index(names="日付"))
-
-    out = pd.concat(result, ignore_index=True)
-    return out
+@st.cache_data(ttl=None, max_entries=8)
+def get_vote_totals(start_date_str, end_date_str, data_version):
+    """投票日ごとの投票数の合計と投票ボタンが押された回数（data_version はキャッシュのキー）"""
+    return vote_trends.load_vote_totals(start_date_str, end_date_str)
 
 
 def show(selected_date):
     selected_date_str = selected_date.strftime("%Y-%m-%d")
+    range_start_str = (selected_date - datetime.timedelta(days=MAX_DAYS)).strftime("%Y-%m-%d")
 
     st.title("投票結果の推移")
     st.write(f"【投票日】{selected_date_str}")
 
-    # REGEXPを使うための関数を定義
-    def regexp(pattern, string):
-        return bool(re.match(pattern, string))
-
-    sql_template = """
-        SELECT a.vote_date, a.stock_code || ' ' || COALESCE(b.stock_name, ''), count(a.stock_code) AS vote_count
-         FROM vote AS a LEFT OUTER JOIN stock_master AS b ON a.stock_code = b.stock_code WHERE a.vote_date BETWEEN ? AND ? 
-         AND a.stock_code REGEXP ?
-         GROUP BY a.vote_date, a.stock_code;
-    """
-
-    # voteテーブルから、各投票回の投票数を取得する
-    conn = get_connection()
-
-    # REGEXP関数をSQLiteに登録
-    conn.create_function('REGEXP', 2, regexp)
-
-    # 日本株 (数字始まり)
-    c = conn.cursor()
-    c.execute(
-        sql_template,
-        ((selected_date - datetime.timedelta(days=MAX_DAYS)).strftime("%Y-%m-%d"),
-         selected_date_str,
-         "^[0-9]+"
-        )
-    )
-    results_jp = c.fetchall()
-
-    # 米国株 (英字始まり)
-    c = conn.cursor()
-    c.execute(
-        sql_template,
-        ((selected_date - datetime.timedelta(days=MAX_DAYS)).strftime("%Y-%m-%d"),
-         selected_date_str,
-         "^[A-Z]+"
-        )
-    )
-    results_us = c.fetchall()
-
-    # 投票数の合計と投票ボタンが押された回数を取得 (#13の追従)
-    sql_template = """
-        SELECT a.vote_date, COUNT(a.id) as total_votes, COUNT(DISTINCT a.created_at) as vote_sessions
-         FROM vote AS a
-         WHERE a.vote_date BETWEEN ? AND ?
-         GROUP BY a.vote_date ORDER BY a.vote_date ASC;
-    """
-    c = conn.cursor()
-    c.execute(
-        sql_template,
-        ((selected_date - datetime.timedelta(days=MAX_DAYS)).strftime("%Y-%m-%d"),
-         selected_date_str
-        )
-    )
-    results_vote_count = c.fetchall()
-    conn.close()
-
-    if results_jp or results_us:
-        # 投票結果をキャッシュキーとして使用
-        @st.cache_data(ttl=None)  # TTLなし（投票結果が変わるまでキャッシュ有効）
-
-        # DataFrameに変換
-        def convert_to_df(vote_results):
-            df = pd.DataFrame(vote_results, columns=["日付", "銘柄コード", "投票数"])
-            df["日付"] = pd.to_datetime(df["日付"])  # 日付をDatetime型に変換
-            return df
+    # 投票が変わったときだけ集計し直す（行列は期間・市場ごとに1回だけ作る）
+    data_version = vote_trends.get_vote_data_version(range_start_str, selected_date_str)
+    matrices = {
+        market: get_vote_matrix(range_start_str, selected_date_str, market, data_version)
+        for market in ("JP", "US")
+    }
 
+    if any(not matrix.empty for matrix in matrices.values()):
         # スライダーで日付範囲を選択
-        dates = pd.date_range(start = (selected_date - datetime.timedelta(days=MAX_DAYS)).strftime("%Y-%m-%d"), end = selected_date_str, freq = "D")
+        dates = pd.date_range(start = range_start_str, end = selected_date_str, freq = "D")
         default_start_date = max(dates.min(), pd.Timestamp(selected_date) - pd.Timedelta(days=DEFAULT_DAYS))
 
         # スライダー用意
@@ -146,46 +83,47 @@ def show(selected_date):
         )
 
         result_list = [
-            {"result_key": "日本株", "result_value": results_jp},
-            {"result_key": "米国株", "result_value": results_us}
+            {"result_key": "日本株", "market": "JP"},
+            {"result_key": "米国株", "market": "US"}
         ]
 
-        df = None
         for result in result_list:
             st.subheader(result["result_key"])
-            df = convert_to_df(result["result_value"])
+            matrix = matrices[result["market"]]
 
-            # スライダー期間でフィルタ
-            filtered_df = df[
-              (df["日付"] >= pd.to_datetime(start_date))
-              & (df["日付"] <= pd.to_datetime(end_date))
-            ].copy()
-
-            # 無投票銘柄を NaN で補完 (期間がひらいて投票された銘柄対応)
-            vote_days = (filtered_df["日付"].drop_duplicates().sort_values())
-            filtered_df = expand_on_vote_days(filtered_df, vote_days)
+            # スライダー期間で切り出し（無投票の日はNaNのまま残る）
+            window = vote_trends.slice_vote_matrix(matrix, start_date, end_date)
 
             options = st.multiselect(
               "銘柄コードを選択してください:",
-              sorted(df["銘柄コード"].unique().tolist()),
-              default=[]
+              sorted(matrix.columns.tolist()),
+              default=[],
+              key=f"vote_trend_codes_{result['market']}"
             )
 
+            value_col = "投票数"
             if options:
-              filtered_df = filtered_df[filtered_df["銘柄コード"].isin(options)]
+              # 選択した銘柄は日ごとの投票数をそのまま描画する
+              filtered_df = vote_trends.melt_vote_matrix(window, options)
+            else:
+              # 選択がない場合は上位の銘柄と「その他」に絞り、期間が長ければ週ごとにまとめる
+              filtered_df, value_col, codes = vote_trends.reduce_vote_matrix(window)
+              notes = []
+              if len(window.columns) > len(codes):
+                notes.append(f"期間内の投票数上位{len(codes)}銘柄と、残り{len(window.columns) - len(codes)}銘柄の合計（その他）を表示しています")
+              if value_col != "投票数":
+                notes.append("期間が長いため週ごとの合計で表示しています")
+              if notes:
+                st.caption("。".join(notes) + "。日ごとの推移は銘柄を選択してください。")
 
             if filtered_df.empty:
               st.info("この期間に表示できるデータがありません")
             else:
-              chart = draw_altair_line(filtered_df)
+              chart = draw_altair_line(filtered_df, value_col)
               st.altair_chart(chart, use_container_width=True)
 
         # 投票数の合計と投票ボタンが押された回数の表示 (#13の追従)
-        df_vote = pd.DataFrame(
-            results_vote_count,
-            columns=["日付", "投票数の合計", "投票ボタンが押された回数"]
-        )
-        df_vote["日付"] = pd.to_datetime(df_vote["日付"])
+        df_vote = get_vote_totals(range_start_str, selected_date_str, data_version)
 
         filtered_df_vote = df_vote[
             (df_vote["日付"] >= pd.to_datetime(start_date))
@@ -4,17 +4,19 @@ import yfinance as yf
 from datetime import datetime, timedelta
 from utils.common import get_ticker, get_stock_name
 from utils.db import get_connection
-from io import BytesIO
-import mplfinance as mpf
-import matplotlib
+from utils import chart_render
+from utils import exports
+from utils import metrics
+from utils import session_store
 import os
-import zipfile
-from matplotlib.font_manager import FontProperties
-from functools import lru_cache
-from openpyxl.styles import numbers
 
 def init_session_state():
-    """セッション状態の初期化"""
+    """
+    セッション状態の初期化
+
+    stock_data（{銘柄コード: ハンドル}）と charts（{銘柄コード: {'handle', 'type'}}）には
+    utils.session_store のハンドルだけを保存し、DataFrameとPNGは保管場所に置く。
+    """
     if 'stock_data' not in st.session_state:
         st.session_state['stock_data'] = {}
     if 'charts' not in st.session_state:
@@ -28,10 +30,16 @@ def init_session_state():
     if 'direct_input_codes_area' not in st.session_state:
         st.session_state['direct_input_codes_area'] = ""
 
-@lru_cache(maxsize=400)
-def get_stock_data(stock_code, start_date, end_date):
+# 取得済みの株価データのハンドル {(銘柄コード, 開始日, 終了日): ハンドル}
+# データそのものは保管場所だけが持ち、保管場所から削除されたら取得し直す
+_stock_data_handles = {}
+
+# ハンドルの件数がこれを超えたら、保管場所から削除されたデータのハンドルを捨てる
+STOCK_DATA_HANDLES_MAX = 1000
+
+def download_stock_data(stock_code, start_date, end_date):
     """
-    株価データを取得する関数（キャッシュ付き）
+    株価データを取得する関数
     
     Parameters:
     stock_code (str): 銘柄コード
@@ -64,62 +72,44 @@ def get_stock_data(stock_code, start_date, end_date):
         st.error(f"データ取得中にエラーが発生しました: {str(e)}")
         return pd.DataFrame()
 
-def create_candlestick_chart(df):
+def get_stock_data(session_id, stock_code, start_date, end_date):
     """
-    ローソク足チャートを作成する関数
-    データ量が250ポイント以上の場合は自動的に折れ線グラフに切り替え
+    株価データを保管場所に置いてハンドルを返す（保管場所に残っていれば取得し直さない）
     
     Parameters:
-    df (DataFrame): 株価データ
+    session_id (str): セッションID
+    stock_code (str): 銘柄コード
+    start_date (str): 開始日（YYYY-MM-DD形式）
+    end_date (str): 終了日（YYYY-MM-DD形式）
     
     Returns:
-    bytes: チャート画像のバイナリデータ
+    tuple: (ハンドル, DataFrame)（データが取得できなかった場合は (None, 空のDataFrame)）
     """
-    # インデックスがDateTimeIndexであることを確認
-    if not isinstance(df.index, pd.DatetimeIndex):
-        df.index = pd.DatetimeIndex(df.index)
-        
+    key = (stock_code, start_date, end_date)
+    handle = _stock_data_handles.get(key)
+    if handle is not None:
+        df = session_store.get(session_id, handle)
+        metrics.count_cache('stock_analysis.get_stock_data', df is not None)
+        if df is not None:
+            return handle, df
+        _stock_data_handles.pop(key, None)
+    else:
+        metrics.count_cache('stock_analysis.get_stock_data', False)
+
+    df = download_stock_data(stock_code, start_date, end_date)
+    if df.empty:
+        return None, df
     # マルチインデックスの場合はレベル0を選択
     if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
         df.columns = df.columns.get_level_values(0)
-        
-    # mplfinanceで必要なOHLCV形式に変換
-    df_plot = df[['Open', 'High', 'Low', 'Close', 'Volume']].copy()
-    
-    # データポイント数に基づいてチャートタイプを決定
-    if len(df_plot) > 250:  # 約1年分の取引日
-        chart_type = 'line'
-    else:
-        chart_type = 'candle'
-    
-    # スタイルの設定
-    mpf_style = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mpf.make_marketcolors(
-        up='red',
-        down='blue',
-        edge='inherit',
-        wick='inherit',
-        volume='inherit',
-    ))
-    
-    # Bytesオブジェクトを作成
-    buf = BytesIO()
-    
-    # チャートを作成
-    fig, axes = mpf.plot(
-        df_plot,
-        type=chart_type,  # 動的にチャートタイプを設定
-        volume=True,
-        style=mpf_style,
-        returnfig=True,
-        figsize=(12, 8),
-        panel_ratios=(4, 1)
-    )
-    
-    # チャートをバイト形式で保存
-    fig.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    
-    return buf, chart_type  # チャートタイプも返す
+    handle = session_store.put(session_id, 'frame', df)
+    _stock_data_handles[key] = handle
+    if len(_stock_data_handles) > STOCK_DATA_HANDLES_MAX:
+        for stale_key, stale_handle in list(_stock_data_handles.items()):
+            if not session_store.contains(stale_handle):
+                _stock_data_handles.pop(stale_key, None)
+    return handle, df
 
 def get_vote_results_top_n(vote_date, top_n=20):
     """指定日の投票結果上位N件を取得"""
@@ -138,6 +128,31 @@ def get_vote_results_top_n(vote_date, top_n=20):
     finally:
         conn.close()
 
+def get_all_frames(session_id, handles):
+    """
+    保管場所からすべての銘柄のデータを取り出す
+    
+    破棄された銘柄がある場合は一部の銘柄だけのファイルを作らないようにエラーにする
+    （作成したファイルはすべての銘柄のハンドルをキーに保持されるため）。
+    """
+    frames = session_store.get_frames(session_id, handles)
+    missing = [code for code in handles if code not in frames]
+    if missing:
+        raise ValueError(f"保存期間が過ぎたため破棄された銘柄があります: {', '.join(missing)}")
+    return frames
+
+def build_stock_data_excel(session_id, handles, stock_names):
+    """保管場所のデータから一括ダウンロード用のExcelを作成（ダウンロード時に呼ばれる）"""
+    return exports.build_stock_data_excel(get_all_frames(session_id, handles), stock_names)
+
+def build_stock_data_zip(session_id, handles, stock_names):
+    """保管場所のデータから一括ダウンロード用のCSV/ZIPを作成（ダウンロード時に呼ばれる）"""
+    return exports.build_stock_data_zip(get_all_frames(session_id, handles), stock_names)
+
+def build_stock_data_csv(session_id, code, handle):
+    """保管場所のデータから銘柄ごとのCSVを作成（ダウンロード時に呼ばれる）"""
+    return exports.build_dataframe_csv(get_all_frames(session_id, {code: handle})[code])
+
 def show(selected_date):
     st.title("特定銘柄分析ページ")
     
@@ -298,9 +313,15 @@ def show(selected_date):
         progress_bar = st.progress(0)
         total_stocks = len(stock_code_list)
 
-        # 新しいデータ取得時にはセッション状態をリセット
+        # 新しいデータ取得時にはセッション状態をリセット（前回のデータの参照を外す）
+        session_id = session_store.get_session_id()
+        session_store.release(session_id, [
+            *st.session_state['stock_data'].values(),
+            *(chart['handle'] for chart in st.session_state['charts'].values())
+        ])
         st.session_state['stock_data'] = {}
         st.session_state['charts'] = {}
+        chart_requests = {}
         
         for i, code in enumerate(stock_code_list):
             try:
@@ -317,19 +338,12 @@ def show(selected_date):
                 start_date_str = start_date.strftime("%Y-%m-%d")
                 end_date_str = end_date.strftime("%Y-%m-%d")
                 
-                # キャッシュ付きのデータ取得関数を使用
-                df = get_stock_data(code, start_date_str, end_date_str)
+                # データは保管場所に置き、セッション状態にはハンドルを保存
+                handle, df = get_stock_data(session_id, code, start_date_str, end_date_str)
                 
-                if not df.empty:
-                    # セッション状態にデータを保存
-                    st.session_state['stock_data'][code] = df
-                    
-                    # ローソク足チャートの作成と保存
-                    buf, chart_type = create_candlestick_chart(df)
-                    st.session_state['charts'][code] = {
-                        'buf': buf,
-                        'type': chart_type
-                    }
+                if handle is not None:
+                    st.session_state['stock_data'][code] = handle
+                    chart_requests[code] = (df, start_date_str, end_date_str)
                 else:
                     st.warning(f"{code} のデータが取得できませんでした。")
                 
@@ -337,86 +351,60 @@ def show(selected_date):
                 st.error(f"{code} のデータ取得中にエラーが発生しました: {str(e)}")
                 continue
         
+        # ローソク足チャートの作成と保存（描画済みの期間はキャッシュから、残りは並列に描画する）
+        if chart_requests:
+            progress_bar.progress(0.0, text="チャートを作成中...")
+            charts = chart_render.render_charts(
+                chart_requests,
+                on_progress=lambda done, total: progress_bar.progress(done / total, text="チャートを作成中...")
+            )
+            for code, (png, chart_type) in charts.items():
+                st.session_state['charts'][code] = {
+                    'handle': session_store.put(session_id, 'png', png),
+                    'type': chart_type
+                }
+        
         progress_bar.progress(1.0)
     
     # 保存されたデータを表示
     if st.session_state['stock_data']:
+        session_id = session_store.get_session_id()
         # 一括ダウンロードボタンを追加
-        if len(st.session_state['stock_data']) > 0:
-            # Excelファイルの作成
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                # 各銘柄のデータをシートとして追加
-                for code, df in st.session_state['stock_data'].items():
-                    sheet_name = f"{code}_{get_stock_name(code)}"
-                    # シート名が長すぎる場合は短縮
-                    if len(sheet_name) > 31:  # Excelのシート名の最大長
-                        sheet_name = f"{code}_{get_stock_name(code)[:20]}"
-                    
-                    # データフレームをExcelに書き込み
-                    df.to_excel(writer, sheet_name=sheet_name, index=True)
-                    
-                    # ワークシートの取得
-                    worksheet = writer.sheets[sheet_name]
-                    
-                    # 列幅の自動調整
-                    for idx, col in enumerate(df.columns):
-                        max_length = max(
-                            df[col].astype(str).apply(len).max(),
-                            len(str(col))
-                        )
-                        worksheet.column_dimensions[chr(65 + idx + 1)].width = max_length + 2  # +1 for index column
-                    
-                    # インデックス列（日付）の幅も調整
-                    max_date_length = max(
-                        max(len(str(date)) for date in df.index),
-                        len('Date')
-                    )
-                    worksheet.column_dimensions['A'].width = max_date_length + 2
-                    
-                    # 日付列の書式を設定
-                    for row in range(2, len(df) + 2):  # 2から始まる（ヘッダー行の後）
-                        cell = worksheet.cell(row=row, column=1)  # A列
-                        cell.number_format = 'yyyy/m/d'
-                    
-                    # TradingViewのURLを追加
-                    url = f'https://jp.tradingview.com/chart/?symbol={code}'
-                    worksheet.cell(row=1, column=len(df.columns) + 2).value = 'TradingView URL'
-                    worksheet.cell(row=1, column=len(df.columns) + 2).hyperlink = url
-                    worksheet.cell(row=1, column=len(df.columns) + 2).style = 'Hyperlink'
+        handles = st.session_state['stock_data']
+        released = [code for code, handle in handles.items() if not session_store.contains(handle)]
+        if released:
+            st.warning(f"保存期間が過ぎたため一部のデータが破棄されました（{', '.join(released)}）。一括ダウンロードするには再度「データ取得」を押してください。")
+        else:
+            # Excel・ZIPはダウンロードされたときに作成する（取得したデータが同じなら作成済みのファイルを使う）
+            # ハンドルは内容のハッシュなので、DataFrameをハッシュし直さずにキーにできる
+            stock_names = {code: get_stock_name(code) for code in handles}
+            data_key = exports.fingerprint(handles, stock_names)
             
             # Excelファイルのダウンロードボタン
             st.download_button(
                 label="一括ダウンロード（Excel）",
-                data=output.getvalue(),
+                data=exports.lazy_export(build_stock_data_excel, session_id, handles, stock_names, key=data_key),
                 file_name=f"stock_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                mime=exports.EXCEL_MIME,
                 key="download_excel"
             )
             
             # CSV一括ダウンロード（ZIPファイル）
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for code, df in st.session_state['stock_data'].items():
-                    csv_data = df.to_csv().encode('utf-8-sig')
-                    # UTF-8フラグを設定してファイル名の文字化けを防止
-                    file_name = f"{code}_{get_stock_name(code)}_stock_data.csv"
-                    zip_info = zipfile.ZipInfo(file_name)
-                    zip_info.flag_bits |= 0x800  # UTF-8フラグ（bit 11）を設定
-                    zip_info.compress_type = zipfile.ZIP_DEFLATED
-                    zip_file.writestr(zip_info, csv_data)
-            
             st.download_button(
                 label="一括ダウンロード（CSV/ZIP）",
-                data=zip_buffer.getvalue(),
+                data=exports.lazy_export(build_stock_data_zip, session_id, handles, stock_names, key=data_key),
                 file_name=f"stock_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
                 mime="application/zip",
                 key="download_csv_zip"
             )
         
         # 個別のデータ表示
-        for code, df in st.session_state['stock_data'].items():
+        for code, handle in st.session_state['stock_data'].items():
             st.subheader(f"{get_stock_name(code)} ({code})")
+            df = session_store.get(session_id, handle)
+            if df is None:
+                st.warning("保存期間が過ぎたため、データが破棄されました。再度「データ取得」を押してください。")
+                continue
             st.write("【株価データ】")
             st.dataframe(df)
             st.write("【チャート】")
@@ -434,14 +422,16 @@ def show(selected_date):
             # ローソク足チャートの表示
             if code in st.session_state['charts']:
                 chart_info = st.session_state['charts'][code]
-                chart_type_text = "ローソク足" if chart_info['type'] == 'candle' else "折れ線"
-                st.image(chart_info['buf'], caption=f"{get_stock_name(code)} ({code}) - {chart_type_text}チャート", use_container_width=True)
+                chart_png = session_store.get(session_id, chart_info['handle'])
+                if chart_png is not None:
+                    chart_type_text = "ローソク足" if chart_info['type'] == 'candle' else "折れ線"
+                    st.image(chart_png, caption=f"{get_stock_name(code)} ({code}) - {chart_type_text}チャート", use_container_width=True)
             
             # CSVダウンロード
-            csv = df.to_csv().encode('utf-8-sig')
             st.download_button(
                 label="CSVダウンロード",
-                data=csv,
+                # DataFrameではなくハンドルを渡す（ボタンの関数が保管場所の外でデータを持ち続けないようにする）
+                data=exports.lazy_export(build_stock_data_csv, session_id, code, handle, key=handle),
                 file_name=f"{code}_stock_data.csv",
                 mime="text/csv",
                 key=f"download_{code}"  # 一意のキーを設定
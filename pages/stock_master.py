@@ -141,10 +141,8 @@ def show_bulk_import():
                 return
             
             # 銘柄コードの形式チェック
-            invalid_codes = []
-            for code in df['銘柄コード']:
-                if not re.match(r'^[A-Z0-9]+$', str(code)):
-                    invalid_codes.append(code)
+            is_valid = df['銘柄コード'].astype(str).str.match(r'^[A-Z0-9]+$')
+            invalid_codes = df.loc[~is_valid, '銘柄コード'].tolist()
             
             if invalid_codes:
                 st.error(f"以下の銘柄コードが不正です（半角英数字・大文字のみ使用可能）: {', '.join(map(str, invalid_codes))}")
@@ -191,43 +189,96 @@ def save_new_stock(stock_code, stock_name):
         conn.close()
 
 def save_bulk_stocks(df):
+    """
+    CSVの銘柄を一括登録/更新する
+
+    一時テーブルへexecutemanyで投入し、新規/更新件数の判定とマージを
+    それぞれ1回の集合演算SQLで行う（行ごとのSELECT/INSERTは行わない）
+    """
     conn = get_connection()
     c = conn.cursor()
     
     success_count = 0
     update_count = 0
     error_count = 0
- 
-    for _, row in df.iterrows():
-        try:
-            # 既存のレコードをチェック
-            c.execute("SELECT stock_code FROM stock_master WHERE stock_code = ?", (row['銘柄コード'],))
-            exists = c.fetchone() is not None
-            
-            c.execute(
-                """
-                INSERT INTO stock_master (stock_code, stock_name)
-                VALUES (?, ?)
-                ON CONFLICT(stock_code) DO UPDATE SET
-                    stock_name = excluded.stock_name
-                """,
-                (row['銘柄コード'], row['銘柄名'])
+
+    # 一時テーブルに投入するデータ（行番号はCSVのヘッダー行を1行目とした行番号）
+    names = df['銘柄名'].astype(object).where(df['銘柄名'].notna(), None)
+    staging_rows = list(zip(
+        range(2, len(df) + 2),
+        df['銘柄コード'].astype(str),
+        names
+    ))
+
+    try:
+        c.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS stock_master_import (
+                line_no INTEGER PRIMARY KEY,
+                stock_code TEXT NOT NULL,
+                stock_name TEXT
             )
-            
-            if exists:
-                update_count += 1
-            else:
-                success_count += 1
+            """
+        )
+        c.execute("DELETE FROM stock_master_import")
+        c.executemany(
+            "INSERT INTO stock_master_import (line_no, stock_code, stock_name) VALUES (?, ?, ?)",
+            staging_rows
+        )
 
-        except Exception as e:
+        # 登録できない行（銘柄名が空）を行単位で報告
+        c.execute(
+            """
+            SELECT stock_code FROM stock_master_import
+            WHERE stock_name IS NULL OR TRIM(stock_name) = ''
+            ORDER BY line_no
+            """
+        )
+        for (stock_code,) in c.fetchall():
             error_count += 1
-            st.error(f"銘柄コード {row['銘柄コード']} の登録に失敗しました: {str(e)}")
+            st.error(f"銘柄コード {stock_code} の登録に失敗しました: 銘柄名が空です")
+
+        # 新規/更新件数を集合演算で判定
+        # 同一コードが複数行ある場合は、最初の1行を新規、以降を更新として数える（従来の逐次処理と同じ）
+        c.execute(
+            """
+            SELECT
+                COUNT(*) AS valid_rows,
+                COUNT(DISTINCT CASE WHEN m.stock_code IS NULL THEN i.stock_code END) AS new_codes
+            FROM stock_master_import i
+            LEFT JOIN stock_master m ON m.stock_code = i.stock_code
+            WHERE i.stock_name IS NOT NULL AND TRIM(i.stock_name) <> ''
+            """
+        )
+        valid_rows, success_count = c.fetchone()
+        update_count = valid_rows - success_count
 
-    # 統計情報の更新
-    c.execute("ANALYZE stock_master;")
+        # 1文でマージ（同一コードが複数行ある場合は最後の行を採用）
+        c.execute(
+            """
+            INSERT INTO stock_master (stock_code, stock_name)
+            SELECT stock_code, stock_name FROM stock_master_import
+            WHERE line_no IN (
+                SELECT MAX(line_no) FROM stock_master_import
+                WHERE stock_name IS NOT NULL AND TRIM(stock_name) <> ''
+                GROUP BY stock_code
+            )
+            ON CONFLICT(stock_code) DO UPDATE SET
+                stock_name = excluded.stock_name
+            """
+        )
+        c.execute("DROP TABLE stock_master_import")
 
-    conn.commit()
-    conn.close()
+        # 統計情報の更新
+        c.execute("ANALYZE stock_master;")
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"一括登録に失敗しました: {str(e)}")
+        return
+    finally:
+        conn.close()
     
     # 結果の表示
     if success_count > 0:
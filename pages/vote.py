@@ -2,10 +2,8 @@ import streamlit as st
 from datetime import datetime
 from utils.db import get_connection
 from utils.common import MAX_VOTE_SELECTION, format_vote_data_with_thresh
-import csv
-from io import StringIO
-import pandas as pd
-from io import BytesIO
+from utils import exports
+from utils import result_artifacts
 
 def show(selected_date):
     selected_date_str = selected_date.strftime("%Y-%m-%d")
@@ -55,26 +53,12 @@ def show(selected_date):
                 st.download_button("銘柄コードExport(票数付)", data=sorted_results_with_thresh, file_name=filename, mime="text/plain")
         
         row2_col1, row2_col2 = st.columns(2)
-        # CSVファイルExportボタン
-        csv_buffer = StringIO()
-        csv_writer = csv.writer(csv_buffer)
-        # ヘッダー行をSJISで書き込み
-        headers = ['銘柄コード', 'アンケート票数', '銘柄名', 'TradingView URL']
-        csv_data = [(row[0], row[1], row[2] or row[0], f'https://jp.tradingview.com/chart/?symbol={row[0]}') for row in sorted_results]
-        
-        # SJISでエンコードしたバイトデータを作成
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(headers)
-        writer.writerows(csv_data)
-        csv_str = output.getvalue()
-        csv_bytes = csv_str.encode('shift-jis', errors='replace')
-        
+        # CSVファイルExportボタン（クリックされたときに作成し、同じデータなら作成済みのファイルを使う）
         csv_filename = f"銘柄発掘{selected_date.strftime('%Y%m%d')}{sort_suffix}.csv"
         with row2_col1:
             st.download_button(
                 "集計結果CSV Export",
-                data=csv_bytes,
+                data=exports.lazy_export(exports.build_vote_csv, sorted_results, 'アンケート票数'),
                 file_name=csv_filename,
                 mime="text/csv"
             )
@@ -82,41 +66,13 @@ def show(selected_date):
         # Excelファイルのエクスポート
         excel_filename = f"銘柄発掘{selected_date.strftime('%Y%m%d')}{sort_suffix}.xlsx"
         
-        # DataFrameを作成（URLなし）
-        excel_data = [(row[0], row[1], row[2] or row[0]) for row in sorted_results]
-        df = pd.DataFrame(excel_data, columns=['銘柄コード', 'アンケート票数', '銘柄名'])
-        
-        # Excelファイルを作成
-        excel_buffer = BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='集計結果')
-            
-            # ワークシートの取得
-            worksheet = writer.sheets['集計結果']
-            
-            # 列幅の自動調整
-            for idx, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).apply(len).max(),
-                    len(str(col))
-                )
-                worksheet.column_dimensions[chr(65 + idx)].width = max_length + 2
-            
-            # 銘柄名列にハイパーリンクを設定
-            for row_idx, row in enumerate(sorted_results, start=2):  # start=2 はヘッダー行の後から
-                stock_code = row[0]
-                url = f'https://jp.tradingview.com/chart/?symbol={stock_code}'
-                cell = worksheet.cell(row=row_idx, column=3)  # 3列目（銘柄名）
-                cell.hyperlink = url
-                cell.style = 'Hyperlink'
-        
-        excel_data = excel_buffer.getvalue()
         with row2_col2:
             st.download_button(
                 "集計結果Excel Export",
-                data=excel_data,
+                # クリックされたときに作成する（pandas/openpyxlの読み込みと作成処理を表示時に行わない）
+                data=exports.lazy_export(exports.build_vote_excel, sorted_results, 'アンケート票数', '集計結果'),
                 file_name=excel_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime=exports.EXCEL_MIME
             )
         
         # 投票方法の説明
@@ -201,6 +157,9 @@ def save_vote_data(selected_date_str, results):
         conn.commit()
         conn.close()
         
+        # 結果ページ用のファイルをバックグラウンドで作成（続けて投票された場合はまとめて1回作成する）
+        result_artifacts.schedule_artifacts(selected_date_str)
+        
         # 進捗バーを完了状態に
         progress_bar.progress(1.0)
         st.success("投票が保存されました。")
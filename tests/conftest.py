@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# プロジェクトのルートをimportできるようにする
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """一時ディレクトリに初期化済みのsurvey.dbを作る（utils.db.get_db_path はカレントディレクトリのsurvey.dbを使う）"""
+    from utils.db import init_db
+    monkeypatch.chdir(tmp_path)
+    init_db.clear()
+    init_db()
+    yield tmp_path
+    init_db.clear()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """退避先を一時ディレクトリにした空の session_store"""
+    from utils import session_store
+    monkeypatch.setattr(session_store, 'SESSION_STORE_DIR', str(tmp_path / 'session_store'))
+    monkeypatch.setattr(session_store, '_spill_dir', None)
+    monkeypatch.setattr(session_store, '_entries', session_store.OrderedDict())
+    monkeypatch.setattr(session_store, '_sessions', {})
+    monkeypatch.setattr(session_store, '_memory_bytes', 0)
+    return session_store
@@ -2,21 +2,13 @@
 import sys
 import os
 from datetime import date
-from unittest.mock import MagicMock
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Mock streamlit
-import streamlit as st
-st.progress = MagicMock()
-st.empty = MagicMock()
-st.error = print
-st.write = print
-
-# Import necessary modules from the app
+# Import necessary modules from the app (utils.simulation does not need the Streamlit runtime)
 try:
-    from pages.investment_simulation import (
+    from utils.simulation import (
         simulate_investment, calculate_monthly_pnl, calculate_pnl_breakdown
     )
 except ImportError:
@@ -32,7 +24,8 @@ def verify_app_fix():
     allocation = [25, 20, 15, 10, 5, 5, 5, 5, 5, 5]
     
     print("Running original simulation...")
-    results, history = simulate_investment(start_date, end_date, initial_jpy, initial_usd, allocation, allocation)
+    result = simulate_investment(start_date, end_date, initial_jpy, initial_usd, allocation, allocation)
+    results, history = result['simulation_results'], result['trade_history']
     
     print(f"Simulation complete. Days: {len(results)}")
     
@@ -0,0 +1,94 @@
+import sys
+import threading
+import types
+
+import pandas as pd
+import pytest
+
+from utils import chart_render, render_cache
+
+
+def _frame(days=5):
+    index = pd.date_range('2025-01-06', periods=days, name='Date')
+    return pd.DataFrame({
+        'Open': [100.0 + i for i in range(days)],
+        'High': [105.0 + i for i in range(days)],
+        'Low': [95.0 + i for i in range(days)],
+        'Close': [102.0 + i for i in range(days)],
+        'Volume': [1000 + i for i in range(days)],
+    }, index=index)
+
+
+def _worker_state():
+    """ワーカープロセスで実行し、読み込まれたモジュールとスレッドを返す"""
+    return 'app' in sys.modules, sorted(thread.name for thread in threading.enumerate())
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(chart_render, '_executor', None)
+    yield
+    chart_render._reset_executor()
+
+
+def test_renders_in_process_when_pool_is_unavailable(temp_db, monkeypatch):
+    def unavailable():
+        raise OSError('no processes')
+
+    monkeypatch.setattr(chart_render, '_get_executor', unavailable)
+    progress = []
+
+    results = chart_render.render_charts(
+        {'7203': (_frame(), '2025-01-06', '2025-01-10')},
+        on_progress=lambda done, total: progress.append((done, total))
+    )
+
+    png, chart_type = results['7203']
+    assert png.startswith(b'\x89PNG')
+    assert chart_type == 'candle'
+    assert progress == [(1, 1)]
+
+
+def test_cached_charts_are_not_rendered_again(temp_db, monkeypatch):
+    df = _frame()
+    df_plot = chart_render.prepare_chart_frame(df)
+    key = chart_render.chart_cache_key('7203', '2025-01-06', '2025-01-10', 'candle', df_plot)
+    render_cache.put(key, b'cached png')
+
+    def render(*args):
+        raise AssertionError('rendered a cached chart')
+
+    monkeypatch.setattr(chart_render, '_get_executor', render)
+    monkeypatch.setattr(chart_render, 'render_chart_png', render)
+
+    assert chart_render.render_charts({'7203': (df, '2025-01-06', '2025-01-10')}) == {
+        '7203': (b'cached png', 'candle')
+    }
+    # 期間が違う場合は別のキー
+    assert key != chart_render.chart_cache_key('7203', '2025-01-06', '2025-01-09', 'candle', df_plot)
+
+
+def test_workers_do_not_run_the_app_script(temp_db, tmp_path, monkeypatch, executor):
+    # Streamlitの実行中と同じく、__main__ をアプリのスクリプトにする
+    marker = tmp_path / 'app_ran'
+    script = tmp_path / 'app.py'
+    script.write_text(
+        "import threading, time\n"
+        f"open({str(marker)!r}, 'a').write('ran\\n')\n"
+        "threading.Thread(target=time.sleep, args=(60,), name='db-maintenance', daemon=True).start()\n",
+        encoding='utf-8'
+    )
+    app_main = types.ModuleType('__main__')
+    app_main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, '__main__', app_main)
+    monkeypatch.setattr(chart_render, 'CHART_RENDER_WORKERS', 1)
+
+    results = chart_render.render_charts({'7203': (_frame(), '2025-01-06', '2025-01-10')})
+    assert results['7203'][0].startswith(b'\x89PNG')
+
+    # 同じワーカー（1つだけ）で状態を確認する
+    app_imported, threads = chart_render._get_executor().submit(_worker_state).result(timeout=60)
+    assert not app_imported
+    assert 'db-maintenance' not in threads
+    assert not marker.exists()
+    assert sys.modules['__main__'] is app_main
@@ -0,0 +1,141 @@
+import json
+import os
+from io import BytesIO
+
+import pytest
+
+from utils.db import get_connection
+from utils import db_transfer
+from utils.db_transfer import import_database, write_export_zip
+
+
+def _insert_votes(rows):
+    conn = get_connection()
+    conn.executemany("INSERT INTO vote (vote_date, stock_code) VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def _count(table_name):
+    conn = get_connection()
+    count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_import_legacy_json_with_empty_table(temp_db):
+    _insert_votes([('2025-01-06', '7203'), ('2025-01-06', '6758')])
+    backup = {
+        'tables': {
+            'stock_master': [{'stock_code': '7203', 'stock_name': 'トヨタ自動車'}],
+            'vote': [],
+        }
+    }
+
+    result = import_database(BytesIO(json.dumps(backup, ensure_ascii=False).encode('utf-8')))
+
+    assert result['tables'] == {'stock_master': 1, 'vote': 0}
+    # 空のテーブルも置き換えられる（既存の行は削除される）
+    assert _count('vote') == 0
+    assert _count('stock_master') == 1
+
+
+def test_import_legacy_json_rejects_missing_required_column(temp_db):
+    _insert_votes([('2025-01-06', '7203')])
+    backup = {'tables': {'vote': [{'stock_code': '7203'}]}}
+
+    with pytest.raises(ValueError, match='vote_date'):
+        import_database(BytesIO(json.dumps(backup).encode('utf-8')))
+
+    # ロールバックされて元の行が残る
+    assert _count('vote') == 1
+
+
+@pytest.mark.parametrize('export_format', ['ndjson', 'csv'])
+def test_export_import_round_trip(temp_db, export_format):
+    _insert_votes([('2025-01-06', '7203'), ('2025-01-07', '6758')])
+    buffer = BytesIO()
+    write_export_zip(buffer, export_format=export_format, tables=['stock_master', 'vote'])
+    _insert_votes([('2025-01-08', '9984')])
+
+    buffer.seek(0)
+    result = import_database(buffer)
+
+    assert result['tables'] == {'stock_master': 0, 'vote': 2}
+    assert _count('vote') == 2
+
+
+@pytest.mark.parametrize('export_format', ['ndjson', 'csv'])
+def test_round_trip_keeps_null_and_empty_strings_apart(temp_db, export_format):
+    names = [('1301', ''), ('1332', '\\N'), ('1333', '\\\\server'), ('7203', 'トヨタ自動車')]
+    conn = get_connection()
+    conn.executemany("INSERT INTO stock_master (stock_code, stock_name) VALUES (?, ?)", names)
+    conn.execute("INSERT INTO vote (vote_date, stock_code, created_at) VALUES ('2025-01-06', '7203', NULL)")
+    conn.commit()
+    conn.close()
+    buffer = BytesIO()
+    write_export_zip(buffer, export_format=export_format, tables=['stock_master', 'vote'])
+
+    buffer.seek(0)
+    import_database(buffer)
+
+    conn = get_connection()
+    assert conn.execute("SELECT stock_code, stock_name FROM stock_master ORDER BY stock_code").fetchall() == names
+    assert conn.execute("SELECT created_at FROM vote").fetchall() == [(None,)]
+    conn.close()
+
+
+def test_import_csv_exported_before_null_marker(temp_db):
+    import zipfile
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('vote.csv', 'id,vote_date,stock_code,created_at\r\n1,2025-01-06,7203,\r\n')
+        zf.writestr('manifest.json', json.dumps({
+            'format': 'csv',
+            'tables': {'vote': {'file': 'vote.csv', 'columns': ['id', 'vote_date', 'stock_code', 'created_at'], 'rows': 1}},
+        }))
+
+    buffer.seek(0)
+    import_database(buffer)
+
+    conn = get_connection()
+    assert conn.execute("SELECT stock_code, created_at FROM vote").fetchall() == [('7203', None)]
+    conn.close()
+
+
+def test_export_includes_moomoo_trades(temp_db):
+    import pandas as pd
+    from utils.moomoo_store import import_trades, list_accounts, make_account_key
+    fills = pd.DataFrame([{
+        'datetime': pd.Timestamp('2025-01-06 10:00:00'), 'ticker': 'AAPL', 'name': 'Apple', 'side': '買い',
+        'currency': 'USD', 'qty': 10.0, 'price': 100.0, 'fee': 1.0,
+    }])
+    import_trades(make_account_key('chatwork:1', 'メイン'), fills)
+    buffer = BytesIO()
+    write_export_zip(buffer)
+
+    conn = get_connection()
+    conn.execute("DELETE FROM moomoo_trades")
+    conn.commit()
+    conn.close()
+    buffer.seek(0)
+    result = import_database(buffer)
+
+    assert result['tables']['moomoo_trades'] == 1
+    assert list_accounts('chatwork:1')[0][:2] == ('メイン', 1)
+
+
+def test_export_files_are_rotated(temp_db):
+    # ダウンロードされずに残った以前のエクスポート
+    export_dir = db_transfer.get_export_dir()
+    old_names = ['db_backup_20250101_120000_ndjson.zip', 'db_backup_20250102_120000_csv.zip']
+    for name in old_names:
+        with open(os.path.join(export_dir, name), 'wb') as f:
+            f.write(b'old')
+
+    path, manifest = db_transfer.create_export_file('ndjson', keep=2)
+
+    assert sorted(os.listdir(export_dir)) == [old_names[1], os.path.basename(path)]
+    assert manifest['format'] == 'ndjson'
+    with open(path, 'rb') as f:
+        assert import_database(f)['tables']['vote'] == 0
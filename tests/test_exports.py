@@ -0,0 +1,94 @@
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from utils import exports
+
+
+def _load(data):
+    return load_workbook(BytesIO(data))
+
+
+def test_openpyxl_write_only_links_and_formats():
+    sheets = [{
+        'name': 'シート',
+        'headers': ['日付', '終値', '銘柄名'],
+        'rows': [
+            [pd.Timestamp('2025-01-06'), 100.5, 'トヨタ'],
+            [None, np.nan, 'ソニー'],
+            [pd.Timestamp('2025-01-08', tz='Asia/Tokyo'), 102.0, '任天堂'],
+        ],
+        'formats': {0: 'yyyy/m/d'},
+        'links': {2: ['https://example.com/7203', 'https://example.com/6758', 'https://example.com/7974']},
+        'header_links': {1: 'https://example.com/close'},
+    }]
+
+    worksheet = _load(exports._write_excel_openpyxl(sheets))['シート']
+
+    assert worksheet['B1'].hyperlink.target == 'https://example.com/close'
+    assert worksheet['A1'].hyperlink is None
+
+    # 書式付きのセルは使い回しているが、行ごとの値と書式が書き出されている
+    assert worksheet['A2'].value == datetime(2025, 1, 6)
+    assert worksheet['A2'].number_format == 'yyyy/m/d'
+    assert worksheet['A3'].value is None
+    assert worksheet['A4'].value == datetime(2025, 1, 8)
+    assert worksheet['A4'].number_format == 'yyyy/m/d'
+    assert worksheet['B3'].value is None
+
+    assert [worksheet[f'C{row}'].value for row in range(2, 5)] == ['トヨタ', 'ソニー', '任天堂']
+    assert [worksheet[f'C{row}'].hyperlink.target for row in range(2, 5)] == [
+        'https://example.com/7203', 'https://example.com/6758', 'https://example.com/7974'
+    ]
+    assert worksheet.column_dimensions['A'].width == len('yyyy/m/d') + 2
+
+
+def test_build_stock_data_excel_sheet_per_code():
+    index = pd.date_range('2025-01-06', periods=3, name='Date')
+    stock_data = {
+        '7203': pd.DataFrame({'Close': [1.0, 2.0, 3.0]}, index=index),
+        '6758': pd.DataFrame({'Close': [4.0, 5.0, 6.0]}, index=index),
+    }
+    stock_names = {'7203': 'トヨタ自動車', '6758': 'ソニーグループ'}
+
+    workbook = _load(exports.build_stock_data_excel(stock_data, stock_names))
+
+    assert workbook.sheetnames == ['7203_トヨタ自動車', '6758_ソニーグループ']
+    worksheet = workbook['6758_ソニーグループ']
+    assert [cell.value for cell in worksheet[1]] == ['Date', 'Close', 'TradingView URL']
+    assert worksheet['C1'].hyperlink.target == 'https://jp.tradingview.com/chart/?symbol=6758'
+    assert worksheet['A4'].value == datetime(2025, 1, 8)
+    assert worksheet['B4'].value == 6.0
+
+
+def test_lazy_export_builds_once_per_key():
+    calls = []
+
+    def builder(value):
+        calls.append(value)
+        return f'data-{value}'.encode()
+
+    key = exports.fingerprint('test_lazy_export_builds_once_per_key')
+    build = exports.lazy_export(builder, 1, key=key)
+    assert calls == []
+    assert build() == b'data-1'
+    assert exports.lazy_export(builder, 1, key=key)() == b'data-1'
+    assert calls == [1]
+
+
+def test_lazy_export_does_not_cache_failed_builds():
+    def builder(fail):
+        if fail[0]:
+            raise ValueError('partial data')
+        return b'ok'
+
+    fail = [True]
+    key = exports.fingerprint('test_lazy_export_does_not_cache_failed_builds')
+    with pytest.raises(ValueError):
+        exports.lazy_export(builder, fail, key=key)()
+    fail[0] = False
+    assert exports.lazy_export(builder, fail, key=key)() == b'ok'
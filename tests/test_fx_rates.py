@@ -0,0 +1,51 @@
+import pandas as pd
+
+from utils import fx_rates
+
+
+def test_today_rate_is_downloaded_once_per_hour(temp_db, monkeypatch):
+    calls = []
+
+    def fake_download(ticker, start, end, **kwargs):
+        calls.append((start, end))
+        index = pd.date_range(start, pd.Timestamp(end) - pd.Timedelta(days=1), freq='D')
+        return pd.DataFrame({'Close': [150.0 + i for i in range(len(index))]}, index=index)
+
+    monkeypatch.setattr(fx_rates.yf, 'download', fake_download)
+    monkeypatch.setattr(fx_rates, '_today_rate', {})
+    today = pd.Timestamp.today().normalize()
+    start = today - pd.Timedelta(days=10)
+
+    first = fx_rates.load_fx_series(start, today)
+    second = fx_rates.load_fx_series(start, today)
+
+    assert len(calls) == 1
+    assert not first.isna().any()
+    pd.testing.assert_series_equal(first, second, check_freq=False, check_names=False)
+    # 当日分はprice_cacheに保存しない
+    conn = fx_rates.get_connection()
+    saved = conn.execute(
+        "SELECT COUNT(*) FROM price_cache WHERE stock_code = ? AND date = ?",
+        (fx_rates.FX_TICKER, today.strftime('%Y-%m-%d'))
+    ).fetchone()[0]
+    conn.close()
+    assert saved == 0
+
+
+def test_today_rate_expires_with_the_hour(temp_db, monkeypatch):
+    calls = []
+
+    def fake_download(ticker, start, end, **kwargs):
+        calls.append((start, end))
+        index = pd.date_range(start, pd.Timestamp(end) - pd.Timedelta(days=1), freq='D')
+        return pd.DataFrame({'Close': [150.0] * len(index)}, index=index)
+
+    monkeypatch.setattr(fx_rates.yf, 'download', fake_download)
+    monkeypatch.setattr(fx_rates, '_today_rate', {})
+    today = pd.Timestamp.today().normalize()
+
+    fx_rates.load_fx_series(today, today)
+    monkeypatch.setattr(fx_rates, '_today_rate_key', lambda: ('next', 0))
+    fx_rates.load_fx_series(today, today)
+
+    assert len(calls) == 2
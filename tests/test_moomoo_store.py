@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from utils.moomoo_store import _replay_average_cost_sequential, replay_average_cost
+
+
+def _random_fills(rng, n, fractional=False):
+    """保有数量を超えない売りだけの約定（途中で何度か全数売却する）"""
+    is_buy, is_sell, qty = [], [], []
+    held = 0.0
+    for _ in range(n):
+        roll = rng.random()
+        if held <= 0 or roll < 0.45:
+            q = round(rng.uniform(0.1, 50), 3) if fractional else float(rng.integers(1, 100))
+            is_buy.append(True)
+            is_sell.append(False)
+            held += q
+        elif roll < 0.55:
+            # 売買以外の区分
+            q = 1.0
+            is_buy.append(False)
+            is_sell.append(False)
+        else:
+            q = held if roll > 0.85 else min(held, round(held * rng.uniform(0.1, 0.9), 3))
+            is_buy.append(False)
+            is_sell.append(True)
+            held -= q
+        qty.append(q)
+    return (
+        np.array(is_buy), np.array(is_sell), np.array(qty),
+        rng.uniform(50, 500, n), rng.uniform(0, 5, n)
+    )
+
+
+def _assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for column in expected:
+        np.testing.assert_allclose(actual[column], expected[column], rtol=1e-9, atol=1e-6, err_msg=column)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('fractional', [False, True])
+def test_replay_matches_sequential(seed, fractional):
+    rng = np.random.default_rng(seed)
+    fills = _random_fills(rng, 200, fractional)
+
+    _assert_same(replay_average_cost(*fills), _replay_average_cost_sequential(*fills))
+
+
+def test_replay_from_snapshot_matches_full_replay():
+    fills = _random_fills(np.random.default_rng(1), 100)
+    full = replay_average_cost(*fills)
+    split = 40
+    initial = (
+        full['position_qty'][split - 1], full['position_total_cost'][split - 1], full['position_avg_cost'][split - 1]
+    )
+
+    resumed = replay_average_cost(*(values[split:] for values in fills), initial=initial)
+
+    for column, values in full.items():
+        np.testing.assert_allclose(resumed[column], values[split:], rtol=1e-9, atol=1e-6, err_msg=column)
+
+
+def test_replay_resets_cost_after_position_is_closed():
+    result = replay_average_cost(
+        np.array([True, False, True, False]), np.array([False, True, False, True]),
+        np.array([10.0, 10.0, 5.0, 2.0]), np.array([100.0, 120.0, 200.0, 210.0]), np.array([10.0, 0.0, 0.0, 0.0])
+    )
+
+    np.testing.assert_allclose(result['avg_cost'], [0, 101, 0, 200])
+    np.testing.assert_allclose(result['pnl_local'], [0, 190, 0, 20])
+    np.testing.assert_allclose(result['position_qty'], [10, 0, 5, 3])
+    np.testing.assert_allclose(result['position_total_cost'], [1010, 0, 1000, 600])
+
+
+def test_replay_marks_sell_without_position_as_orphan():
+    fills = (
+        np.array([False, True, False]), np.array([True, False, True]),
+        np.array([5.0, 10.0, 4.0]), np.array([100.0, 100.0, 110.0]), np.zeros(3)
+    )
+
+    result = replay_average_cost(*fills)
+
+    np.testing.assert_array_equal(result['is_orphan'], [True, False, False])
+    np.testing.assert_array_equal(result['is_realized'], [False, False, True])
+    _assert_same(result, _replay_average_cost_sequential(*fills))
+
+
+def test_replay_empty():
+    empty = np.zeros(0)
+    result = replay_average_cost(empty.astype(bool), empty.astype(bool), empty, empty, empty)
+    assert all(len(values) == 0 for values in result.values())
+
+
+def _trades(rows):
+    import pandas as pd
+    return pd.DataFrame(
+        [
+            {'datetime': pd.Timestamp(dt), 'ticker': ticker, 'name': ticker, 'side': side,
+             'currency': 'USD', 'qty': qty, 'price': price, 'fee': 0.0}
+            for dt, ticker, side, qty, price in rows
+        ]
+    )
+
+
+def test_accounts_are_separated_by_owner(temp_db):
+    from utils.moomoo_store import delete_account, import_trades, list_accounts, load_trades, make_account_key
+    fills = _trades([('2025-01-06 10:00:00', 'AAPL', '買い', 10, 100.0)])
+    import_trades(make_account_key('chatwork:1', 'メイン'), fills)
+    import_trades(make_account_key('chatwork:2', 'メイン'), fills)
+    import_trades(make_account_key('chatwork:2', 'NISA'), fills)
+
+    assert [name for name, _, _ in list_accounts('chatwork:1')] == ['メイン']
+    assert [name for name, _, _ in list_accounts('chatwork:2')] == ['NISA', 'メイン']
+    assert list_accounts('chatwork:3') == []
+
+    assert delete_account(make_account_key('chatwork:2', 'メイン')) == 1
+    assert [name for name, _, _ in list_accounts('chatwork:2')] == ['NISA']
+    assert len(load_trades(make_account_key('chatwork:1', 'メイン'))) == 1
+
+
+def test_reimport_adds_only_new_fills_and_replays(temp_db):
+    from utils.moomoo_store import import_trades, load_trades, make_account_key
+    account = make_account_key('chatwork:1', 'メイン')
+    first = _trades([
+        ('2025-01-06 10:00:00', 'AAPL', '買い', 10, 100.0),
+        ('2025-01-08 10:00:00', 'AAPL', '売り', 5, 120.0),
+    ])
+    import_trades(account, first)
+
+    summary = import_trades(account, _trades([
+        ('2025-01-06 10:00:00', 'AAPL', '買い', 10, 100.0),
+        ('2025-01-07 10:00:00', 'AAPL', '買い', 10, 110.0),
+    ]))
+
+    assert (summary['added'], summary['skipped']) == (1, 1)
+    trades = load_trades(account)
+    np.testing.assert_allclose(trades['position_qty'], [10, 20, 15])
+    np.testing.assert_allclose(trades['pnl_local'], [0, 0, 5 * (120.0 - 105.0)])
@@ -0,0 +1,64 @@
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from utils import price_archive
+
+
+def _days(start, count, price):
+    first = date.fromisoformat(start)
+    return [((first + timedelta(days=i)).isoformat(), price) for i in range(count)]
+
+
+def test_codes_differing_only_in_symbols_use_separate_files(temp_db):
+    assert price_archive.get_archive_path('USDJPY=X') != price_archive.get_archive_path('USDJPY_X')
+
+    price_archive.merge_into_archive('USDJPY=X', _days('2024-01-01', 3, 150.0))
+    price_archive.merge_into_archive('USDJPY_X', _days('2024-01-01', 3, 1.0))
+
+    assert price_archive.read_archived_price('USDJPY=X', '2024-01-02') == 150.0
+    assert price_archive.read_archived_price('USDJPY_X', '2024-01-02') == 1.0
+
+
+def test_archive_with_the_old_file_name_is_migrated(temp_db):
+    old_path = price_archive._get_old_archive_path('USDJPY=X')
+    runs = price_archive._encode_runs(np.array([19723, 19724]), np.array([150.0, 150.0]))
+    price_archive._write_archive(old_path, runs)
+
+    assert price_archive.read_archived_price('USDJPY=X', '2024-01-01') == 150.0
+    assert os.path.exists(price_archive.get_archive_path('USDJPY=X'))
+
+    # 以前のファイル名は 'USDJPY_X' のものでもあり得るため残す
+    price_archive.merge_into_archive('USDJPY=X', _days('2024-01-03', 1, 151.0))
+    assert price_archive.read_archived_price('USDJPY=X', '2024-01-03') == 151.0
+    assert price_archive.read_archived_price('USDJPY_X', '2024-01-03') is None
+
+
+def test_concurrent_appends_keep_every_record(temp_db):
+    price_archive.merge_into_archive('7203.T', _days('2024-01-01', 1, -1.0))
+    # 日ごとに価格を変え、区間をまとめられないようにする
+    batches = [
+        [((date(2024, 1, 2) + timedelta(days=i)).isoformat(), float(i)) for i in range(start, start + 5)]
+        for start in range(0, 200, 5)
+    ]
+    barrier = threading.Barrier(8)
+
+    def append(worker):
+        barrier.wait()
+        for rows in batches[worker::8]:
+            price_archive.merge_into_archive('7203.T', rows)
+
+    threads = [threading.Thread(target=append, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    path = price_archive.get_archive_path('7203.T')
+    count = int(price_archive._read_header(path)['count'])
+    assert count == 201
+    assert os.path.getsize(path) == price_archive.HEADER_SIZE + count * price_archive.RECORD_DTYPE.itemsize
+    prices = price_archive.load_archived_prices(['7203.T'], '2024-01-02', '2024-07-19')['7203.T']
+    np.testing.assert_array_equal(prices.to_numpy(), np.arange(200, dtype=float))
@@ -0,0 +1,55 @@
+import sys
+
+import pytest
+
+from utils import profiler
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    """sleepするサブモジュールを持つ一時パッケージ（パッケージ本体は読み込み済みにする）"""
+    root = tmp_path / 'profiled_pkg'
+    root.mkdir()
+    (root / '__init__.py').write_text('')
+    for name in ('slow', 'other'):
+        (root / f'{name}.py').write_text('import time\ntime.sleep(0.02)\nVALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(profiler, '_imports', {})
+    __import__('profiled_pkg')
+    yield 'profiled_pkg'
+    profiler.disable()
+    for name in list(sys.modules):
+        if name.startswith('profiled_pkg'):
+            del sys.modules[name]
+
+
+def _recorded():
+    return {entry['module']: entry for entry in profiler.get_report()['imports']}
+
+
+def test_from_import_of_new_submodule_is_timed(package):
+    profiler.enable()
+    exec('from profiled_pkg import slow')
+    profiler.disable()
+
+    recorded = _recorded()
+    assert 'profiled_pkg.slow' in recorded
+    assert recorded['profiled_pkg.slow']['inclusive_ms'] >= 15
+
+
+def test_from_import_of_several_new_submodules_is_timed_once(package):
+    profiler.enable()
+    exec('from profiled_pkg import slow, other')
+    profiler.disable()
+
+    assert _recorded()['profiled_pkg.slow, profiled_pkg.other']['inclusive_ms'] >= 30
+
+
+def test_loaded_modules_and_attributes_are_not_timed(package):
+    exec('from profiled_pkg import slow')
+    profiler.enable()
+    exec('from profiled_pkg import slow')
+    exec('from profiled_pkg.slow import VALUE')
+    profiler.disable()
+
+    assert _recorded() == {}
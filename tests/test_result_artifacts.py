@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from utils import result_artifacts
+
+
+def _save(vote_date_str, size, last_used):
+    """size バイトの成果物を保存し、マニフェストの更新時刻を last_used にする"""
+    result_artifacts.save_artifacts(vote_date_str, f'version-{vote_date_str}', {'csv': b'x' * size})
+    manifest = os.path.join(result_artifacts.get_artifact_dir(vote_date_str), result_artifacts.RESULT_ARTIFACT_MANIFEST)
+    os.utime(manifest, (last_used, last_used))
+
+
+def _dates():
+    return sorted(os.listdir(result_artifacts.get_artifact_root()))
+
+
+@pytest.fixture
+def max_bytes(temp_db, monkeypatch):
+    monkeypatch.setattr(result_artifacts, 'RESULT_ARTIFACT_MAX_BYTES', 10 ** 9)
+    return lambda value: monkeypatch.setattr(result_artifacts, 'RESULT_ARTIFACT_MAX_BYTES', value)
+
+
+def test_evicts_least_recently_used_dates(max_bytes):
+    _save('2025-01-06', 10000, 300)
+    _save('2025-01-07', 10000, 100)
+    _save('2025-01-08', 10000, 200)
+
+    max_bytes(25000)
+    _save('2025-01-09', 10000, 400)
+
+    # マニフェストを含めて上限以下になるまで、最後に使われたのが古い日付から削除される
+    assert _dates() == ['2025-01-06', '2025-01-09']
+
+
+def test_keeps_the_date_just_saved(max_bytes):
+    _save('2025-01-06', 1000, 100)
+    max_bytes(0)
+
+    _save('2025-01-07', 1000, 50)
+
+    assert _dates() == ['2025-01-07']
+
+
+def test_dates_without_artifacts_take_no_directory(max_bytes):
+    # 投票のない日付の結果ページを開いてもディレクトリを作らない（削除の対象にならないため）
+    assert result_artifacts.load_manifest('2025-01-05') is None
+    _save('2025-01-06', 10000, 100)
+
+    assert _dates() == ['2025-01-06']
+
+
+def test_reading_artifacts_marks_the_date_as_used(max_bytes):
+    results = [('7203', 3, 'トヨタ自動車')]
+    version = result_artifacts.get_data_version(1, results)
+    result_artifacts.save_artifacts('2025-01-06', version, {'csv': b'x' * 10000})
+    manifest = os.path.join(result_artifacts.get_artifact_dir('2025-01-06'), result_artifacts.RESULT_ARTIFACT_MANIFEST)
+    os.utime(manifest, (100, 100))
+    _save('2025-01-07', 10000, 200)
+
+    # 保存済みの成果物を読むだけ（作り直さない）
+    artifacts = result_artifacts.load_or_build_artifacts('2025-01-06', 1, results)
+    assert artifacts['csv'][1] == b'x' * 10000
+
+    max_bytes(25000)
+    _save('2025-01-08', 10000, 300)
+    assert _dates() == ['2025-01-06', '2025-01-08']
+
+
+def test_rebuilds_when_evicted_while_reading(max_bytes, monkeypatch):
+    monkeypatch.setattr(result_artifacts, 'build_artifacts', lambda date, sessions, results: {'csv': b'rebuilt'})
+    results = [('7203', 3, 'トヨタ自動車')]
+    version = result_artifacts.get_data_version(1, results)
+    result_artifacts.save_artifacts('2025-01-06', version, {'csv': b'saved'})
+
+    read_artifacts = result_artifacts._read_artifacts
+
+    def evicted_before_read(vote_date_str, manifest):
+        monkeypatch.setattr(result_artifacts, '_read_artifacts', read_artifacts)
+        result_artifacts.evict_artifacts(max_bytes=0)
+        return read_artifacts(vote_date_str, manifest)
+
+    monkeypatch.setattr(result_artifacts, '_read_artifacts', evicted_before_read)
+
+    assert result_artifacts.load_or_build_artifacts('2025-01-06', 1, results)['csv'][1] == b'rebuilt'
@@ -0,0 +1,90 @@
+import os
+
+import pandas as pd
+import pytest
+
+
+def _frame(seed, rows=1000):
+    return pd.DataFrame({'Close': [float(seed + i) for i in range(rows)]},
+                        index=pd.date_range('2020-01-01', periods=rows, name='Date'))
+
+
+def test_same_data_is_shared_between_sessions(store):
+    handle_a = store.put('a', 'frame', _frame(1))
+    handle_b = store.put('b', 'frame', _frame(1))
+
+    assert handle_a == handle_b
+    assert store.get('b', handle_a) is store.get('a', handle_a)
+    stats = store.get_stats()
+    assert stats['entries'] == 1
+    assert all(s['shared_bytes'] == s['memory_bytes'] > 0 for s in stats['sessions'])
+
+
+def test_spill_over_budget_and_reload(store, monkeypatch):
+    first = _frame(1)
+    size = int(first.memory_usage(index=True, deep=True).sum())
+    monkeypatch.setattr(store, 'SESSION_STORE_MAX_BYTES', size * 2)
+
+    handles = [store.put('a', 'frame', _frame(seed)) for seed in range(1, 4)]
+
+    # 最後に使われたのが古いものから退避される
+    stats = store.get_stats()
+    assert stats['spilled'] == 1
+    assert stats['memory_bytes'] <= size * 2
+    spilled_path = os.path.join(store._spill_dir, handles[0])
+    assert os.path.exists(spilled_path)
+
+    pd.testing.assert_frame_equal(store.get('a', handles[0]), first, check_freq=False)
+    # 読み戻した代わりに別のデータが退避される
+    assert store.get_stats()['spilled'] == 1
+    assert store._entries[handles[1]].value is None
+
+
+def test_release_removes_spilled_data(store):
+    handle = store.put('a', 'frame', _frame(1))
+    png = store.put('a', 'png', b'\x89PNG data')
+    assert store.spill_all() == 2
+    path = store._entries[handle].path
+
+    store.release('a', [handle])
+
+    assert store.get('a', handle) is None
+    assert not os.path.exists(path)
+    assert store.get('a', png) == b'\x89PNG data'
+
+
+def test_unreferenced_data_in_memory_is_kept_until_over_budget(store, monkeypatch):
+    handle = store.put('a', 'frame', _frame(1))
+    store.release_session('a')
+
+    # 他のセッションが同じデータを取得したときのためにメモリ上には残す
+    assert store.get_stats()['unreferenced'] == 1
+    assert store.put('b', 'frame', _frame(1)) == handle
+
+    store.release_session('b')
+    monkeypatch.setattr(store, 'SESSION_STORE_MAX_BYTES', 0)
+    store.put('c', 'png', b'png')
+    assert handle not in store._entries
+
+
+def test_idle_sessions_are_released(store, monkeypatch):
+    handle = store.put('idle', 'frame', _frame(1))
+    store.spill_all()
+    store._sessions['idle']['last_seen'] -= store.SESSION_STORE_IDLE_SECONDS + 1
+
+    assert store.release_idle_sessions() == 1
+    assert handle not in store._entries
+    assert store.get_stats()['sessions'] == []
+
+
+def test_get_frames_skips_released_handles(store):
+    handles = {'7203': store.put('a', 'frame', _frame(1)), '6758': store.put('a', 'frame', _frame(2))}
+    store.spill_all()
+    store.release('a', [handles['6758']])
+
+    assert list(store.get_frames('a', handles)) == ['7203']
+
+
+def test_unknown_kind(store):
+    with pytest.raises(ValueError):
+        store.put('a', 'text', 'value')
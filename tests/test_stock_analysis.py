@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+from pages import stock_analysis
+
+
+@pytest.fixture
+def downloads(store, monkeypatch):
+    """yfinanceの代わりに呼ばれた回数を記録してデータを返す"""
+    calls = []
+
+    def download(stock_code, start_date, end_date):
+        calls.append(stock_code)
+        columns = pd.MultiIndex.from_product([['Open', 'High', 'Low', 'Close'], [f'{stock_code}.T']])
+        return pd.DataFrame([[1.0, 2.0, 0.5, 1.5]], columns=columns,
+                            index=pd.DatetimeIndex([pd.Timestamp(start_date)], name='Date'))
+
+    monkeypatch.setattr(stock_analysis, 'download_stock_data', download)
+    monkeypatch.setattr(stock_analysis, '_stock_data_handles', {})
+    return calls
+
+
+def test_get_stock_data_reuses_the_stored_frame(downloads, store):
+    handle, df = stock_analysis.get_stock_data('a', '7203', '2025-01-06', '2025-01-10')
+    assert list(df.columns) == ['Open', 'High', 'Low', 'Close']
+
+    # 別のセッションでも保管場所に残っていれば取得し直さない
+    assert stock_analysis.get_stock_data('b', '7203', '2025-01-06', '2025-01-10')[0] == handle
+    assert downloads == ['7203']
+
+    # 保管場所から削除されたら取得し直す
+    store.spill_all()
+    store.release_session('a')
+    store.release_session('b')
+    assert not store.contains(handle)
+    assert stock_analysis.get_stock_data('b', '7203', '2025-01-06', '2025-01-10')[0] == handle
+    assert downloads == ['7203', '7203']
+
+
+def test_bulk_export_refuses_partial_data(downloads, store):
+    handles = {
+        code: stock_analysis.get_stock_data('a', code, '2025-01-06', '2025-01-10')[0]
+        for code in ('7203', '6758')
+    }
+    names = {'7203': 'トヨタ自動車', '6758': 'ソニーグループ'}
+    assert stock_analysis.build_stock_data_zip('a', handles, names)
+
+    store.spill_all()
+    store.release('a', [handles['6758']])
+
+    with pytest.raises(ValueError, match='6758'):
+        stock_analysis.build_stock_data_excel('a', handles, names)
+    with pytest.raises(ValueError, match='6758'):
+        stock_analysis.build_stock_data_zip('a', handles, names)
+
+
+def test_csv_download_reads_the_store_when_clicked(downloads, store):
+    handle, df = stock_analysis.get_stock_data('a', '7203', '2025-01-06', '2025-01-10')
+    assert stock_analysis.build_stock_data_csv('a', '7203', handle) == df.to_csv().encode('utf-8-sig')
+
+    store.spill_all()
+    store.release('a', [handle])
+    with pytest.raises(ValueError, match='7203'):
+        stock_analysis.build_stock_data_csv('a', '7203', handle)
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.vote_trends import (
+    WEEKLY_VALUE_COLUMN, build_vote_matrix, melt_vote_matrix, reduce_vote_matrix, slice_vote_matrix, top_k_codes
+)
+
+
+def expand_on_vote_days(df, vote_days):
+    """以前の pages/result_graph.py の実装（投票日を軸に銘柄ごとにreindexする）"""
+    result = []
+    for code, g in df.groupby("銘柄コード"):
+        g = g.set_index("日付").sort_index()
+        g = g.reindex(vote_days)
+        g["銘柄コード"] = code
+        result.append(g.reset_index(names="日付"))
+    return pd.concat(result, ignore_index=True)
+
+
+def _vote_counts(seed=0, days=200, codes=30):
+    """投票がまばらな日付・銘柄ごとの投票数（load_vote_counts と同じ形）"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2025-01-01', periods=days)
+    rows = [
+        (date, f"{1300 + i} 銘柄{i}", int(rng.integers(1, 20)))
+        for date in dates for i in range(codes)
+        if rng.random() < 0.15
+    ]
+    return pd.DataFrame(rows, columns=["日付", "銘柄コード", "投票数"])
+
+
+def _sorted(df):
+    return df.sort_values(["銘柄コード", "日付"]).reset_index(drop=True)[["日付", "銘柄コード", "投票数"]]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matrix_matches_expand_on_vote_days(seed):
+    df = _vote_counts(seed)
+    start, end = pd.Timestamp('2025-02-01'), pd.Timestamp('2025-06-30')
+    in_window = df[(df["日付"] >= start) & (df["日付"] <= end)]
+    vote_days = pd.DatetimeIndex(sorted(in_window["日付"].unique()), name="日付")
+    expected = expand_on_vote_days(in_window, vote_days)
+
+    window = slice_vote_matrix(build_vote_matrix(df), start, end)
+    actual = melt_vote_matrix(window, list(window.columns))
+
+    pd.testing.assert_frame_equal(_sorted(actual), _sorted(expected), check_dtype=False)
+
+
+def test_empty_counts_and_window():
+    empty = build_vote_matrix(pd.DataFrame(columns=["日付", "銘柄コード", "投票数"]))
+    assert empty.empty
+
+    # 投票のない期間を切り出すと銘柄の列も残らない
+    window = slice_vote_matrix(build_vote_matrix(_vote_counts()), '2030-01-01', '2030-12-31')
+    assert window.shape == (0, 0)
+    assert top_k_codes(window) == []
+    assert melt_vote_matrix(window, ["1300 銘柄0"]).empty
+
+    df, value_column, codes = reduce_vote_matrix(window)
+    assert df.empty
+    assert value_column == "投票数"
+    assert codes == []
+
+
+def test_top_k_codes_breaks_ties_by_code():
+    window = pd.DataFrame({"B": [1.0, 1.0], "A": [2.0, np.nan], "C": [5.0, 1.0]})
+    assert top_k_codes(window, 2) == ["C", "A"]
+
+
+def test_reduce_sums_others_into_one_series():
+    window = slice_vote_matrix(build_vote_matrix(_vote_counts(days=40)), '2025-01-01', '2025-12-31')
+
+    df, value_column, codes = reduce_vote_matrix(window, top_k=5)
+
+    others = [code for code in df["銘柄コード"].unique() if code not in codes]
+    assert len(codes) == 5
+    assert others == [f"その他（{window.shape[1] - 5}銘柄）"]
+    assert value_column == "投票数"
+    assert df[value_column].sum() == window.sum().sum()
+
+
+@pytest.mark.parametrize('span_days, weekly', [(120, False), (121, True)])
+def test_reduce_switches_to_weekly_after_the_boundary(span_days, weekly):
+    start = pd.Timestamp('2025-01-06')  # 月曜日
+    counts = pd.DataFrame({
+        "日付": [start, start + pd.Timedelta(days=span_days)],
+        "銘柄コード": ["1301 A", "1301 A"],
+        "投票数": [3, 4],
+    })
+    window = build_vote_matrix(counts)
+
+    df, value_column, _ = reduce_vote_matrix(window, weekly_after_days=120)
+
+    assert (value_column == WEEKLY_VALUE_COLUMN) is weekly
+    assert df[value_column].sum() == 7
+    if weekly:
+        # 月曜始まりの週で、投票がない週はNaN
+        assert df["日付"].dt.dayofweek.eq(0).all()
+        assert df[value_column].isna().sum() == len(df) - 2
+
+
+def test_weekly_buckets_start_on_monday():
+    sunday, monday = pd.Timestamp('2025-01-05'), pd.Timestamp('2025-01-06')
+    counts = pd.DataFrame({
+        "日付": [sunday, monday, monday + pd.Timedelta(days=6), pd.Timestamp('2025-06-02')],
+        "銘柄コード": ["1301 A"] * 4,
+        "投票数": [1, 2, 3, 4],
+    })
+
+    df, value_column, _ = reduce_vote_matrix(build_vote_matrix(counts), weekly_after_days=120)
+    weekly = df.set_index("日付")[value_column]
+
+    assert weekly[pd.Timestamp('2024-12-30')] == 1
+    assert weekly[monday] == 5
+    assert weekly[pd.Timestamp('2025-06-02')] == 4
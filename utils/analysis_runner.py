@@ -5,6 +5,10 @@ import time
 from utils.db import get_connection, get_vote_results_top_n
 from utils.scorer import StockScorer
 from utils.common import get_ticker, get_stock_name
+from utils.market_calendar import count_trading_days, get_market
+
+# 最後のデータがこの取引日数より古い銘柄は、上場廃止やデータ欠損として除外する
+MAX_STALE_TRADING_DAYS = 5
 
 def fetch_stock_data(stock_code, end_date_str, days_back=180):
     """
@@ -39,10 +43,10 @@ def fetch_stock_data(stock_code, end_date_str, days_back=180):
         if isinstance(df.columns, pd.MultiIndex):
             df.columns = df.columns.get_level_values(0)
             
-        # 取得した最後のデータの日付が、指定したend_dateとあまりに離れていたら除外（例: 5日以上）
-        # ただし休日の場合もあるので厳密にはカレンダーチェックが必要だが、簡易的に
+        # 取得した最後のデータの日付が、指定したend_dateから取引日で数えて離れすぎていたら除外
+        # （取引カレンダーで休場日を除くため、連休明けでも誤って除外しない）
         last_date = df.index[-1]
-        if (end_dt - last_date).days > 10:
+        if count_trading_days(last_date, end_dt, get_market(stock_code)) > MAX_STALE_TRADING_DAYS:
             # print(f"Warning: {stock_code} data is too old (last: {last_date}, target: {end_date_str})")
             return None
             
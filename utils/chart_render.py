@@ -0,0 +1,221 @@
+"""
+株価チャート（ローソク足・折れ線）の描画（Streamlitに依存しない）
+
+mplfinanceの描画はプロセスプールで並列に行う。各ワーカーは起動時にAggバックエンドと
+チャートのスタイルを1回だけ用意し、PNGのバイト列を返す。
+描画結果は utils.render_cache に（銘柄コード・期間・チャートの種類・データのハッシュ）をキーとして保存し、
+同じ期間のデータを取得し直した場合は描画しない。
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from utils import render_cache
+
+logger = logging.getLogger(__name__)
+
+# 描画するプロセス数
+CHART_RENDER_WORKERS = int(os.environ.get('CHART_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+
+# データポイント数がこれを超えると折れ線グラフにする（約1年分の取引日）
+CANDLE_MAX_POINTS = 250
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# ワーカープロセス内で1回だけ作るスタイル
+_mpf_style = None
+
+
+def _get_style():
+    """チャートのスタイル（プロセスごとに1回だけ作成）"""
+    global _mpf_style
+    if _mpf_style is None:
+        import mplfinance as mpf
+        _mpf_style = mpf.make_mpf_style(base_mpf_style='yahoo', marketcolors=mpf.make_marketcolors(
+            up='red',
+            down='blue',
+            edge='inherit',
+            wick='inherit',
+            volume='inherit',
+        ))
+    return _mpf_style
+
+
+def _init_worker():
+    """ワーカープロセスの初期化（画面のないAggバックエンドにしてスタイルを用意）"""
+    import matplotlib
+    matplotlib.use('Agg')
+    _get_style()
+
+
+def get_chart_type(df):
+    """データポイント数に基づいてチャートの種類を決定（'candle' または 'line'）"""
+    return 'line' if len(df) > CANDLE_MAX_POINTS else 'candle'
+
+
+def prepare_chart_frame(df):
+    """
+    mplfinanceで描画できるOHLCVのDataFrameにする（元のDataFrameは変更しない）
+
+    インデックスはDatetimeIndexにし、yfinanceのMultiIndex列はレベル0（Price）を使う。
+    """
+    import pandas as pd
+    df_plot = df.copy()
+    if not isinstance(df_plot.index, pd.DatetimeIndex):
+        df_plot.index = pd.DatetimeIndex(df_plot.index)
+    if isinstance(df_plot.columns, pd.MultiIndex):
+        df_plot.columns = df_plot.columns.get_level_values(0)
+    return df_plot[OHLCV_COLUMNS]
+
+
+def render_chart_png(df_plot, chart_type):
+    """
+    チャートを描画してPNGのバイト列を返す（ワーカープロセスで実行）
+
+    Parameters:
+    df_plot (DataFrame): prepare_chart_frame の結果
+    chart_type (str): 'candle' または 'line'
+    """
+    import mplfinance as mpf
+    import matplotlib.pyplot as plt
+
+    fig, axes = mpf.plot(
+        df_plot,
+        type=chart_type,
+        volume=True,
+        style=_get_style(),
+        returnfig=True,
+        figsize=(12, 8),
+        panel_ratios=(4, 1)
+    )
+    try:
+        buf = BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight')
+        return buf.getvalue()
+    finally:
+        # ワーカーは使い回すため、図を閉じてメモリを解放する
+        plt.close(fig)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Streamlitのスレッドを持つプロセスをforkしないよう、spawnでワーカーを起動する
+            _executor = ProcessPoolExecutor(
+                max_workers=CHART_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+        return _executor
+
+
+def _submit_all(executor, pending):
+    """
+    描画をワーカーに渡す（ワーカーは submit の中で必要な数だけ起動される）
+
+    Streamlitは __main__ をアプリのスクリプト（app.py）にしているため、そのままspawnすると
+    ワーカーは起動時に app.py を実行する（DBの初期化やメンテナンスのスレッドの起動まで行われる）。
+    submit の間だけ __main__ を空のモジュールに差し替え、ワーカーではこのモジュールだけを読み込ませる。
+
+    Returns:
+    dict: {Future: 銘柄コード}
+    """
+    with _executor_lock:
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            return {
+                executor.submit(render_chart_png, df_plot, chart_type): code
+                for code, (key, df_plot, chart_type) in pending.items()
+            }
+        finally:
+            sys.modules['__main__'] = main_module
+
+
+def _reset_executor():
+    """ワーカーが異常終了した場合にプールを作り直す"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def chart_cache_key(code, start_date_str, end_date_str, chart_type, df_plot):
+    """描画結果のキャッシュキー（当日分の株価が更新された場合に備えてデータのハッシュも含める）"""
+    from utils.exports import fingerprint
+    return render_cache.make_key('stock_chart', code, start_date_str, end_date_str, chart_type, fingerprint(df_plot))
+
+
+def render_charts(requests, on_progress=None):
+    """
+    複数銘柄のチャートを描画する
+
+    キャッシュ済みのチャートはそのまま返し、残りをプロセスプールで並列に描画する。
+    プールが使えない場合はこのプロセスで順に描画する。
+
+    Parameters:
+    requests (dict): {銘柄コード: (DataFrame, 開始日, 終了日)}（日付はYYYY-MM-DD形式）
+    on_progress (callable): 1銘柄ごとに on_progress(完了した銘柄数, 銘柄数) で呼ばれる
+
+    Returns:
+    dict: {銘柄コード: (PNGのバイト列, チャートの種類)}（描画に失敗した銘柄は含まない）
+    """
+    results = {}
+    pending = {}
+    total = len(requests)
+
+    def progress():
+        if on_progress is not None:
+            on_progress(len(results), total)
+
+    for code, (df, start_date_str, end_date_str) in requests.items():
+        df_plot = prepare_chart_frame(df)
+        chart_type = get_chart_type(df_plot)
+        key = chart_cache_key(code, start_date_str, end_date_str, chart_type, df_plot)
+        data = render_cache.get(key)
+        if data is not None:
+            results[code] = (data, chart_type)
+            progress()
+        else:
+            pending[code] = (key, df_plot, chart_type)
+
+    if not pending:
+        return results
+
+    try:
+        futures = _submit_all(_get_executor(), pending)
+        for future in as_completed(futures):
+            code = futures[future]
+            key, df_plot, chart_type = pending[code]
+            try:
+                data = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                logger.warning("Rendering the chart for %s failed: %s", code, e)
+                del pending[code]
+                continue
+            del pending[code]
+            render_cache.put(key, data)
+            results[code] = (data, chart_type)
+            progress()
+    except (BrokenProcessPool, OSError) as e:
+        # ワーカーを起動できない環境などでは、このプロセスで描画する
+        logger.warning("Chart render pool unavailable, rendering in process: %s", e)
+        _reset_executor()
+        for code, (key, df_plot, chart_type) in list(pending.items()):
+            data = render_chart_png(df_plot, chart_type)
+            render_cache.put(key, data)
+            results[code] = (data, chart_type)
+            progress()
+    return results
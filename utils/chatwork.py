@@ -14,6 +14,7 @@ ChatWork OAuth & API連携ユーティリティ
 - st.context.cookies を使用してクッキーを読み取り（Streamlit 1.37+）
 """
 import base64
+import functools
 import os
 import hashlib
 import hmac
@@ -25,7 +26,6 @@ from urllib.parse import urlencode, quote
 
 import requests
 import streamlit as st
-from cryptography.fernet import Fernet, InvalidToken
 
 
 # ====== 設定 ======
@@ -61,8 +61,12 @@ COOKIE_MAX_AGE_DAYS = 14  # Refresh Tokenの有効期限に合わせる
 # HMAC署名シークレット（CLIENT_SECRETを使用）
 _HMAC_SECRET = CLIENT_SECRET.encode("utf-8")
 
-# Fernet暗号化用
-_fernet = Fernet(TOKEN_ENCRYPT_KEY.encode("utf-8"))
+
+@functools.lru_cache(maxsize=1)
+def _get_fernet():
+    """Fernet暗号化用（cryptographyの読み込みはクッキーを扱うときまで遅らせる）"""
+    from cryptography.fernet import Fernet
+    return Fernet(TOKEN_ENCRYPT_KEY.encode("utf-8"))
 
 
 def _b64(s: str) -> str:
@@ -137,13 +141,14 @@ def _encrypt_tokens(access_token: str, refresh_token: str, expires_at: float) ->
         "r": refresh_token,
         "e": expires_at
     })
-    return _fernet.encrypt(data.encode("utf-8")).decode("utf-8")
+    return _get_fernet().encrypt(data.encode("utf-8")).decode("utf-8")
 
 
 def _decrypt_tokens(encrypted: str) -> dict | None:
     """暗号化されたトークンを復号"""
+    from cryptography.fernet import InvalidToken
     try:
-        decrypted = _fernet.decrypt(encrypted.encode("utf-8")).decode("utf-8")
+        decrypted = _get_fernet().decrypt(encrypted.encode("utf-8")).decode("utf-8")
         return json.loads(decrypted)
     except (InvalidToken, json.JSONDecodeError):
         return None
@@ -1,5 +1,4 @@
 from datetime import datetime, date
-import yfinance as yf
 from utils.db import get_connection
 
 MAX_SETS = 7            # 銘柄発掘アンケートの入力セット数
@@ -102,8 +101,9 @@ def get_stock_name(stock_code):
         conn.close()
         return result[0]
 
-    # yfinanceから銘柄名を取得
+    # yfinanceから銘柄名を取得（importが重いため、マスタにない場合のみ読み込む）
     try:
+        import yfinance as yf
         ticker = yf.Ticker(get_ticker(stock_code))
         info = ticker.info
         if 'shortName' in info:
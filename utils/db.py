@@ -2,6 +2,7 @@ import sqlite3
 import os
 from datetime import datetime
 import streamlit as st
+from utils import metrics
 
 def get_db_path():
     """データベースファイルのパスを取得"""
@@ -17,8 +18,9 @@ def get_db_path():
 
 def get_connection():
     # SQLite の DB ファイル (survey.db) に接続（マルチスレッド対応のため check_same_thread=False）
+    # 計測が有効な場合はSQL文ごとの時間を記録する接続になる（utils.metrics）
     db_path = get_db_path()
-    return sqlite3.connect(db_path, check_same_thread=False)
+    return sqlite3.connect(db_path, check_same_thread=False, factory=metrics.connection_factory())
 
 @st.cache_resource(ttl=24*3600)  # 24時間（1日）でキャッシュを無効化
 def init_db():
@@ -29,6 +31,10 @@ def init_db():
     conn = get_connection()
     c = conn.cursor()
 
+    # 空きページをバックグラウンドで少しずつ解放できるようにする
+    # （新規DBのみ有効。既存DBの切り替えはutils.maintenance.enable_incremental_vacuumで行う）
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+
     # DB高速化
     c.execute("PRAGMA journal_mode=WAL;")
     c.execute("PRAGMA synchronous=NORMAL;")
@@ -101,6 +107,9 @@ def init_db():
     conn.commit()
     conn.close()
 
+    # 株価キャッシュは為替レートの取得のたびに参照するため、ここで1回だけ作成する
+    init_price_cache_table()
+
     # キャッシュの有効期限を確認するために実行時刻をログ出力
     st.write(f"DBキャッシュ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -119,7 +128,70 @@ def init_price_cache_table():
                 PRIMARY KEY (stock_code, date)
             )
         """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_cache_updated_at ON price_cache (updated_at);")
+        # 保持期間を過ぎた行の抽出（utils.price_archive）は日付で行うため、日付のインデックスを使う
+        cursor.execute("DROP INDEX IF EXISTS idx_price_cache_updated_at;")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_price_cache_date ON price_cache (date);")
+        conn.commit()
+    finally:
+        conn.close()
+
+def init_moomoo_tables():
+    """moomoo証券の取引履歴テーブルを初期化"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS moomoo_trades (
+                account TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                trade_datetime TEXT NOT NULL,
+                trade_date TEXT NOT NULL,
+                ticker TEXT NOT NULL,
+                name TEXT,
+                side TEXT NOT NULL,
+                currency TEXT,
+                qty REAL NOT NULL,
+                price REAL,
+                fee REAL,
+
+                -- 平均法の再生結果（この約定の後の保有状態と実現損益）
+                position_qty REAL,
+                position_total_cost REAL,
+                position_avg_cost REAL,
+                avg_cost_at_sell REAL,
+                pnl_local REAL,
+                is_realized INTEGER,
+                is_orphan INTEGER,
+
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account, fingerprint)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_moomoo_trades_ticker_datetime ON moomoo_trades (account, ticker, trade_datetime);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_moomoo_trades_datetime ON moomoo_trades (account, trade_datetime);")
+        conn.commit()
+    finally:
+        conn.close()
+
+def init_metrics_table():
+    """計測結果（utils.metrics）の保存テーブルを初期化"""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS metrics (
+                collected_at TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                count INTEGER,
+                sum_ms REAL,
+                max_ms REAL,
+                buckets TEXT,  -- utils.metrics.LATENCY_BUCKETS_MS ごとの件数（カンマ区切り）
+                hits INTEGER,
+                misses INTEGER
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_metrics_collected_at ON metrics (collected_at);")
         conn.commit()
     finally:
         conn.close()
@@ -0,0 +1,497 @@
+"""
+データベースのエクスポート/インポート処理
+
+エクスポート: テーブル全体をpandasに読み込まず、fetchmanyでチャンク単位に読み出して
+ZIPのメンバー（NDJSON / CSV / Parquet）へ逐次書き出す。
+投票履歴が増えてもピークメモリはチャンクサイズ分で一定になる。
+管理画面から作成したZIPはDBファイルと同じディレクトリ配下のexportsに保存し、EXPORT_FILE_RETENTION 世代だけ残す。
+
+インポート: アップロードされたZIP（または旧形式のJSON）を逐次読み出し、
+executemanyでバッチ挿入する。大量ロード時はセカンダリインデックスを
+一旦削除し、ロード後に再作成する。
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import time
+import zipfile
+from datetime import datetime
+from utils.db import get_connection, get_db_path, init_moomoo_tables, init_price_cache_table
+
+# エクスポート対象のテーブル（存在しないテーブルはスキップ）
+EXPORT_TABLES = ['stock_master', 'survey', 'vote', 'analysis_results', 'price_cache', 'moomoo_trades']
+
+# fetchmanyで1回に読み出す行数
+EXPORT_CHUNK_SIZE = 5000
+
+# 画面に表示するプレビュー行数
+EXPORT_PREVIEW_ROWS = 100
+
+# 出力形式 {形式: (表示名, 拡張子)}
+EXPORT_FORMATS = {
+    'ndjson': ('NDJSON', 'ndjson'),
+    'csv': ('CSV', 'csv'),
+    'parquet': ('Parquet', 'parquet'),
+}
+
+# ZIP内のメタ情報ファイル名
+MANIFEST_NAME = 'manifest.json'
+
+# 保持するエクスポートファイルの世代数
+EXPORT_FILE_RETENTION = 3
+
+EXPORT_FILE_PREFIX = 'db_backup_'
+EXPORT_FILE_SUFFIX = '.zip'
+
+# CSVでNULLを表す値（空文字と区別する）。この文字で始まる文字列は先頭に1文字重ねて出力する
+CSV_NULL = '\\N'
+
+
+def is_parquet_available():
+    """Parquet出力に必要なpyarrowが利用可能か"""
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_existing_tables(conn, tables=EXPORT_TABLES):
+    """指定テーブルのうちDBに存在するものを、指定順で返す"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing = {row[0] for row in cursor.fetchall()}
+    return [t for t in tables if t in existing]
+
+
+def get_table_columns(conn, table_name):
+    """
+    テーブルのカラム定義を取得
+
+    Returns:
+    list: [(カラム名, 宣言型), ...]
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    return [(row[1], (row[2] or '').upper()) for row in cursor.fetchall()]
+
+
+def iter_table_chunks(conn, table_name, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """テーブルの行をchunk_size件ずつのリストで返すジェネレータ"""
+    cursor = conn.cursor()
+    column_list = ','.join(columns)
+    cursor.execute(f"SELECT {column_list} FROM {table_name}")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _write_ndjson(member, columns, chunks):
+    row_count = 0
+    for rows in chunks:
+        lines = [json.dumps(dict(zip(columns, row)), ensure_ascii=False) for row in rows]
+        member.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        row_count += len(rows)
+    return row_count
+
+
+def _encode_csv_value(value):
+    """NULLを CSV_NULL にする（空文字のまま出力すると、インポート時に空文字とNULLを区別できない）"""
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, str) and value.startswith('\\'):
+        return '\\' + value
+    return value
+
+
+def _decode_csv_value(value):
+    if value == CSV_NULL:
+        return None
+    if value.startswith('\\'):
+        return value[1:]
+    return value
+
+
+def _write_csv(member, columns, chunks):
+    text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    row_count = 0
+    for rows in chunks:
+        writer.writerows([_encode_csv_value(value) for value in row] for row in rows)
+        row_count += len(rows)
+    text.flush()
+    text.detach()
+    return row_count
+
+
+def _arrow_type(declared_type):
+    """SQLiteの宣言型からArrowの型を決める（型親和性の規則に準拠）"""
+    import pyarrow as pa
+    if 'INT' in declared_type:
+        return pa.int64()
+    if any(t in declared_type for t in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return pa.string()
+
+
+def _write_parquet(member, column_defs, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, _arrow_type(declared)) for name, declared in column_defs])
+    writer = pq.ParquetWriter(member, schema, compression='zstd')
+    row_count = 0
+    try:
+        for rows in chunks:
+            # チャンクごとに1つのrow groupとして書き出す
+            arrays = [list(col) for col in zip(*rows)]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(arrays, schema)],
+                schema=schema
+            ))
+            row_count += len(rows)
+        # 空テーブルでもスキーマを残す
+        if row_count == 0:
+            writer.write_table(schema.empty_table())
+    finally:
+        writer.close()
+    return row_count
+
+
+def write_export_zip(fileobj, export_format='ndjson', tables=EXPORT_TABLES, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    データベースの内容をZIPとして書き出す
+
+    Parameters:
+    fileobj: 書き込み先（ファイルパスまたはバイナリファイルオブジェクト）
+    export_format (str): 'ndjson' / 'csv' / 'parquet'
+    tables (list): エクスポート対象のテーブル
+    chunk_size (int): fetchmanyの行数
+
+    Returns:
+    dict: ZIPに格納したマニフェスト（テーブルごとの行数・カラム）
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"未対応の形式です: {export_format}")
+    _, extension = EXPORT_FORMATS[export_format]
+
+    manifest = {
+        'export_date': datetime.now().isoformat(),
+        'format': export_format,
+        'tables': {},
+    }
+    if export_format == 'csv':
+        manifest['csv_null'] = CSV_NULL
+
+    conn = get_connection()
+    try:
+        with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for table_name in get_existing_tables(conn, tables):
+                column_defs = get_table_columns(conn, table_name)
+                columns = [name for name, _ in column_defs]
+                chunks = iter_table_chunks(conn, table_name, columns, chunk_size)
+
+                member_name = f"{table_name}.{extension}"
+                info = zipfile.ZipInfo(member_name, date_time=datetime.now().timetuple()[:6])
+                # Parquetは自前で圧縮済みなので無圧縮で格納
+                info.compress_type = zipfile.ZIP_STORED if export_format == 'parquet' else zipfile.ZIP_DEFLATED
+
+                with zf.open(info, 'w', force_zip64=True) as member:
+                    if export_format == 'ndjson':
+                        row_count = _write_ndjson(member, columns, chunks)
+                    elif export_format == 'csv':
+                        row_count = _write_csv(member, columns, chunks)
+                    else:
+                        row_count = _write_parquet(member, column_defs, chunks)
+
+                manifest['tables'][table_name] = {
+                    'file': member_name,
+                    'columns': columns,
+                    'rows': row_count,
+                }
+
+            zf.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+    finally:
+        conn.close()
+
+    return manifest
+
+
+def get_export_dir():
+    """エクスポートファイルの保存先（DBファイルと同じディレクトリ配下のexports）"""
+    db_dir = os.path.dirname(os.path.abspath(get_db_path()))
+    export_dir = os.path.join(db_dir, 'exports')
+    os.makedirs(export_dir, exist_ok=True)
+    return export_dir
+
+
+def rotate_export_files(keep=EXPORT_FILE_RETENTION):
+    """
+    古いエクスポートファイルを削除し、新しいものからkeep世代だけ残す
+
+    Returns:
+    list: 削除したファイル名
+    """
+    export_dir = get_export_dir()
+    names = sorted(
+        (name for name in os.listdir(export_dir)
+         if name.startswith(EXPORT_FILE_PREFIX) and name.endswith(EXPORT_FILE_SUFFIX)),
+        reverse=True
+    )
+    removed = []
+    for name in names[keep:]:
+        try:
+            os.remove(os.path.join(export_dir, name))
+        except OSError:
+            # 別のセッションが同時に削除した場合
+            continue
+        removed.append(name)
+    return removed
+
+
+def create_export_file(export_format='ndjson', keep=EXPORT_FILE_RETENTION):
+    """
+    エクスポートファイル（ZIP）を get_export_dir に作成する
+
+    一時ファイルへ書き出してからリネームするため、途中で失敗しても不完全なファイルは残らない。
+    作成後は古いファイルを削除し、keep世代だけ残す（ダウンロードされずに残ったファイルが増え続けないようにする）。
+
+    Parameters:
+    export_format (str): 'ndjson' / 'csv' / 'parquet'
+    keep (int): 作成後に残す世代数
+
+    Returns:
+    tuple: (作成したファイルのパス, マニフェスト)
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(get_export_dir(), f"{EXPORT_FILE_PREFIX}{timestamp}_{export_format}{EXPORT_FILE_SUFFIX}")
+    tmp_path = path + '.tmp'
+    try:
+        manifest = write_export_zip(tmp_path, export_format)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    rotate_export_files(keep)
+    return path, manifest
+
+
+# ====== インポート ======
+
+# executemanyで1回に挿入する行数
+IMPORT_BATCH_SIZE = 5000
+
+# この行数以上をロードするテーブルはセカンダリインデックスを削除してから挿入する
+IMPORT_INDEX_REBUILD_THRESHOLD = 50000
+
+
+def _batched(iterable, size):
+    """iterableをsize件ずつのリストに分割するジェネレータ"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            break
+        yield batch
+
+
+def _iter_ndjson_rows(member, columns):
+    text = io.TextIOWrapper(member, encoding='utf-8')
+    for line in text:
+        line = line.strip()
+        if line:
+            record = json.loads(line)
+            yield tuple(record.get(col) for col in columns)
+
+
+def _iter_csv_rows(member, null_marker):
+    text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+    reader = csv.reader(text)
+    next(reader, None)  # ヘッダー行
+    if null_marker is None:
+        # マニフェストにcsv_nullがない以前のエクスポートは、NULLを空文字で出力している
+        for row in reader:
+            yield tuple(value if value != '' else None for value in row)
+    else:
+        for row in reader:
+            yield tuple(_decode_csv_value(value) for value in row)
+
+
+def _read_csv_header(zf, member_name):
+    with zf.open(member_name) as member:
+        text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+        return next(csv.reader(text), [])
+
+
+def _iter_parquet_rows(member, batch_size):
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(member)
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from zip(*(column.to_pylist() for column in record_batch.columns))
+
+
+def iter_import_sources(fileobj, batch_size=IMPORT_BATCH_SIZE):
+    """
+    バックアップファイルからテーブル単位のデータを順に返すジェネレータ
+
+    Yields:
+    tuple: (テーブル名, カラム名リスト, 行のイテレータ, 行数 or None)
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            if MANIFEST_NAME not in zf.namelist():
+                raise ValueError("無効なバックアップファイルです（manifest.jsonがありません）。")
+            manifest = json.loads(zf.read(MANIFEST_NAME))
+            export_format = manifest.get('format')
+            if export_format not in EXPORT_FORMATS:
+                raise ValueError(f"未対応の形式です: {export_format}")
+
+            for table_name, table_info in manifest['tables'].items():
+                member_name = table_info['file']
+                expected_rows = table_info.get('rows')
+                if export_format == 'csv':
+                    columns = _read_csv_header(zf, member_name)
+                else:
+                    columns = table_info['columns']
+
+                with zf.open(member_name) as member:
+                    if export_format == 'ndjson':
+                        rows = _iter_ndjson_rows(member, columns)
+                    elif export_format == 'csv':
+                        rows = _iter_csv_rows(member, manifest.get('csv_null'))
+                    else:
+                        rows = _iter_parquet_rows(member, batch_size)
+                    yield table_name, columns, rows, expected_rows
+    else:
+        # 旧形式（db_backup_*.json）
+        fileobj.seek(0)
+        import_data = json.load(fileobj)
+        if 'tables' not in import_data:
+            raise ValueError("無効なバックアップファイルです。")
+        for table_name, records in import_data['tables'].items():
+            columns = list(records[0].keys()) if records else []
+            rows = (tuple(record.get(col) for col in columns) for record in records)
+            yield table_name, columns, rows, len(records)
+
+
+def validate_import_columns(conn, table_name, columns):
+    """
+    インポートするカラムを実際のテーブル定義と照合する
+
+    Raises:
+    ValueError: 存在しないカラムがある、または必須カラムが不足している場合
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    table_info = cursor.fetchall()  # (cid, name, type, notnull, dflt_value, pk)
+    live_columns = {row[1] for row in table_info}
+
+    unknown = [col for col in columns if col not in live_columns]
+    if unknown:
+        raise ValueError(f"テーブル {table_name} に存在しないカラムが含まれています: {', '.join(unknown)}")
+
+    missing = [
+        row[1] for row in table_info
+        if row[3] and row[4] is None and not row[5] and row[1] not in columns
+    ]
+    if missing:
+        raise ValueError(f"テーブル {table_name} の必須カラムがありません: {', '.join(missing)}")
+
+
+def _drop_secondary_indexes(cursor, table_name):
+    """テーブルの明示的に作成されたインデックスを削除し、再作成用のSQLを返す"""
+    cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table_name,)
+    )
+    indexes = cursor.fetchall()
+    for index_name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{index_name}"')
+    return [sql for _, sql in indexes]
+
+
+def import_database(fileobj, batch_size=IMPORT_BATCH_SIZE,
+                    index_rebuild_threshold=IMPORT_INDEX_REBUILD_THRESHOLD, on_progress=None):
+    """
+    バックアップファイルをデータベースにインポートする（対象テーブルは置き換え）
+
+    全テーブルを1トランザクションで処理し、エラー時はロールバックする。
+
+    Parameters:
+    fileobj: バックアップファイル（ZIPまたは旧形式のJSON）
+    batch_size (int): executemanyの行数
+    index_rebuild_threshold (int): インデックスを削除・再作成する行数の閾値
+    on_progress (callable): on_progress(テーブル名, 挿入済み行数) の進捗コールバック
+
+    Returns:
+    dict: {'tables': {テーブル名: 行数}, 'rows': 合計行数, 'elapsed': 秒, 'rows_per_sec': 行/秒}
+    """
+    # price_cache・moomoo_tradesは各ページの初回利用時に作成されるため、未作成なら作っておく
+    init_price_cache_table()
+    init_moomoo_tables()
+
+    conn = get_connection()
+    table_rows = {}
+    start_time = time.perf_counter()
+    try:
+        c = conn.cursor()
+        live_tables = get_existing_tables(conn)
+
+        c.execute("BEGIN TRANSACTION")
+        for table_name, columns, rows, expected_rows in iter_import_sources(fileobj, batch_size):
+            if table_name not in live_tables:
+                raise ValueError(f"インポート対象外のテーブルです: {table_name}")
+            # 旧形式のJSONでは空のテーブルのカラムがわからないため、照合せずに空にするだけにする
+            if columns:
+                validate_import_columns(conn, table_name, columns)
+
+            # テーブルを空にする
+            c.execute(f"DELETE FROM {table_name}")
+
+            # 大量ロード時はインデックスを後から一括作成する
+            rebuild_sqls = []
+            if expected_rows is None or expected_rows >= index_rebuild_threshold:
+                rebuild_sqls = _drop_secondary_indexes(c, table_name)
+
+            inserted = 0
+            if columns:
+                placeholders = ','.join(['?'] * len(columns))
+                insert_sql = f"INSERT INTO {table_name} ({','.join(columns)}) VALUES ({placeholders})"
+                for batch in _batched(rows, batch_size):
+                    c.executemany(insert_sql, batch)
+                    inserted += len(batch)
+                    if on_progress is not None:
+                        on_progress(table_name, inserted)
+
+            for sql in rebuild_sqls:
+                c.execute(sql)
+
+            table_rows[table_name] = inserted
+
+        # 統計情報の更新
+        c.execute("ANALYZE;")
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start_time
+    total_rows = sum(table_rows.values())
+    return {
+        'tables': table_rows,
+        'rows': total_rows,
+        'elapsed': elapsed,
+        'rows_per_sec': total_rows / elapsed if elapsed > 0 else 0,
+    }
@@ -0,0 +1,160 @@
+"""
+投票銘柄の株価評価（Streamlitに依存しない）
+
+投票日の翌日から評価期間最終日までの始値・終値で銘柄ごとの損益率を計算し、
+日本株と米国株に分けてベンチマークの指数と並べる。ページ（pages/stock_evaluation.py）は表示だけを行う。
+"""
+import pandas as pd
+from datetime import timedelta
+import yfinance as yf
+from utils.db import get_connection
+from utils.common import get_stock_name, get_ticker
+from utils import metrics
+from functools import lru_cache
+
+# 市場ごとのベンチマーク（結果の表に1行追加する）
+BENCHMARK_INDICES = {
+    'japan': {'銘柄コード': '^N225', '銘柄名': '日経平均株価', '投票数': 1},
+    'us': {'銘柄コード': 'NDX', '銘柄名': 'NASDAQ-100', '投票数': 1},
+}
+INDEX_CODES = [index['銘柄コード'] for index in BENCHMARK_INDICES.values()]
+
+# 市場ごとの損益額の列名
+PROFIT_COLUMNS = {'japan': '損益額(円)', 'us': '損益額($)'}
+
+@lru_cache(maxsize=400)
+def get_stock_price(stock_code, start_date, end_date):
+    """
+    株価を取得する関数（キャッシュ付き）
+    
+    Parameters:
+    stock_code (str): 銘柄コード
+    start_date (str): 開始日（YYYY-MM-DD形式）
+    end_date (str): 終了日（YYYY-MM-DD形式）
+    
+    Returns:
+    tuple: (始値, 終値) または (None, None)
+    """
+    try:
+        # yfinanceのTicker形式に変換
+        ticker = get_ticker(stock_code)
+        
+        # 終了日を翌日にずらす（yfinanceは[start, end)の半開区間）
+        end_date_plus_one = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        
+        # 株価データを取得
+        df = yf.download(
+            ticker,
+            start=start_date,
+            end=end_date_plus_one,
+            progress=False,
+            threads=False,
+            auto_adjust=True
+        )
+        
+        if df.empty:
+            return None, None
+            
+        # 開始日と終了日の株価を取得
+        start_price = float(df.iloc[0]["Open"].iloc[0])
+        end_price = float(df.iloc[-1]["Close"].iloc[0])
+        
+        return start_price, end_price
+        
+    except Exception as e:
+        return None, None
+
+metrics.register_cache('evaluation.get_stock_price', get_stock_price)
+
+def get_voted_stocks(vote_date_str):
+    """
+    投票日の銘柄コードと投票数を取得する関数
+
+    Parameters:
+    vote_date_str (str): 投票日（YYYY-MM-DD形式）
+
+    Returns:
+    list: [(銘柄コード, 投票数), ...]
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT stock_code, COUNT(*) as vote_count
+            FROM vote
+            WHERE vote_date = ?
+            GROUP BY stock_code
+        """, (vote_date_str,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def _evaluate_stock(stock_code, stock_name, vote_count, start_date, end_date):
+    """1銘柄の損益を計算（株価を取得できない場合はNone）"""
+    start_price, end_price = get_stock_price(stock_code, start_date, end_date)
+    if start_price is None or end_price is None:
+        return None
+    profit_rate = ((end_price - start_price) / start_price) * 100
+    profit_amount = end_price - start_price
+    return {
+        '銘柄コード': stock_code,
+        '銘柄名': stock_name,
+        '投票数': vote_count,
+        '始値': start_price,
+        '終値': end_price,
+        '損益率(%)': round(profit_rate, 2),
+        '損益額': round(profit_amount, 2)
+    }
+
+def evaluate_votes(vote_date, end_date, voted_stocks, on_progress=None):
+    """
+    投票銘柄の評価期間の損益を計算する関数
+
+    Parameters:
+    vote_date (date): 投票日（翌日の始値から評価する）
+    end_date (date): 評価期間最終日
+    voted_stocks (list): [(銘柄コード, 投票数), ...]（get_voted_stocks の結果）
+    on_progress (callable): 1銘柄ごとに on_progress(処理済みの銘柄数, 銘柄数) で呼ばれる
+
+    Returns:
+    dict: {
+        'japan': 日本株のDataFrame（結果がない場合はNone）,
+        'us': 米国株のDataFrame（結果がない場合はNone）,
+        'errors': [(銘柄コード, エラーメッセージ), ...]
+    }
+    DataFrameは指数の行を含み、投票数の降順でNo.列を持つ。
+    """
+    start_date = (vote_date + timedelta(days=1)).strftime("%Y-%m-%d")
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    results = {'japan': [], 'us': []}
+    errors = []
+    total_stocks = len(voted_stocks)
+
+    for i, (stock_code, vote_count) in enumerate(voted_stocks):
+        try:
+            result = _evaluate_stock(stock_code, get_stock_name(stock_code), vote_count, start_date, end_date_str)
+            if result is not None:
+                # 日本株と米国株で分ける
+                results['japan' if stock_code[0].isdigit() else 'us'].append(result)
+        except Exception as e:
+            errors.append((stock_code, str(e)))
+        if on_progress is not None:
+            on_progress(i + 1, total_stocks)
+
+    frames = {}
+    for market, rows in results.items():
+        if not rows:
+            frames[market] = None
+            continue
+        index = BENCHMARK_INDICES[market]
+        index_result = _evaluate_stock(index['銘柄コード'], index['銘柄名'], index['投票数'], start_date, end_date_str)
+        if index_result is not None:
+            rows = rows + [index_result]
+        df = pd.DataFrame(rows).rename(columns={'損益額': PROFIT_COLUMNS[market]})
+        # 投票数で降順ソート
+        df = df.sort_values('投票数', ascending=False)
+        # No.列を追加
+        df.insert(0, 'No.', range(1, len(df) + 1))
+        frames[market] = df
+
+    return {'japan': frames['japan'], 'us': frames['us'], 'errors': errors}
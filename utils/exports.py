@@ -0,0 +1,349 @@
+"""
+ダウンロード用ファイル（CSV・Excel・ZIP）の遅延作成
+
+st.download_button の data に lazy_export の戻り値（引数なしの関数）を渡すと、
+ファイルはボタンがクリックされたときに初めて作成される。作成結果は入力データのフィンガープリントをキーに
+プロセス内で保持し、同じデータのダウンロードでは作り直さない（セッションをまたいで共有する）。
+表示のたびにかかるのはフィンガープリントの計算だけで、使われない形式のシリアライズは行わない。
+"""
+import csv
+import hashlib
+import importlib.util
+import json
+import threading
+import zipfile
+from collections import OrderedDict
+from io import BytesIO, StringIO
+from utils import metrics
+
+# 作成済みファイルを保持する合計サイズの上限（バイト）
+EXPORT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Excelの列幅を測るときに使う行数
+EXCEL_WIDTH_SAMPLE_ROWS = 100
+
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+_cache = OrderedDict()  # {(作成関数名, フィンガープリント): bytes}
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def fingerprint(*parts):
+    """
+    入力データのフィンガープリント
+
+    DataFrameは pandas.util.hash_pandas_object で値とインデックスを、
+    dictは各値を、その他はJSONの文字列をハッシュする。
+
+    Returns:
+    str: SHA-256の16進文字列
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        _update_digest(digest, part)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, part):
+    import pandas as pd
+    if isinstance(part, pd.DataFrame):
+        digest.update(repr(list(part.columns)).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+    elif isinstance(part, dict):
+        for key, value in part.items():
+            digest.update(repr(key).encode('utf-8'))
+            _update_digest(digest, value)
+    else:
+        digest.update(json.dumps(part, ensure_ascii=False, default=str).encode('utf-8'))
+    digest.update(b'\0')
+
+
+def _get_cached(key):
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+    metrics.count_cache('exports', data is not None)
+    return data
+
+
+def _put_cached(key, data):
+    global _cache_bytes
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = data
+        _cache_bytes += len(data)
+        # 上限を超えた分を最後に使われたのが古いものから削除
+        while _cache_bytes > EXPORT_CACHE_MAX_BYTES and len(_cache) > 1:
+            _, removed = _cache.popitem(last=False)
+            _cache_bytes -= len(removed)
+
+
+def lazy_export(builder, *args, key=None):
+    """
+    ダウンロード時にファイルを作成する関数を返す
+
+    Parameters:
+    builder (callable): builder(*args) でファイルのバイト列を返す関数
+    args: builder に渡す引数
+    key (str): フィンガープリント（Noneの場合は args から計算する）
+
+    Returns:
+    callable: 引数なしでバイト列を返す関数（st.download_button の data に渡す。Streamlit 1.52.0 以降）
+    """
+    cache_key = (f"{builder.__module__}.{builder.__qualname__}", key or fingerprint(*args))
+
+    def build():
+        data = _get_cached(cache_key)
+        if data is None:
+            data = builder(*args)
+            _put_cached(cache_key, data)
+        return data
+
+    return build
+
+
+def build_csv_sjis(headers, rows):
+    """ヘッダーと行からShift-JISのCSVを作成（Excelでそのまま開けるようにする）"""
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return output.getvalue().encode('shift-jis', errors='replace')
+
+
+def build_vote_csv(results, count_column):
+    """
+    集計結果のCSV（Shift-JIS）を作成
+
+    Parameters:
+    results (list): [(銘柄コード, 票数, 銘柄名), ...]
+    count_column (str): 票数の列名（'投票数' など）
+    """
+    headers = ['銘柄コード', count_column, '銘柄名', 'TradingView URL']
+    rows = [(row[0], row[1], row[2] or row[0], f'https://jp.tradingview.com/chart/?symbol={row[0]}') for row in results]
+    return build_csv_sjis(headers, rows)
+
+
+def _excel_value(value):
+    """Excelに書き込める値にする（NaNは空欄、pandasの日時はタイムゾーンなしのdatetime）"""
+    import pandas as pd
+    if value is None:
+        return None
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, pd.Timestamp):
+        if value.tzinfo is not None:
+            value = value.tz_localize(None)
+        return value.to_pydatetime()
+    return value
+
+
+def _column_widths(headers, rows, formats):
+    """
+    列幅を見出しと一部の行の文字数から計算
+
+    行は最大 EXCEL_WIDTH_SAMPLE_ROWS 件を等間隔に抜き出して測る（全行を文字列にしない）。
+    書式を指定した列（日付など）は書式の文字数で測る。
+    """
+    step = max(1, len(rows) // EXCEL_WIDTH_SAMPLE_ROWS)
+    sample = rows[::step]
+    widths = []
+    for col, header in enumerate(headers):
+        if col in formats:
+            length = len(formats[col])
+        else:
+            length = max((len(str(row[col])) for row in sample if col < len(row) and row[col] is not None), default=0)
+        widths.append(max(length, len(str(header))) + 2)
+    return widths
+
+
+def _write_excel_xlsxwriter(sheets):
+    import xlsxwriter
+
+    output = BytesIO()
+    # constant_memory: 行を書き終えるたびにディスクへ書き出し、メモリに保持しない
+    workbook = xlsxwriter.Workbook(output, {'in_memory': False, 'constant_memory': True})
+    cell_formats = {}
+    link_format = workbook.get_default_url_format()
+    for sheet in sheets:
+        worksheet = workbook.add_worksheet(sheet['name'])
+        formats = sheet.get('formats', {})
+        links = sheet.get('links', {})
+        # 列ごとの書式と幅は1回だけ設定する
+        for col, width in enumerate(_column_widths(sheet['headers'], sheet['rows'], formats)):
+            number_format = formats.get(col)
+            if number_format is not None and number_format not in cell_formats:
+                cell_formats[number_format] = workbook.add_format({'num_format': number_format})
+            worksheet.set_column(col, col, width, cell_formats.get(number_format))
+
+        for col, header in enumerate(sheet['headers']):
+            url = sheet.get('header_links', {}).get(col)
+            if url:
+                worksheet.write_url(0, col, url, link_format, string=header)
+            else:
+                worksheet.write(0, col, header)
+
+        for row_idx, row in enumerate(sheet['rows'], start=1):
+            for col, value in enumerate(row):
+                value = _excel_value(value)
+                if col in links:
+                    worksheet.write_url(row_idx, col, links[col][row_idx - 1], link_format, string=str(value))
+                elif value is None:
+                    continue
+                elif col in formats:
+                    worksheet.write(row_idx, col, value, cell_formats[formats[col]])
+                else:
+                    worksheet.write(row_idx, col, value)
+    workbook.close()
+    return output.getvalue()
+
+
+def _write_excel_openpyxl(sheets):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    # write_only: 行を追加するたびにXMLへ書き出し、セルをメモリに保持しない
+    workbook = Workbook(write_only=True)
+    for sheet in sheets:
+        worksheet = workbook.create_sheet(sheet['name'])
+        formats = sheet.get('formats', {})
+        links = sheet.get('links', {})
+        # 列幅は行を追加する前に設定する
+        for col, width in enumerate(_column_widths(sheet['headers'], sheet['rows'], formats)):
+            worksheet.column_dimensions[get_column_letter(col + 1)].width = width
+
+        header_cells = []
+        for col, header in enumerate(sheet['headers']):
+            cell = WriteOnlyCell(worksheet, value=header)
+            url = sheet.get('header_links', {}).get(col)
+            if url:
+                cell.hyperlink = url
+                cell.style = 'Hyperlink'
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+
+        # 書式付きのセルは列ごとに1つ作って値だけ差し替える（追加した時点で書き出される）
+        format_cells = {col: WriteOnlyCell(worksheet) for col in formats}
+        for col, cell in format_cells.items():
+            cell.number_format = formats[col]
+
+        for row_idx, row in enumerate(sheet['rows']):
+            values = []
+            for col, value in enumerate(row):
+                value = _excel_value(value)
+                if col in links:
+                    cell = WriteOnlyCell(worksheet, value=value)
+                    cell.hyperlink = links[col][row_idx]
+                    cell.style = 'Hyperlink'
+                    values.append(cell)
+                elif col in format_cells and value is not None:
+                    format_cells[col].value = value
+                    values.append(format_cells[col])
+                else:
+                    values.append(value)
+            worksheet.append(values)
+
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def write_excel(sheets):
+    """
+    Excelファイルを作成（xlsxwriterがあれば使い、なければopenpyxlの書き込み専用モードで作成）
+
+    どちらも行を順に書き出すだけで、書き込んだ後にセルを1つずつ読み直して加工しない。
+
+    Parameters:
+    sheets (list): シートごとの dict
+        name (str): シート名
+        headers (list): 見出し
+        rows (list): 行のリスト（各行は値のリスト）
+        formats (dict): {列番号: 表示形式}（例: {0: 'yyyy/m/d'}）
+        links (dict): {列番号: 行ごとのURLのリスト}
+        header_links (dict): {列番号: 見出しに付けるURL}
+
+    Returns:
+    bytes: xlsxファイルのバイト列
+    """
+    if importlib.util.find_spec('xlsxwriter') is None:
+        return _write_excel_openpyxl(sheets)
+    return _write_excel_xlsxwriter(sheets)
+
+
+def build_vote_excel(results, count_column, sheet_name):
+    """
+    集計結果のExcelファイルを作成（銘柄名にTradingViewへのリンクを付ける）
+
+    Parameters:
+    results (list): [(銘柄コード, 票数, 銘柄名), ...]
+    count_column (str): 票数の列名
+    sheet_name (str): シート名
+    """
+    return write_excel([{
+        'name': sheet_name,
+        'headers': ['銘柄コード', count_column, '銘柄名'],
+        'rows': [[row[0], row[1], row[2] or row[0]] for row in results],
+        'links': {2: [f'https://jp.tradingview.com/chart/?symbol={row[0]}' for row in results]},
+    }])
+
+
+def _stock_sheet_name(code, name):
+    sheet_name = f"{code}_{name}"
+    # シート名が長すぎる場合は短縮
+    if len(sheet_name) > 31:  # Excelのシート名の最大長
+        sheet_name = f"{code}_{name[:20]}"
+    return sheet_name
+
+
+def _dataframe_rows(df):
+    """インデックスと各列の値を行のリストにする（列ごとに tolist してPythonの値にする）"""
+    columns = [df.index.tolist()] + [df.iloc[:, i].tolist() for i in range(df.shape[1])]
+    return [list(row) for row in zip(*columns)]
+
+
+def build_stock_data_excel(stock_data, stock_names):
+    """
+    銘柄ごとの株価データを1銘柄1シートのExcelファイルにする
+
+    列の見出しは yfinance のMultiIndex（Price, Ticker）の場合は Price だけにする。
+
+    Parameters:
+    stock_data (dict): {銘柄コード: DataFrame（インデックスは日付）}
+    stock_names (dict): {銘柄コード: 銘柄名}
+    """
+    sheets = []
+    for code, df in stock_data.items():
+        columns = [col[0] if isinstance(col, tuple) else col for col in df.columns]
+        sheets.append({
+            'name': _stock_sheet_name(code, stock_names[code]),
+            'headers': [df.index.name or 'Date'] + [str(col) for col in columns] + ['TradingView URL'],
+            'rows': _dataframe_rows(df),
+            'formats': {0: 'yyyy/m/d'},
+            'header_links': {len(columns) + 1: f'https://jp.tradingview.com/chart/?symbol={code}'},
+        })
+    return write_excel(sheets)
+
+
+def build_stock_data_zip(stock_data, stock_names):
+    """銘柄ごとの株価データのCSV（UTF-8 BOM付き）をまとめたZIPファイルを作成"""
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for code, df in stock_data.items():
+            csv_data = df.to_csv().encode('utf-8-sig')
+            # UTF-8フラグを設定してファイル名の文字化けを防止
+            file_name = f"{code}_{stock_names[code]}_stock_data.csv"
+            zip_info = zipfile.ZipInfo(file_name)
+            zip_info.flag_bits |= 0x800  # UTF-8フラグ（bit 11）を設定
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            zip_file.writestr(zip_info, csv_data)
+    return zip_buffer.getvalue()
+
+
+def build_dataframe_csv(df):
+    """DataFrameのCSV（UTF-8 BOM付き）を作成"""
+    return df.to_csv().encode('utf-8-sig')
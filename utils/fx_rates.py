@@ -0,0 +1,181 @@
+"""
+USD/JPY為替レートの系列取得
+
+指定期間のレートを1回のダウンロードでまとめて取得し、price_cache（'USDJPY=X'）へ保存する。
+土日・休場日は直前の終値で補完した暦日ごとの系列として扱うため、
+複数日のレートをまとめて引く場合も reindex だけで済む。
+当日分は終値が確定していないため保存せず、1時間ごとにプロセス内で保持する。
+"""
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from utils import metrics
+from utils.db import get_connection
+from utils.price_archive import load_archived_prices
+
+FX_TICKER = 'USDJPY=X'
+
+# 期間の先頭が休場日でも直前の終値で補完できるよう、前に余分に取得する日数
+FX_LOOKBACK_DAYS = 7
+
+_today_rate = {}  # {(日付, 時): 当日のレート}（1時間ごとに取り直す）
+_today_rate_lock = threading.Lock()
+
+
+def _today_rate_key():
+    now = datetime.now()
+    return (now.strftime('%Y-%m-%d'), now.hour)
+
+
+def _get_today_rate():
+    with _today_rate_lock:
+        return _today_rate.get(_today_rate_key())
+
+
+def _set_today_rate(rate):
+    with _today_rate_lock:
+        _today_rate.clear()
+        _today_rate[_today_rate_key()] = rate
+
+
+def _to_timestamp(value):
+    return pd.Timestamp(value).normalize()
+
+
+def _read_cached_rates(index):
+    """アーカイブとprice_cacheから期間内の保存済みレートを取得"""
+    start_date = index[0].strftime('%Y-%m-%d')
+    end_date = index[-1].strftime('%Y-%m-%d')
+    rates = load_archived_prices([FX_TICKER], start_date, end_date)[FX_TICKER]
+
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT date, price FROM price_cache
+            WHERE stock_code = ? AND date BETWEEN ? AND ?
+        """, (FX_TICKER, start_date, end_date)).fetchall()
+    finally:
+        conn.close()
+
+    if rows:
+        cached = pd.Series([price for _, price in rows], index=pd.to_datetime([d for d, _ in rows]))
+        rates = cached.combine_first(rates)
+    return rates.reindex(index)
+
+
+def _download_rates(start, end):
+    """yfinanceから期間内の終値を取得（end の日を含む）"""
+    df = yf.download(
+        FX_TICKER,
+        start=(start - pd.Timedelta(days=FX_LOOKBACK_DAYS)).strftime('%Y-%m-%d'),
+        end=(end + pd.Timedelta(days=1)).strftime('%Y-%m-%d'),
+        progress=False,
+        threads=False,
+        auto_adjust=True
+    )
+    if df.empty:
+        return pd.Series(dtype=float)
+
+    close = df['Close']
+    # MultiIndex列の場合はDataFrameになる
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    close = close.dropna()
+    close.index = pd.DatetimeIndex(close.index).tz_localize(None).normalize()
+    return close[~close.index.duplicated(keep='last')]
+
+
+def _save_rates(rates):
+    """補完済みの日次レートをprice_cacheへ保存"""
+    if rates.empty:
+        return
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    try:
+        conn.executemany("""
+            INSERT OR REPLACE INTO price_cache
+            (stock_code, date, price, currency, updated_at)
+            VALUES (?, ?, ?, 'FX', ?)
+        """, [
+            (FX_TICKER, ts.strftime('%Y-%m-%d'), float(rate), updated_at)
+            for ts, rate in rates.items()
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_fx_series(start_date, end_date):
+    """
+    期間内の日次USD/JPYレートを取得（暦日、休場日は直前の終値で補完）
+
+    保存済みでない日があれば、その範囲を1回だけダウンロードして保存する。
+    当日分は終値が確定していないため保存せず、同じ時間帯の呼び出しではプロセス内に保持したレートを使う。
+
+    Parameters:
+    start_date (date | str): 開始日
+    end_date (date | str): 終了日（この日を含む）
+
+    Returns:
+    pandas.Series: 日付をインデックスとするレート（取得できなかった日はNaN）
+    """
+    index = pd.date_range(_to_timestamp(start_date), _to_timestamp(end_date), freq='D')
+    if len(index) == 0:
+        return pd.Series(dtype=float)
+
+    rates = _read_cached_rates(index)
+
+    today = pd.Timestamp.today().normalize()
+    if today in index and np.isnan(rates[today]):
+        today_rate = _get_today_rate()
+        if today_rate is not None:
+            rates[today] = today_rate
+    missing = index[rates.isna().to_numpy() & (index <= today)]
+    metrics.count_cache('fx_rates', len(missing) == 0)
+    if len(missing) == 0:
+        return rates
+
+    try:
+        closes = _download_rates(missing[0], missing[-1])
+    except Exception:
+        return rates
+    if closes.empty:
+        return rates
+
+    # 取得した終値を暦日に展開し、休場日は直前の終値で補完
+    daily = closes.reindex(pd.date_range(closes.index[0], missing[-1], freq='D')).ffill()
+    fetched = daily.reindex(missing).dropna()
+    _save_rates(fetched[fetched.index < today])
+    if today in fetched.index:
+        _set_today_rate(float(fetched[today]))
+    return fetched.combine_first(rates).reindex(index)
+
+
+def get_fx_rates(dates):
+    """
+    複数日のUSD/JPYレートをまとめて取得
+
+    Parameters:
+    dates (list): 日付のリスト（date, datetime, 'YYYY-MM-DD'のいずれか）
+
+    Returns:
+    numpy.ndarray: 各日付のレート（取得できなかった日はNaN）
+    """
+    if len(dates) == 0:
+        return np.empty(0)
+    index = pd.DatetimeIndex([_to_timestamp(d) for d in dates])
+    rates = load_fx_series(index.min(), index.max())
+    return rates.reindex(index).to_numpy(dtype=float)
+
+
+def get_fx_rate(target_date):
+    """
+    指定日のUSD/JPYレートを取得
+
+    Returns:
+    float: レート、または取得できなかった場合は None
+    """
+    rate = get_fx_rates([target_date])[0]
+    return None if np.isnan(rate) else float(rate)
@@ -0,0 +1,218 @@
+"""
+データベースのバックグラウンドメンテナンス
+
+VACUUMによる全体の書き直しは実行中すべての接続をロックするため、
+バックグラウンドのタイマーで小さな単位（スライス）に分けて実行する。
+- PRAGMA wal_checkpoint(PASSIVE): 読み書き中の接続を待たずにできる範囲だけチェックポイント
+- PRAGMA incremental_vacuum(N): 空きページをN件ずつ解放（auto_vacuum=INCREMENTAL時）
+- PRAGMA optimize: 定期的に統計情報を更新
+- 株価キャッシュのアーカイブ: 保持期間を過ぎた price_cache の行を1日1回アーカイブへ移動
+- 計測が有効な場合は、スライスごとに集計結果をPrometheus形式のファイルへ書き出す（utils.metrics）
+各スライスがDBを占有した時間はログに出力し、直近分をメモリに保持する。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import streamlit as st
+from utils import metrics
+from utils.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# スライスの実行間隔（秒）
+MAINTENANCE_INTERVAL = 60
+
+# 1スライスで解放する空きページ数
+MAINTENANCE_VACUUM_PAGES = 200
+
+# PRAGMA optimize の実行間隔（秒）
+MAINTENANCE_OPTIMIZE_INTERVAL = 6 * 3600
+
+# 株価キャッシュのアーカイブ間隔（秒）
+MAINTENANCE_ARCHIVE_INTERVAL = 24 * 3600
+
+# メモリに保持するスライスログの件数
+MAINTENANCE_LOG_SIZE = 200
+
+AUTO_VACUUM_MODES = {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}
+
+_slice_log = deque(maxlen=MAINTENANCE_LOG_SIZE)
+_slice_log_lock = threading.Lock()
+
+
+def _run_timed(conn, task, sql, as_script=False):
+    """SQLを実行し、DBを占有した時間を記録する"""
+    started_at = datetime.now()
+    start = time.perf_counter()
+    if as_script:
+        # incremental_vacuumはステップごとに1ページずつ解放するため、
+        # 最後までステップを進めるexecutescriptで実行する
+        conn.executescript(sql)
+        rows = []
+    else:
+        rows = conn.execute(sql).fetchall()
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    result = ', '.join(str(v) for v in rows[0]) if rows else ''
+    _record_slice(task, started_at, duration_ms, result)
+    return rows
+
+
+def _record_slice(task, started_at, duration_ms, result):
+    with _slice_log_lock:
+        _slice_log.append({
+            'started_at': started_at,
+            'task': task,
+            'duration_ms': duration_ms,
+            'result': result,
+        })
+    logger.info("DB maintenance %s held the database for %.1f ms (%s)", task, duration_ms, result)
+
+
+def _get_maintenance_connection():
+    # PRAGMAを暗黙のトランザクションに含めないよう自動コミットモードで接続
+    conn = get_connection()
+    conn.isolation_level = None
+    return conn
+
+
+def get_slice_log():
+    """直近のスライスログを新しい順に取得"""
+    with _slice_log_lock:
+        return list(reversed(_slice_log))
+
+
+def get_database_status():
+    """
+    メンテナンスに関するDBの状態を取得
+
+    Returns:
+    dict: auto_vacuum（モード名）, page_size, page_count, freelist_count
+    """
+    conn = get_connection()
+    try:
+        return {
+            'auto_vacuum': AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum;").fetchone()[0], 'UNKNOWN'),
+            'page_size': conn.execute("PRAGMA page_size;").fetchone()[0],
+            'page_count': conn.execute("PRAGMA page_count;").fetchone()[0],
+            'freelist_count': conn.execute("PRAGMA freelist_count;").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def run_maintenance_slice(vacuum_pages=MAINTENANCE_VACUUM_PAGES, optimize=False, archive=False):
+    """
+    メンテナンスを1スライス分実行する
+
+    Parameters:
+    vacuum_pages (int): incremental_vacuumで解放するページ数の上限
+    optimize (bool): PRAGMA optimize も実行するか
+    archive (bool): 保持期間を過ぎた株価キャッシュをアーカイブへ移動するか
+
+    Returns:
+    dict: アーカイブを実行した場合はその結果（utils.price_archive.archive_price_cache）、それ以外はNone
+    """
+    summary = None
+    if archive:
+        # numpy/pandasを使うため、アプリ起動時ではなく初回のアーカイブ時に読み込む
+        from utils.price_archive import archive_price_cache
+        # 移動で空いたページを同じスライスのincremental_vacuumで解放する
+        started_at = datetime.now()
+        start = time.perf_counter()
+        summary = archive_price_cache()
+        _record_slice(
+            'price_archive', started_at, (time.perf_counter() - start) * 1000,
+            f"{summary['tickers']} tickers, {summary['rows']} rows"
+        )
+
+    conn = _get_maintenance_connection()
+    try:
+        _run_timed(conn, 'wal_checkpoint', "PRAGMA wal_checkpoint(PASSIVE);")
+
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        if AUTO_VACUUM_MODES.get(auto_vacuum) == 'INCREMENTAL' and freelist_count > 0:
+            _run_timed(conn, 'incremental_vacuum', f"PRAGMA incremental_vacuum({int(vacuum_pages)});", as_script=True)
+
+        if optimize:
+            _run_timed(conn, 'optimize', "PRAGMA optimize;")
+    finally:
+        conn.close()
+    return summary
+
+
+def enable_incremental_vacuum():
+    """
+    既存のDBを auto_vacuum=INCREMENTAL に切り替える
+
+    既存DBのモード変更にはVACUUMによる全体の書き直しが1回必要なため、
+    利用者の少ない時間帯に実行すること（新規DBはinit_dbで最初から設定される）。
+    """
+    conn = _get_maintenance_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        _run_timed(conn, 'vacuum', "VACUUM;")
+    finally:
+        conn.close()
+
+
+class MaintenanceScheduler:
+    """一定間隔でメンテナンススライスを実行するバックグラウンドスレッド"""
+
+    def __init__(self, interval=MAINTENANCE_INTERVAL, optimize_interval=MAINTENANCE_OPTIMIZE_INTERVAL,
+                 archive_interval=MAINTENANCE_ARCHIVE_INTERVAL):
+        self.interval = interval
+        self.optimize_interval = optimize_interval
+        self.archive_interval = archive_interval
+        self.last_run_at = None
+        self.last_error = None
+        self._last_optimize = time.monotonic()
+        # 起動後最初のスライスで1回アーカイブする
+        self._last_archive = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            now = time.monotonic()
+            optimize = now - self._last_optimize >= self.optimize_interval
+            archive = self._last_archive is None or now - self._last_archive >= self.archive_interval
+            try:
+                summary = run_maintenance_slice(optimize=optimize, archive=archive)
+                self.last_error = None
+                if optimize:
+                    self._last_optimize = now
+                # 上限まで処理した場合は残りがあるため、次のスライスで続きを移動する
+                from utils.price_archive import PRICE_ARCHIVE_MAX_TICKERS
+                if archive and summary['tickers'] < PRICE_ARCHIVE_MAX_TICKERS:
+                    self._last_archive = now
+                if metrics.is_enabled():
+                    metrics.write_prometheus_file()
+            except Exception as e:
+                # ロック競合などで失敗した場合は次のスライスで再試行
+                self.last_error = str(e)
+                logger.warning("DB maintenance slice failed: %s", e)
+            self.last_run_at = datetime.now()
+
+
+@st.cache_resource
+def start_maintenance_scheduler():
+    """
+    メンテナンススケジューラを起動する。
+    @st.cache_resourceデコレータにより、プロセスごとに1回のみ起動される。
+    """
+    scheduler = MaintenanceScheduler()
+    scheduler.start()
+    return scheduler
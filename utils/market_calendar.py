@@ -0,0 +1,114 @@
+"""
+取引カレンダー（東証・米国市場）
+
+土日に加えて、同梱の休場日テーブル(data/market_holidays.csv)に載っている日を休場日として扱う。
+テーブルは market,date,name の形式で、翌年分の休場日が公表されたら行を追加して更新する。
+テーブルに収録されていない年は、土日のみを休場日として扱う。
+- JP: 東京証券取引所（祝日・振替休日・年末年始 12/31〜1/3）
+- US: NYSE/NASDAQ
+- FX: 為替（土日のみ休場）
+"""
+import csv
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+HOLIDAY_TABLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'market_holidays.csv')
+
+MARKETS = ('JP', 'US', 'FX')
+
+
+@lru_cache(maxsize=1)
+def load_holiday_table():
+    """
+    休場日テーブルを読み込む
+
+    Returns:
+    dict: {市場: {'dates': frozenset(休場日), 'years': (収録開始年, 収録終了年)}}
+    """
+    holidays = {}
+    with open(HOLIDAY_TABLE_PATH, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            holidays.setdefault(row['market'], set()).add(datetime.strptime(row['date'], '%Y-%m-%d').date())
+
+    return {
+        market: {
+            'dates': frozenset(dates),
+            'years': (min(d.year for d in dates), max(d.year for d in dates)),
+        }
+        for market, dates in holidays.items()
+    }
+
+
+def get_market(stock_code):
+    """
+    銘柄コードから市場を判定（utils.common.get_ticker と同じく先頭が数字なら日本株）
+
+    Returns:
+    str: 'JP', 'US', 'FX'（'USDJPY=X'などの為替）
+    """
+    if stock_code.endswith('=X'):
+        return 'FX'
+    if stock_code[0].isdigit():
+        return 'JP'
+    return 'US'
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def is_trading_day(value, market='JP'):
+    """
+    指定日が取引日かどうか
+
+    Parameters:
+    value (date | datetime | str): 日付（文字列の場合はYYYY-MM-DD形式）
+    market (str): 'JP', 'US', 'FX'
+    """
+    day = _to_date(value)
+    if day.weekday() >= 5:
+        return False
+    table = load_holiday_table().get(market)
+    return table is None or day not in table['dates']
+
+
+def previous_trading_day(value, market='JP'):
+    """指定日以前で直近の取引日を取得（指定日が取引日ならその日）"""
+    day = _to_date(value)
+    while not is_trading_day(day, market):
+        day -= timedelta(days=1)
+    return day
+
+
+def next_trading_day(value, market='JP'):
+    """指定日より後で直近の取引日を取得"""
+    day = _to_date(value) + timedelta(days=1)
+    while not is_trading_day(day, market):
+        day += timedelta(days=1)
+    return day
+
+
+def count_trading_days(start, end, market='JP'):
+    """start より後、end 以前の取引日数を数える"""
+    day = _to_date(start)
+    end_day = _to_date(end)
+    count = 0
+    while day < end_day:
+        day += timedelta(days=1)
+        if is_trading_day(day, market):
+            count += 1
+    return count
+
+
+def is_calendar_covered(value, market='JP'):
+    """指定日の年が休場日テーブルに収録されているか（テーブルの更新漏れの確認用）"""
+    table = load_holiday_table().get(market)
+    if table is None:
+        return market == 'FX'
+    first_year, last_year = table['years']
+    return first_year <= _to_date(value).year <= last_year
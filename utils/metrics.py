@@ -0,0 +1,355 @@
+"""
+DB・ネットワーク・ページ表示の計測（トレーシング）
+
+環境変数 METRICS_SAMPLE_RATE（0〜1、既定は0=無効）の割合で呼び出しをサンプリングし、
+次の回数とレイテンシのヒストグラムをプロセス内に集計する。
+- sql: SQL文の形（リテラルを?に置き換えて空白を詰めたもの）ごと
+- yfinance: エンドポイント（download / Ticker.history / Ticker.info）ごと
+- page: ページの表示ごと
+あわせて lru_cache（register_cacheで登録した関数）と price_cache などのキャッシュのヒット率を集計する。
+
+無効時は get_connection が通常の sqlite3 接続を返し、各計測点はフラグの確認だけで戻る。
+集計結果はPrometheusのテキスト形式（metrics/metrics.prom）またはSQLiteの metrics テーブルへ出力し、
+データベース管理ページの「計測」タブに表示する。
+"""
+import bisect
+import functools
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+METRICS_SAMPLE_RATE_ENV = 'METRICS_SAMPLE_RATE'
+
+# レイテンシのヒストグラムのバケット上限（ミリ秒）
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+METRICS_FILE_NAME = 'metrics.prom'
+
+KINDS = ('sql', 'yfinance', 'page')
+
+
+def _parse_sample_rate(value):
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+_sample_rate = _parse_sample_rate(os.environ.get(METRICS_SAMPLE_RATE_ENV, 0))
+_lock = threading.Lock()
+_started_at = datetime.now()
+_latencies = {}
+_cache_counts = {}
+_registered_caches = {}
+_yfinance_instrumented = False
+
+
+def is_enabled():
+    return _sample_rate > 0
+
+
+def get_sample_rate():
+    return _sample_rate
+
+
+def set_sample_rate(rate):
+    """サンプリング率を変更する（0で無効。実行中のプロセスだけに反映される）"""
+    global _sample_rate
+    _sample_rate = _parse_sample_rate(rate)
+
+
+def _sampled():
+    return _sample_rate > 0 and (_sample_rate >= 1 or random.random() < _sample_rate)
+
+
+def reset():
+    """集計結果を消去する"""
+    global _started_at
+    with _lock:
+        _latencies.clear()
+        _cache_counts.clear()
+        _started_at = datetime.now()
+
+
+def observe(kind, name, elapsed_ms):
+    """レイテンシを1件記録する"""
+    with _lock:
+        entry = _latencies.get((kind, name))
+        if entry is None:
+            entry = _latencies[(kind, name)] = {
+                'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS_MS)
+            }
+        entry['count'] += 1
+        entry['sum_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        entry['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+
+@contextmanager
+def _timed(kind, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(kind, name, (time.perf_counter() - start) * 1000)
+
+
+def timed(kind, name):
+    """処理時間を記録するコンテキストマネージャ（サンプリングされなかった場合は何もしない）"""
+    if not _sampled():
+        return nullcontext()
+    return _timed(kind, name)
+
+
+def count_cache(name, hit):
+    """キャッシュのヒット/ミスを記録する（無効時は何もしない）"""
+    if _sample_rate <= 0:
+        return
+    with _lock:
+        counts = _cache_counts.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+
+def register_cache(name, func):
+    """lru_cache でラップした関数を登録し、cache_info() のヒット率を集計に含める"""
+    _registered_caches[name] = func
+    return func
+
+
+# ====== SQL ======
+
+_SQL_COMMENT = re.compile(r"--[^\n]*")
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """SQL文をリテラルを?に置き換えた形にまとめる（IN (?, ?, ...) は IN (...) にする）"""
+    shape = _SQL_COMMENT.sub(' ', sql)
+    shape = _SQL_STRING.sub('?', shape)
+    shape = _SQL_NUMBER.sub('?', shape)
+    shape = _SQL_IN_LIST.sub('(...)', shape)
+    return _SQL_SPACE.sub(' ', shape).strip().rstrip(';')
+
+
+class TracedCursor(sqlite3.Cursor):
+    """execute/executemany/executescript の時間をSQL文の形ごとに記録するカーソル"""
+
+    def execute(self, sql, *args):
+        with timed('sql', normalize_sql(sql)):
+            return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        with timed('sql', normalize_sql(sql)):
+            return super().executemany(sql, *args)
+
+    def executescript(self, sql):
+        with timed('sql', normalize_sql(sql)):
+            return super().executescript(sql)
+
+
+class TracedConnection(sqlite3.Connection):
+    """cursor() と Connection.execute 系を TracedCursor 経由にする接続"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+
+def connection_factory():
+    """sqlite3.connect の factory 引数（無効時は通常の接続）"""
+    return TracedConnection if _sample_rate > 0 else sqlite3.Connection
+
+
+# ====== yfinance ======
+
+def _wrap_timed(kind, name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(kind, name):
+            return func(*args, **kwargs)
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def instrument_yfinance():
+    """
+    読み込み済みのyfinanceの download / Ticker.history / Ticker.info を計測付きに差し替える
+
+    yfinanceはページのimport時に読み込まれるため（起動を重くしないよう、ここではimportしない）、
+    ページ表示の開始時に呼び出す。各モジュールは yf.download を呼び出し時に参照するため差し替えが反映される。
+    """
+    global _yfinance_instrumented
+    if _yfinance_instrumented or _sample_rate <= 0 or 'yfinance' not in sys.modules:
+        return
+    yf = sys.modules['yfinance']
+    with _lock:
+        if _yfinance_instrumented:
+            return
+        yf.download = _wrap_timed('yfinance', 'download', yf.download)
+        yf.Ticker.history = _wrap_timed('yfinance', 'Ticker.history', yf.Ticker.history)
+        yf.Ticker.info = property(_wrap_timed('yfinance', 'Ticker.info', yf.Ticker.info.fget))
+        _yfinance_instrumented = True
+
+
+def page_render(page):
+    """ページの表示時間を記録するコンテキストマネージャ（無効時は何もしない）"""
+    if _sample_rate <= 0:
+        return nullcontext()
+    instrument_yfinance()
+    return timed('page', page)
+
+
+# ====== 集計結果 ======
+
+def get_snapshot():
+    """
+    集計結果を取得
+
+    Returns:
+    dict: started_at, sample_rate,
+        latencies（[{'kind', 'name', 'count', 'sum_ms', 'avg_ms', 'max_ms', 'buckets'}, ...] 合計時間の降順）,
+        caches（[{'name', 'hits', 'misses', 'hit_ratio'}, ...]）
+    """
+    with _lock:
+        latencies = [
+            {'kind': kind, 'name': name, **{key: (list(v) if key == 'buckets' else v) for key, v in entry.items()}}
+            for (kind, name), entry in _latencies.items()
+        ]
+        caches = {name: tuple(counts) for name, counts in _cache_counts.items()}
+        started_at = _started_at
+
+    for entry in latencies:
+        entry['avg_ms'] = entry['sum_ms'] / entry['count'] if entry['count'] else 0.0
+
+    for name, func in _registered_caches.items():
+        info = func.cache_info()
+        caches[name] = (info.hits, info.misses)
+
+    return {
+        'started_at': started_at,
+        'sample_rate': _sample_rate,
+        'latencies': sorted(latencies, key=lambda e: e['sum_ms'], reverse=True),
+        'caches': [
+            {
+                'name': name, 'hits': hits, 'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else None,
+            }
+            for name, (hits, misses) in sorted(caches.items())
+        ],
+    }
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def format_prometheus(snapshot=None):
+    """集計結果をPrometheusのテキスト形式にする（ヒストグラムの単位は秒）"""
+    snapshot = snapshot or get_snapshot()
+    lines = []
+    for kind in KINDS:
+        metric = f"discover_stocks_{kind}_duration_seconds"
+        entries = [e for e in snapshot['latencies'] if e['kind'] == kind]
+        if not entries:
+            continue
+        lines.append(f"# HELP {metric} Sampled {kind} latency.")
+        lines.append(f"# TYPE {metric} histogram")
+        for entry in entries:
+            label = f'name="{_escape_label(entry["name"])}"'
+            cumulative = 0
+            for upper, count in zip(LATENCY_BUCKETS_MS, entry['buckets']):
+                cumulative += count
+                le = '+Inf' if upper == float('inf') else f"{upper / 1000:g}"
+                lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{label}}} {entry['sum_ms'] / 1000:.6f}")
+            lines.append(f"{metric}_count{{{label}}} {entry['count']}")
+
+    if snapshot['caches']:
+        lines.append("# HELP discover_stocks_cache_requests_total Cache lookups by result.")
+        lines.append("# TYPE discover_stocks_cache_requests_total counter")
+        for cache in snapshot['caches']:
+            label = f'cache="{_escape_label(cache["name"])}"'
+            lines.append(f'discover_stocks_cache_requests_total{{{label},result="hit"}} {cache["hits"]}')
+            lines.append(f'discover_stocks_cache_requests_total{{{label},result="miss"}} {cache["misses"]}')
+
+    lines.append("# HELP discover_stocks_metrics_sample_rate Fraction of calls that are timed.")
+    lines.append("# TYPE discover_stocks_metrics_sample_rate gauge")
+    lines.append(f"discover_stocks_metrics_sample_rate {snapshot['sample_rate']:g}")
+    return '\n'.join(lines) + '\n'
+
+
+def get_metrics_path():
+    """Prometheus形式のファイルの保存先（DBファイルと同じディレクトリ配下のmetrics）"""
+    from utils.db import get_db_path
+    metrics_dir = os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'metrics')
+    os.makedirs(metrics_dir, exist_ok=True)
+    return os.path.join(metrics_dir, METRICS_FILE_NAME)
+
+
+def write_prometheus_file(path=None):
+    """
+    集計結果をPrometheusのテキスト形式で保存する（node_exporterのtextfile collectorで読み込める）
+
+    Returns:
+    str: 保存したパス
+    """
+    path = path or get_metrics_path()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(format_prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+def save_to_db():
+    """
+    集計結果を metrics テーブルへ追記する（記録時刻ごとに1行/項目）
+
+    Returns:
+    int: 保存した行数
+    """
+    from utils.db import get_connection, init_metrics_table
+    init_metrics_table()
+    snapshot = get_snapshot()
+    collected_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = [
+        (collected_at, entry['kind'], entry['name'], entry['count'], entry['sum_ms'], entry['max_ms'],
+         ','.join(str(c) for c in entry['buckets']), None, None)
+        for entry in snapshot['latencies']
+    ] + [
+        (collected_at, 'cache', cache['name'], cache['hits'] + cache['misses'], None, None, None,
+         cache['hits'], cache['misses'])
+        for cache in snapshot['caches']
+    ]
+    if not rows:
+        return 0
+
+    conn = get_connection()
+    try:
+        conn.executemany("""
+            INSERT INTO metrics
+            (collected_at, kind, name, count, sum_ms, max_ms, buckets, hits, misses)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(rows)
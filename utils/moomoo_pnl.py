@@ -0,0 +1,304 @@
+"""
+moomoo証券の取引履歴CSVの解析と損益計算（Streamlitに依存しない）
+
+CSVの解析（parse_moomoo_csv）、平均法による実現損益・含み損益の計算（calculate_pnl / build_pnl_results）を行う。
+約定の保存と再生は utils.moomoo_store が担い、ページ（pages/moomoo_pnl.py）は表示だけを行う。
+"""
+import io
+import pandas as pd
+import numpy as np
+import yfinance as yf
+from datetime import datetime
+from utils.common import get_ticker
+from utils.fx_rates import get_fx_rate, get_fx_rates
+from utils.moomoo_store import QUANTITY_TOLERANCE, replay_trades
+
+# 定数
+TRADING_FEES_RATE = 0.0  # 必要に応じて調整
+TAX_RATE = 0.0 # 必要に応じて調整
+DEFAULT_EXCHANGE_RATE = 150.0  # 為替レート取得失敗時のデフォルト値
+
+def get_exchange_rate(date_str):
+    """
+    指定日のUSD/JPY為替レートを取得する関数（price_cacheに保存済みならダウンロードしない）
+    """
+    rate = get_fx_rate(date_str)
+    return rate if rate is not None else DEFAULT_EXCHANGE_RATE
+
+def get_current_prices(tickers):
+    """
+    複数銘柄の現在の株価を1回のダウンロードでまとめて取得
+
+    Returns:
+    dict: {銘柄コード: 株価}（取得できなかった銘柄は含まない）
+    """
+    if not tickers:
+        return {}
+    # 日本株の場合（先頭文字が数字なら日本株として扱う）
+    yf_tickers = {ticker: get_ticker(ticker) for ticker in tickers}
+    try:
+        df = yf.download(
+            list(yf_tickers.values()),
+            period="5d",
+            progress=False,
+            auto_adjust=True,
+            group_by='column'
+        )
+    except Exception:
+        return {}
+    if df.empty:
+        return {}
+
+    close = df['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(name=next(iter(yf_tickers.values())))
+
+    prices = {}
+    for ticker, yf_ticker in yf_tickers.items():
+        if yf_ticker not in close:
+            continue
+        # 市場ごとに最終取引日が異なるため、銘柄ごとに最新の終値を使う
+        series = close[yf_ticker].dropna()
+        if not series.empty:
+            prices[ticker] = float(series.iloc[-1])
+    return prices
+
+# 分割約定の続きの行（注文状況が空欄）へ引き継ぐ親注文の項目
+PARENT_ORDER_COLUMNS = ['銘柄コード', '銘柄名', '売買方向', '通貨']
+
+# 手数料として合算する項目
+FEE_COLUMNS = ['取引手数料', '消費税', 'システム利用料']
+
+def read_moomoo_csv(file):
+    """
+    CSVのバイト列から文字コード（UTF-8またはShift-JIS）を判定して読み込む
+    """
+    file.seek(0)
+    data = file.read()
+    if isinstance(data, str):
+        text = data
+    elif data.startswith(b'\xef\xbb\xbf'):
+        text = data[3:].decode('utf-8')
+    else:
+        # UTF-8として正しくデコードできなければShift-JIS（機種依存文字を含むcp932）とみなす
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.decode('cp932')
+    # 銘柄コードなどを数値に変換しないよう、すべて文字列として読み込む
+    return pd.read_csv(io.StringIO(text), dtype=str)
+
+def to_number(series):
+    """カンマ区切りの数値文字列を数値に変換（変換できない値はNaN）"""
+    return pd.to_numeric(series.str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+def parse_moomoo_csv(file):
+    """
+    moomoo証券のCSVを解析する
+
+    Returns:
+    pandas.DataFrame: 約定ごとの date, datetime, ticker, name, side, currency, qty, price, fee, original_line
+        （約定がない場合は空のDataFrame）
+
+    Raises:
+    ValueError: CSVを読み込めない場合
+    """
+    try:
+        df = read_moomoo_csv(file)
+
+        # 必要なカラムが存在するか確認
+        required_columns = ['売買方向', '銘柄コード', '銘柄名', '注文状況', '約定数量', '約定価格', '約定日時', '通貨', '取引手数料', '消費税']
+        # カラム名の空白削除などの正規化
+        df.columns = [c.strip() for c in df.columns]
+
+        # 注文状況が「約定済」または空欄（分割約定の続き）の場合のみ処理
+        status = df['注文状況'].fillna('').str.strip()
+
+        # 約定数量がある行を有効な約定データとみなす
+        qty = to_number(df['約定数量'])
+        has_qty = qty > 0
+
+        # 親注文情報の補完: 直前の「約定済」の行の項目を、続く空欄の行へ引き継ぐ
+        is_parent = has_qty & (status == '約定済')
+        parent_index = pd.Series(df.index.where(is_parent), index=df.index).ffill()
+        is_trade = is_parent | (has_qty & (status == '') & parent_index.notna())
+        parent = df.loc[parent_index[is_trade].astype(int), PARENT_ORDER_COLUMNS].astype(str)
+        parent.index = df.index[is_trade]
+        parent = parent.apply(lambda col: col.str.strip())
+
+        rows = df[is_trade]
+
+        # 約定価格、約定日時は現在の行から取得（価格が数値でない場合は0）
+        price = to_number(rows['約定価格'])
+        price = price.mask(price.isna() & rows['約定価格'].notna(), 0.0)
+
+        # 手数料は行にある数値をそのまま合算する
+        fee = pd.Series(0.0, index=rows.index)
+        for column in FEE_COLUMNS:
+            if column in rows:
+                fee += to_number(rows[column]).fillna(0.0)
+
+        # 日付のパース (ET/JSTの処理)
+        # 例: "2025/11/25 08:38:23 ET" -> "2025/11/25 08:38:23"
+        date_str = rows['約定日時'].fillna('').str.strip()
+        date_str_clean = date_str.str.replace(' ET', '', regex=False).str.replace(' JST', '', regex=False).str.strip()
+        trade_datetime = pd.to_datetime(date_str_clean, format='%Y/%m/%d %H:%M:%S', errors='coerce')
+        # 時刻がない場合は日付のみ
+        date_only = pd.to_datetime(date_str.str.split(' ').str[0], format='%Y/%m/%d', errors='coerce')
+        trade_datetime = trade_datetime.fillna(date_only)
+        valid = trade_datetime.notna()
+
+        if not valid.any():
+            return pd.DataFrame()
+
+        trades = pd.DataFrame({
+            'date': trade_datetime[valid].dt.date,
+            'datetime': trade_datetime[valid],  # ソート用に日時も保存
+            'ticker': parent.loc[valid, '銘柄コード'],
+            'name': parent.loc[valid, '銘柄名'],
+            'side': parent.loc[valid, '売買方向'],
+            'currency': parent.loc[valid, '通貨'],
+            'qty': qty[is_trade][valid],
+            'price': price[valid],
+            'fee': fee[valid],
+            'original_line': rows.index[valid] + 2  # 1-based index for header + 1
+        })
+        return trades.reset_index(drop=True)
+
+    except Exception as e:
+        raise ValueError(f"CSV読み込みエラー: {e}") from e
+
+def calculate_pnl(df):
+    """
+    損益計算を行う
+    """
+    if df.empty:
+        return [], [], []
+
+    # 日時順にソート（古い順）- 同日の取引も正しい順序で処理
+    df = df.sort_values('datetime').reset_index(drop=True)
+    return build_pnl_results(replay_trades(df))
+
+def build_pnl_results(df):
+    """
+    平均法の再生結果（utils.moomoo_store.replay_trades / load_trades）から
+    実現損益・含み損益・警告の一覧を作成する
+    """
+    if df.empty:
+        return [], [], []
+
+    qty = df['qty'].to_numpy(dtype=float)
+    price = df['price'].to_numpy(dtype=float)
+    is_realized = df['is_realized'].to_numpy(dtype=bool)
+    is_orphan = df['is_orphan'].to_numpy(dtype=bool)
+    avg_cost = df['avg_cost'].to_numpy(dtype=float)
+    pnl_local = df['pnl_local'].to_numpy(dtype=float)
+
+    # 保有ポジション: 銘柄ごとの最後の約定後の状態（銘柄は初めて出現した順）
+    first = df.drop_duplicates('ticker', keep='first').set_index('ticker')
+    last = df.drop_duplicates('ticker', keep='last').set_index('ticker')
+    holdings = {
+        ticker: {
+            'qty': float(last.at[ticker, 'position_qty']),
+            'total_cost': float(last.at[ticker, 'position_total_cost']),
+            'avg_cost': float(last.at[ticker, 'position_avg_cost']),
+            'currency': first.at[ticker, 'currency'],
+            'name': first.at[ticker, 'name'],
+        }
+        for ticker in first.index
+    }
+
+    # 円換算: 米国株の売却日の為替レートを1回でまとめて取得して結合
+    rate = np.ones(len(df))
+    is_usd_realized = is_realized & (df['currency'] == 'USD').to_numpy()
+    usd_dates = df.loc[is_usd_realized, 'date']
+    rate[is_usd_realized] = get_fx_rates(list(usd_dates))
+    is_rate_missing = np.isnan(rate)
+    rate[is_rate_missing] = DEFAULT_EXCHANGE_RATE
+    pnl_jpy = pnl_local * rate
+
+    tickers = df['ticker'].to_numpy()
+    names = df['name'].to_numpy()
+    dates = df['date'].to_numpy()
+    currencies = df['currency'].to_numpy()
+
+    realized_pnl = []
+    warnings = []  # 警告情報を記録
+    for i in np.flatnonzero(is_realized | is_orphan):
+        ticker, name, date = tickers[i], names[i], dates[i]
+        if is_orphan[i]:
+            warnings.append({
+                'type': '買い情報欠損',
+                'ticker': ticker,
+                'name': name,
+                'date': date,
+                'qty': qty[i],
+                'message': f'銘柄 {ticker}({name}) の売り注文に対応する買い情報がありません（{date}, {qty[i]}株）'
+            })
+            continue
+
+        if is_rate_missing[i]:
+            warnings.append({
+                'type': '為替レート取得失敗',
+                'ticker': ticker,
+                'name': name,
+                'date': date,
+                'qty': qty[i],
+                'message': f'{date} の為替レートを取得できなかったため、{DEFAULT_EXCHANGE_RATE}円で換算しました'
+            })
+        realized_pnl.append({
+            'month': date.strftime("%Y-%m"),
+            'date': date,
+            'ticker': ticker,
+            'name': name,
+            'qty': float(qty[i]),
+            'avg_cost': float(avg_cost[i]),  # 売却前の平均取得単価
+            'sell_price': float(price[i]),
+            'currency': currencies[i],
+            'pnl_local': float(pnl_local[i]),
+            'pnl_jpy': float(pnl_jpy[i]),
+            'rate': float(rate[i])
+        })
+
+    # 含み損益計算: 保有銘柄の現在株価を1回でまとめて取得
+    unrealized_pnl = []
+    current_rate = get_exchange_rate(datetime.now().strftime("%Y-%m-%d"))
+    open_positions = {ticker: pos for ticker, pos in holdings.items() if pos['qty'] > QUANTITY_TOLERANCE}
+    current_prices = get_current_prices(list(open_positions))
+
+    for ticker, pos in open_positions.items():
+        current_price = current_prices.get(ticker)
+
+        if current_price is not None:
+            market_value_local = current_price * pos['qty']
+            cost_basis_local = pos['total_cost']
+            pnl_local_value = market_value_local - cost_basis_local
+
+            rate_value = 1.0
+            if pos['currency'] == 'USD':
+                rate_value = current_rate
+
+            unrealized_pnl.append({
+                'ticker': ticker,
+                'name': pos['name'],
+                'qty': pos['qty'],
+                'avg_cost': pos['avg_cost'],
+                'current_price': current_price,
+                'market_value_jpy': market_value_local * rate_value,
+                'cost_basis_jpy': cost_basis_local * rate_value,
+                'pnl_jpy': pnl_local_value * rate_value,
+                'currency': pos['currency']
+            })
+        else:
+            # 株価取得失敗
+            warnings.append({
+                'type': '株価取得失敗',
+                'ticker': ticker,
+                'name': pos['name'],
+                'qty': pos['qty'],
+                'avg_cost': pos['avg_cost'],
+                'currency': pos['currency'],
+                'message': f'銘柄 {ticker}({pos["name"]}) の現在株価を取得できませんでした（保有: {pos["qty"]}株）'
+            })
+
+    return realized_pnl, unrealized_pnl, warnings
@@ -0,0 +1,383 @@
+"""
+moomoo証券の取引履歴の保存と、平均法による損益の逐次計算
+
+アップロードされた約定は口座ごとに moomoo_trades テーブルへ保存する。
+口座は所有者（ChatWorkのアカウント）ごとに分け、"所有者/口座名" をキーにする。
+各約定は (銘柄コード, 約定日時, 数量, 価格) の指紋をキーにするため、
+期間が重なるCSVを再アップロードしても新しい約定だけが追加される。
+
+約定ごとに、その約定の後の保有数量・保有コスト・平均取得単価（ポジションのスナップショット）と
+実現損益を保存しておく。約定が追加された場合は、銘柄ごとに最初に追加された約定の直前の
+スナップショットから再計算するため、過去分の再生は不要になる。
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+from utils.db import get_connection, init_moomoo_tables
+
+QUANTITY_TOLERANCE = 0.0001  # 数量の誤差許容範囲
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 口座のキーの所有者と口座名の区切り
+ACCOUNT_SEPARATOR = '/'
+
+
+def replay_average_cost(is_buy, is_sell, qty, price, fee, initial=None):
+    """
+    1銘柄の約定を時系列順に平均法で再生する
+
+    平均取得単価は買いでのみ変わり、売りでは変わらない（保有コストを数量に比例して減らす）。
+    保有数量が0になるまでを1つのサイクルとし、サイクルごとの累積和・累積積で配列のまま計算する。
+    - 保有数量: 売買で符号を付けた数量の累積和
+    - 保有コスト: 売りで残った数量の割合を掛け、買いで取得コスト（手数料含む）を足す線形漸化式を、
+      割合の累積積 R で割った取得コストの累積和に R を掛けて求める
+    - 平均取得単価: 買いの時点の 保有コスト / 保有数量 をサイクル内で前方補完
+    買い情報のない売りや保有数量を超える売りがある場合（データ欠損）は、約定ごとに順に再生する。
+    売買以外の区分の約定は保有状態を変えない。
+
+    Parameters:
+    is_buy, is_sell, qty, price, fee (numpy.ndarray): 約定ごとの売買区分・数量・価格・手数料
+    initial (tuple): 再生開始前の (保有数量, 保有コスト, 平均取得単価)。Noneの場合はポジションなし
+
+    Returns:
+    dict: 約定ごとの配列
+        is_realized: 実現損益が発生した売り, is_orphan: 買い情報のない売り,
+        avg_cost: 売却前の平均取得単価, pnl_local: 現地通貨建ての実現損益,
+        position_qty, position_total_cost, position_avg_cost: 約定後の保有状態
+    """
+    is_buy = np.asarray(is_buy, dtype=bool)
+    is_sell = np.asarray(is_sell, dtype=bool)
+    qty = np.asarray(qty, dtype=float)
+    price = np.asarray(price, dtype=float)
+    fee = np.asarray(fee, dtype=float)
+    n = len(qty)
+    if n == 0:
+        return _replay_average_cost_sequential(is_buy, is_sell, qty, price, fee, initial)
+    initial_qty, initial_cost, initial_avg = (
+        (float(v) for v in initial) if initial is not None else (0.0, 0.0, 0.0)
+    )
+
+    # 保有数量（数量が0になった売りでサイクルを区切り、サイクルごとに0から数え直す）
+    signed_qty = np.where(is_buy, qty, np.where(is_sell, -qty, 0.0))
+    closing = is_sell & (np.abs(initial_qty + np.cumsum(signed_qty)) < QUANTITY_TOLERANCE)
+    cycle = np.concatenate(([0], np.cumsum(closing)[:-1]))
+    first_cycle = cycle == 0
+    held = pd.Series(signed_qty).groupby(cycle).cumsum().to_numpy() + np.where(first_cycle, initial_qty, 0.0)
+    held[closing] = 0.0
+    held_before = np.concatenate(([initial_qty], held[:-1]))
+
+    if np.any(is_sell & (held_before <= 0)) or np.any(held < -QUANTITY_TOLERANCE):
+        return _replay_average_cost_sequential(is_buy, is_sell, qty, price, fee, initial)
+
+    # 保有コスト: total[i] = ratio[i] * total[i-1] + added[i]
+    ratio = np.ones(n)
+    partial_sell = is_sell & ~closing
+    ratio[partial_sell] = held[partial_sell] / held_before[partial_sell]
+    growth = pd.Series(ratio).groupby(cycle).cumprod().to_numpy()
+    added = np.where(is_buy, price * qty + fee, 0.0)
+    scaled = pd.Series(added / growth).groupby(cycle).cumsum().to_numpy()
+    total_cost = growth * (scaled + np.where(first_cycle, initial_cost, 0.0))
+    total_cost[closing] = 0.0
+
+    # 平均取得単価（買いでのみ更新し、売りではそのまま）
+    bought = is_buy & (held > 0)
+    avg_at_buy = np.full(n, np.nan)
+    avg_at_buy[bought] = total_cost[bought] / held[bought]
+    position_avg_cost = pd.Series(avg_at_buy).groupby(cycle).ffill().to_numpy()
+    position_avg_cost = np.where(
+        np.isnan(position_avg_cost), np.where(first_cycle, initial_avg, 0.0), position_avg_cost
+    )
+    position_avg_cost[closing] = 0.0
+    avg_before = np.concatenate(([initial_avg], position_avg_cost[:-1]))
+
+    # 実現損益 = (売却単価 - 平均取得単価) * 数量 - 手数料
+    return {
+        'is_realized': is_sell.copy(),
+        'is_orphan': np.zeros(n, dtype=bool),
+        'avg_cost': np.where(is_sell, avg_before, 0.0),
+        'pnl_local': np.where(is_sell, price * qty - avg_before * qty - fee, 0.0),
+        'position_qty': held,
+        'position_total_cost': total_cost,
+        'position_avg_cost': position_avg_cost,
+    }
+
+
+def _replay_average_cost_sequential(is_buy, is_sell, qty, price, fee, initial=None):
+    """replay_average_cost と同じ計算を約定ごとに順に行う（買い情報のない売りなどを含む場合）"""
+    n = len(qty)
+    result = {
+        'is_realized': np.zeros(n, dtype=bool),
+        'is_orphan': np.zeros(n, dtype=bool),
+        'avg_cost': np.zeros(n),
+        'pnl_local': np.zeros(n),
+        'position_qty': np.zeros(n),
+        'position_total_cost': np.zeros(n),
+        'position_avg_cost': np.zeros(n),
+    }
+
+    held_qty, total_cost, position_avg_cost = initial if initial is not None else (0.0, 0.0, 0.0)
+    for i in range(n):
+        if is_buy[i]:
+            # 取得コスト計算（手数料含む）
+            held_qty += qty[i]
+            total_cost += price[i] * qty[i] + fee[i]
+            if held_qty > 0:
+                position_avg_cost = total_cost / held_qty
+        elif is_sell[i]:
+            if held_qty > 0:
+                # 実現損益 = (売却単価 - 平均取得単価) * 数量 - 手数料
+                cost_basis = position_avg_cost * qty[i]
+                result['is_realized'][i] = True
+                result['avg_cost'][i] = position_avg_cost
+                result['pnl_local'][i] = price[i] * qty[i] - cost_basis - fee[i]
+
+                held_qty -= qty[i]
+                total_cost -= cost_basis  # 平均法なので比例配分で減らす
+
+                # 誤差修正（数量0ならコストも0）
+                if abs(held_qty) < QUANTITY_TOLERANCE:
+                    held_qty = 0
+                    total_cost = 0
+                    position_avg_cost = 0
+            else:
+                # 買い情報がない状態で売りが発生（データ欠損）
+                result['is_orphan'][i] = True
+
+        result['position_qty'][i] = held_qty
+        result['position_total_cost'][i] = total_cost
+        result['position_avg_cost'][i] = position_avg_cost
+
+    return result
+
+
+def replay_trades(df):
+    """
+    日時順に並んだ約定の全履歴を銘柄ごとに再生し、結果の列を追加して返す
+    """
+    df = df.copy()
+    side = df['side'].to_numpy()
+    is_buy = side == '買い'
+    is_sell = side == '売り'
+    qty = df['qty'].to_numpy(dtype=float)
+    price = df['price'].to_numpy(dtype=float)
+    fee = df['fee'].to_numpy(dtype=float)
+
+    columns = {}
+    for ticker, rows in df.groupby('ticker', sort=False).indices.items():
+        replayed = replay_average_cost(is_buy[rows], is_sell[rows], qty[rows], price[rows], fee[rows])
+        for column, values in replayed.items():
+            if column not in columns:
+                columns[column] = np.zeros(len(df), dtype=values.dtype)
+            columns[column][rows] = values
+
+    for column, values in columns.items():
+        df[column] = values
+    return df
+
+
+def get_trade_fingerprints(df):
+    """
+    約定ごとの指紋を計算
+
+    同じ銘柄・日時・数量・価格の約定が同じCSV内に複数ある場合（同時刻の分割約定）も
+    区別できるよう、同じキー内での出現順を含める。
+    """
+    key = (
+        df['ticker'].astype(str) + '|'
+        + df['datetime'].dt.strftime(DATETIME_FORMAT) + '|'
+        + df['qty'].astype(float).map(repr) + '|'
+        + df['price'].astype(float).map(repr)
+    )
+    ordinal = key.groupby(key).cumcount().astype(str)
+    return (key + '|' + ordinal).map(lambda value: hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+
+def _recompute_ticker(cursor, account, ticker, from_datetime):
+    """指定日時以降の約定を、直前のスナップショットから再生して保存し直す"""
+    cursor.execute("""
+        SELECT position_qty, position_total_cost, position_avg_cost
+        FROM moomoo_trades
+        WHERE account = ? AND ticker = ? AND trade_datetime < ?
+        ORDER BY trade_datetime DESC, rowid DESC
+        LIMIT 1
+    """, (account, ticker, from_datetime))
+    snapshot = cursor.fetchone()
+
+    rows = cursor.execute("""
+        SELECT rowid, side, qty, price, fee
+        FROM moomoo_trades
+        WHERE account = ? AND ticker = ? AND trade_datetime >= ?
+        ORDER BY trade_datetime, rowid
+    """, (account, ticker, from_datetime)).fetchall()
+    if not rows:
+        return 0
+
+    rowids = [row[0] for row in rows]
+    side = np.array([row[1] for row in rows])
+    replayed = replay_average_cost(
+        side == '買い',
+        side == '売り',
+        np.array([row[2] for row in rows], dtype=float),
+        np.array([row[3] for row in rows], dtype=float),
+        np.array([row[4] for row in rows], dtype=float),
+        initial=snapshot
+    )
+
+    cursor.executemany("""
+        UPDATE moomoo_trades SET
+            position_qty = ?, position_total_cost = ?, position_avg_cost = ?,
+            avg_cost_at_sell = ?, pnl_local = ?, is_realized = ?, is_orphan = ?
+        WHERE rowid = ?
+    """, zip(
+        replayed['position_qty'].tolist(),
+        replayed['position_total_cost'].tolist(),
+        replayed['position_avg_cost'].tolist(),
+        replayed['avg_cost'].tolist(),
+        replayed['pnl_local'].tolist(),
+        replayed['is_realized'].astype(int).tolist(),
+        replayed['is_orphan'].astype(int).tolist(),
+        rowids
+    ))
+    return len(rows)
+
+
+def import_trades(account, df):
+    """
+    解析済みの約定を口座の履歴へ追加し、影響を受けた銘柄だけ損益を再計算する
+
+    Parameters:
+    account (str): 口座のキー（make_account_key）
+    df (pandas.DataFrame): utils.moomoo_pnl.parse_moomoo_csv の結果
+
+    Returns:
+    dict: {'added': 追加した約定数, 'skipped': 保存済みだった約定数, 'replayed': 再計算した約定数}
+    """
+    init_moomoo_tables()
+    summary = {'added': 0, 'skipped': 0, 'replayed': 0}
+    if df.empty:
+        return summary
+
+    df = df.sort_values('datetime', kind='stable').reset_index(drop=True)
+    df['fingerprint'] = get_trade_fingerprints(df)
+    df['trade_datetime'] = df['datetime'].dt.strftime(DATETIME_FORMAT)
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        existing = {
+            row[0] for row in cursor.execute("""
+                SELECT fingerprint FROM moomoo_trades
+                WHERE account = ? AND trade_datetime BETWEEN ? AND ?
+            """, (account, df['trade_datetime'].iloc[0], df['trade_datetime'].iloc[-1]))
+        }
+        new_trades = df[~df['fingerprint'].isin(existing)]
+        summary['skipped'] = len(df) - len(new_trades)
+        if new_trades.empty:
+            return summary
+
+        cursor.executemany("""
+            INSERT OR IGNORE INTO moomoo_trades
+            (account, fingerprint, trade_datetime, trade_date, ticker, name, side, currency, qty, price, fee)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, zip(
+            [account] * len(new_trades),
+            new_trades['fingerprint'],
+            new_trades['trade_datetime'],
+            new_trades['datetime'].dt.strftime('%Y-%m-%d'),
+            new_trades['ticker'],
+            new_trades['name'],
+            new_trades['side'],
+            new_trades['currency'],
+            new_trades['qty'].astype(float).tolist(),
+            new_trades['price'].astype(float).tolist(),
+            new_trades['fee'].astype(float).tolist()
+        ))
+        summary['added'] = len(new_trades)
+
+        # 約定が追加された銘柄ごとに、最初に追加された約定から再計算
+        for ticker, from_datetime in new_trades.groupby('ticker')['trade_datetime'].min().items():
+            summary['replayed'] += _recompute_ticker(cursor, account, ticker, from_datetime)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    return summary
+
+
+def load_trades(account):
+    """
+    口座の約定履歴を、保存済みの再生結果の列とともに日時順で取得
+
+    Returns:
+    pandas.DataFrame: parse_moomoo_csv の列 + replay_average_cost の結果の列
+    """
+    init_moomoo_tables()
+    conn = get_connection()
+    try:
+        df = pd.read_sql_query("""
+            SELECT trade_datetime, ticker, name, side, currency, qty, price, fee,
+                   position_qty, position_total_cost, position_avg_cost,
+                   avg_cost_at_sell AS avg_cost, pnl_local, is_realized, is_orphan
+            FROM moomoo_trades
+            WHERE account = ?
+            ORDER BY trade_datetime, rowid
+        """, conn, params=(account,))
+    finally:
+        conn.close()
+
+    df['datetime'] = pd.to_datetime(df['trade_datetime'], format=DATETIME_FORMAT)
+    df['date'] = df['datetime'].dt.date
+    df['is_realized'] = df['is_realized'].astype(bool)
+    df['is_orphan'] = df['is_orphan'].astype(bool)
+    return df.drop(columns=['trade_datetime'])
+
+
+def make_account_key(owner, account_name):
+    """
+    moomoo_trades の account に保存するキー（"所有者/口座名"）
+
+    口座名が同じでも所有者（ログインユーザー）が異なれば別の口座として扱う。
+    """
+    return f"{owner}{ACCOUNT_SEPARATOR}{account_name}"
+
+
+def list_accounts(owner):
+    """
+    所有者の保存済みの口座の一覧
+
+    Returns:
+    list: [(口座名, 約定数, 最終約定日時), ...]
+    """
+    init_moomoo_tables()
+    prefix = make_account_key(owner, '')
+    conn = get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT account, COUNT(*), MAX(trade_datetime)
+            FROM moomoo_trades
+            WHERE substr(account, 1, ?) = ?
+            GROUP BY account
+            ORDER BY account
+        """, (len(prefix), prefix)).fetchall()
+    finally:
+        conn.close()
+    return [(account[len(prefix):], count, last_trade) for account, count, last_trade in rows]
+
+
+def delete_account(account):
+    """
+    口座の約定履歴をすべて削除
+
+    Returns:
+    int: 削除した約定数
+    """
+    init_moomoo_tables()
+    conn = get_connection()
+    try:
+        deleted = conn.execute("DELETE FROM moomoo_trades WHERE account = ?", (account,)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return deleted
@@ -0,0 +1,446 @@
+"""
+株価キャッシュの保持期間管理（ホット層/アーカイブ層）
+
+price_cache テーブルは取得した株価・為替を日付ごとに保存するだけで削除されないため、
+年数とともにDBファイルとクエリ時間が増え続ける。
+- ホット層: 直近 PRICE_CACHE_HOT_DAYS 日分は従来どおりSQLiteの price_cache に保持
+- アーカイブ層: それより古い確定済みの値は銘柄ごとのアーカイブファイル(.pca)へ移動
+
+アーカイブは (開始日, 終了日, 価格) のランレングス形式で保存する。
+価格キャッシュは休日に直前営業日の値を保存するため、連続する日付で同じ値が並ぶ
+（特に為替は毎日保存される）。これを1行にまとめることで重複行を圧縮する。
+
+ファイル形式（追記専用）:
+- 先頭64バイトのヘッダ: マジック、レコード長、レコード数、最初/最後の日付
+- 続いて16バイト固定長のレコード (開始日 int32, 終了日 int32, 価格 float64) を開始日順に並べる
+読み込み時は numpy.memmap でマップし、日付範囲は二分探索でスライスするため、
+行のデコードを行わず必要なページだけを読む。
+ファイルへの書き込み（追記・書き直し・旧形式からの変換）はプロセス内でロックして1つずつ行う。
+"""
+import os
+import re
+import shutil
+import threading
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from utils.db import get_db_path, get_connection, init_price_cache_table
+
+# SQLiteに残す日数（これより古い日付の値はアーカイブへ移動）
+PRICE_CACHE_HOT_DAYS = 400
+
+# 1回のアーカイブ処理で扱う銘柄数の上限（DBを長時間占有しないため）
+PRICE_ARCHIVE_MAX_TICKERS = 50
+
+ARCHIVE_SUFFIX = '.pca'
+
+# 031形式（np.saveで保存した構造化配列）。読み込み時に新形式へ変換する
+LEGACY_ARCHIVE_SUFFIX = '.npy'
+
+ARCHIVE_MAGIC = b'PCA1'
+
+# ヘッダ（64バイト固定）: レコード数と日付範囲を持ち、範囲外の問い合わせはデータを読まずに返す
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('record_size', '<u4'),
+    ('count', '<u8'),
+    ('first_day', '<i4'),
+    ('last_day', '<i4'),
+    ('reserved', 'V40'),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+# レコード（16バイト固定）: 日付は1970-01-01からの日数、価格はfloat64
+RECORD_DTYPE = np.dtype([('start', '<i4'), ('end', '<i4'), ('price', '<f8')])
+
+_EPOCH = datetime(1970, 1, 1).date()
+
+# メモリマップ済みアーカイブのキャッシュ {パス: ((更新時刻, サイズ), 配列)}
+_archive_cache = {}
+_archive_cache_lock = threading.Lock()
+
+# アーカイブファイルへの書き込みのロック（メンテナンスのスレッドと管理画面のアーカイブが同時に追記しないようにする）
+_archive_write_lock = threading.RLock()
+
+
+def get_archive_dir():
+    """アーカイブの保存先（DBファイルと同じディレクトリ配下のprice_archive）"""
+    db_dir = os.path.dirname(os.path.abspath(get_db_path()))
+    archive_dir = os.path.join(db_dir, 'price_archive')
+    os.makedirs(archive_dir, exist_ok=True)
+    return archive_dir
+
+
+def get_archive_path(stock_code, suffix=ARCHIVE_SUFFIX):
+    """銘柄コードからアーカイブファイルのパスを取得（記号はURLエンコード: 'USDJPY=X' → 'USDJPY%3DX.pca'）"""
+    return os.path.join(get_archive_dir(), f"{quote(stock_code, safe='')}{suffix}")
+
+
+def _get_old_archive_path(stock_code, suffix=ARCHIVE_SUFFIX):
+    """
+    以前のファイル名のパス（記号を'_'に置き換えていた: 'USDJPY=X' → 'USDJPY_X.pca'）
+
+    'USDJPY=X' と 'USDJPY_X' が同じファイルになるため、現在のファイル名に移行する。
+    """
+    safe_code = re.sub(r'[^A-Za-z0-9._-]', '_', stock_code)
+    return os.path.join(get_archive_dir(), f"{safe_code}{suffix}")
+
+
+def _to_day(date_str):
+    return (datetime.strptime(date_str, '%Y-%m-%d').date() - _EPOCH).days
+
+
+def _make_header(runs):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = ARCHIVE_MAGIC
+    header['record_size'] = RECORD_DTYPE.itemsize
+    header['count'] = len(runs)
+    if len(runs) > 0:
+        header['first_day'] = runs['start'][0]
+        header['last_day'] = runs['end'][-1]
+    return header
+
+
+def _read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) != 1 or header['magic'][0] != ARCHIVE_MAGIC \
+            or header['record_size'][0] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"価格アーカイブの形式が不正です: {path}")
+    return header[0]
+
+
+def _write_archive(path, runs):
+    """アーカイブ全体を書き直す（一時ファイルへ書き出してからリネーム）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_make_header(runs).tobytes())
+        f.write(np.ascontiguousarray(runs, dtype=RECORD_DTYPE).tobytes())
+    os.replace(tmp_path, path)
+
+
+def _convert_legacy_archive(legacy_path):
+    """旧形式(.npy)のアーカイブを新形式へ変換する"""
+    with _archive_write_lock:
+        if not os.path.exists(legacy_path):
+            return
+        runs = np.load(legacy_path).astype(RECORD_DTYPE)
+        _write_archive(legacy_path[:-len(LEGACY_ARCHIVE_SUFFIX)] + ARCHIVE_SUFFIX, runs)
+        os.remove(legacy_path)
+
+
+def convert_legacy_archives():
+    """保存先にある旧形式(.npy)のアーカイブをすべて新形式へ変換する"""
+    archive_dir = get_archive_dir()
+    for name in os.listdir(archive_dir):
+        if name.endswith(LEGACY_ARCHIVE_SUFFIX):
+            _convert_legacy_archive(os.path.join(archive_dir, name))
+
+
+def _migrate_old_archive(stock_code):
+    """
+    以前のファイル名・旧形式(.npy)のアーカイブを現在のファイル名の新形式にする
+
+    以前のファイル名は別の銘柄コードと共有している場合があるため、移動せずにコピーする。
+
+    Returns:
+    bool: 現在のファイル名のアーカイブがある場合はTrue
+    """
+    path = get_archive_path(stock_code)
+    with _archive_write_lock:
+        if os.path.exists(path):
+            return True
+        for legacy_path in (get_archive_path(stock_code, LEGACY_ARCHIVE_SUFFIX),
+                            _get_old_archive_path(stock_code, LEGACY_ARCHIVE_SUFFIX)):
+            _convert_legacy_archive(legacy_path)
+        if os.path.exists(path):
+            return True
+        old_path = _get_old_archive_path(stock_code)
+        if not os.path.exists(old_path):
+            return False
+        tmp_path = path + '.tmp'
+        shutil.copyfile(old_path, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+
+
+def _load_archive(stock_code):
+    """
+    アーカイブをメモリマップで開く（ファイルが更新されていなければ前回のマップを再利用）
+
+    ヘッダのレコード数までをマップするため、追記中のレコードは読まない。
+
+    Returns:
+    numpy.memmap: RECORD_DTYPE の配列、またはアーカイブがない場合は None
+    """
+    path = get_archive_path(stock_code)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        if not _migrate_old_archive(stock_code):
+            return None
+        stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _archive_cache_lock:
+        cached = _archive_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        count = int(_read_header(path)['count'])
+        if count == 0:
+            runs = np.empty(0, dtype=RECORD_DTYPE)
+        else:
+            runs = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+        _archive_cache[path] = (key, runs)
+        return runs
+
+
+def _encode_runs(days, prices):
+    """日付順の (日数, 価格) を、連続する日付かつ同じ価格の区間ごとにまとめる"""
+    if len(days) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    # 前日と日付が連続していない、または価格が変わった位置で新しい区間を開始
+    breaks = np.ones(len(days), dtype=bool)
+    breaks[1:] = (np.diff(days) != 1) | (prices[1:] != prices[:-1])
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], len(days)) - 1
+
+    runs = np.empty(len(starts), dtype=RECORD_DTYPE)
+    runs['start'] = days[starts]
+    runs['end'] = days[ends]
+    runs['price'] = prices[starts]
+    return runs
+
+
+def _decode_runs(runs):
+    """ランレングス形式を日付ごとの (日数, 価格) に展開"""
+    lengths = (runs['end'] - runs['start'] + 1).astype(np.int64)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    days = np.repeat(runs['start'].astype(np.int64), lengths) + offsets
+    prices = np.repeat(runs['price'], lengths)
+    return days, prices
+
+
+def read_archived_price(stock_code, date_str):
+    """
+    アーカイブから指定日の価格を取得
+
+    Returns:
+    float: 価格、または該当データがない場合は None
+    """
+    runs = _load_archive(stock_code)
+    if runs is None or len(runs) == 0:
+        return None
+
+    day = _to_day(date_str)
+    idx = np.searchsorted(runs['start'], day, side='right') - 1
+    if idx >= 0 and runs['end'][idx] >= day:
+        return float(runs['price'][idx])
+    return None
+
+
+def read_archived_runs(stock_code, start_date, end_date):
+    """
+    指定期間にかかる区間をアーカイブから取得（メモリマップのスライスのためコピーしない）
+
+    Parameters:
+    stock_code (str): 銘柄コード
+    start_date (str): 開始日（YYYY-MM-DD形式）
+    end_date (str): 終了日（YYYY-MM-DD形式、この日を含む）
+
+    Returns:
+    numpy.ndarray: RECORD_DTYPE の配列（該当なしの場合は空配列）
+    """
+    runs = _load_archive(stock_code)
+    if runs is None or len(runs) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    start_day = _to_day(start_date)
+    end_day = _to_day(end_date)
+    # 区間の終了日・開始日はどちらも昇順のため、二分探索で範囲を決められる
+    lo = np.searchsorted(runs['end'], start_day, side='left')
+    hi = np.searchsorted(runs['start'], end_day, side='right')
+    return runs[lo:hi]
+
+
+def load_archived_prices(stock_codes, start_date, end_date):
+    """
+    複数銘柄の日次価格をアーカイブからまとめて取得（バックテスト用）
+
+    Parameters:
+    stock_codes (list): 銘柄コードのリスト
+    start_date (str): 開始日（YYYY-MM-DD形式）
+    end_date (str): 終了日（YYYY-MM-DD形式、この日を含む）
+
+    Returns:
+    pandas.DataFrame: 日付をインデックス、銘柄コードを列とする価格（アーカイブにない日はNaN）
+    """
+    index = pd.date_range(start_date, end_date, freq='D')
+    start_day = _to_day(start_date)
+    frame = np.full((len(index), len(stock_codes)), np.nan)
+
+    for col, stock_code in enumerate(stock_codes):
+        runs = read_archived_runs(stock_code, start_date, end_date)
+        if len(runs) == 0:
+            continue
+        days, prices = _decode_runs(runs)
+        rows = days - start_day
+        in_range = (rows >= 0) & (rows < len(index))
+        frame[rows[in_range], col] = prices[in_range]
+
+    return pd.DataFrame(frame, index=index, columns=list(stock_codes))
+
+
+def merge_into_archive(stock_code, rows):
+    """
+    (日付, 価格) の行をアーカイブへ追加する（同じ日付は新しい値で上書き）
+
+    追加する日付がすべてアーカイブの最終日より後であれば、ファイル末尾へ追記して
+    ヘッダのレコード数を更新するだけで済ませる（通常の日次アーカイブはこちら）。
+    過去の日付を含む場合は全体を書き直す。
+    読み込んでから書き終えるまで _archive_write_lock を持つ（同時に追記するとレコード数が壊れるため）。
+
+    Parameters:
+    stock_code (str): 銘柄コード
+    rows (list): [('YYYY-MM-DD', price), ...]
+
+    Returns:
+    int: 書き込み後の区間数
+    """
+    new_days = np.array([_to_day(date_str) for date_str, _ in rows], dtype=np.int64)
+    new_prices = np.array([price for _, price in rows], dtype=np.float64)
+    # 日付で並べ替え、同じ日付は後の値を残す
+    order = np.argsort(new_days, kind='stable')[::-1]
+    new_days, first = np.unique(new_days[order], return_index=True)
+    new_prices = new_prices[order][first]
+
+    with _archive_write_lock:
+        path = get_archive_path(stock_code)
+        existing = _load_archive(stock_code)
+
+        if existing is not None and len(existing) > 0 and new_days[0] > existing['end'][-1]:
+            last = existing[-1]
+            runs = _encode_runs(new_days, new_prices)
+            count = len(existing)
+            # 最後の区間と連続していて同じ価格なら、その区間の終了日を延ばす
+            if runs['start'][0] == last['end'] + 1 and runs['price'][0] == last['price']:
+                extended = np.array([(last['start'], runs['end'][0], last['price'])], dtype=RECORD_DTYPE)
+                runs = np.concatenate([extended, runs[1:]])
+                count -= 1
+            with open(path, 'r+b') as f:
+                f.seek(HEADER_SIZE + count * RECORD_DTYPE.itemsize)
+                f.write(runs.tobytes())
+                f.flush()
+                # レコードを書き終えてからヘッダを更新する
+                header = _make_header(runs)
+                header['count'] = count + len(runs)
+                header['first_day'] = existing['start'][0]
+                f.seek(0)
+                f.write(header.tobytes())
+            return count + len(runs)
+
+        if existing is not None and len(existing) > 0:
+            old_days, old_prices = _decode_runs(np.asarray(existing))
+            days = np.concatenate([new_days, old_days])
+            prices = np.concatenate([new_prices, old_prices])
+            # 重複は先に並べた新しい値を残す
+            days, first = np.unique(days, return_index=True)
+            prices = prices[first]
+        else:
+            days, prices = new_days, new_prices
+
+        runs = _encode_runs(days, prices)
+        _write_archive(path, runs)
+        return len(runs)
+
+
+def archive_price_cache(hot_days=PRICE_CACHE_HOT_DAYS, max_tickers=PRICE_ARCHIVE_MAX_TICKERS):
+    """
+    保持期間を過ぎた price_cache の行をアーカイブへ移動する
+
+    アーカイブへの書き込みが完了した銘柄だけをSQLiteから削除するため、
+    途中で失敗しても値が失われることはない。
+
+    Parameters:
+    hot_days (int): SQLiteに残す日数
+    max_tickers (int): 1回で処理する銘柄数の上限（Noneの場合は全銘柄）
+
+    Returns:
+    dict: {'tickers': 処理した銘柄数, 'rows': 移動した行数, 'runs': 書き込んだ区間数}
+    """
+    init_price_cache_table()
+    convert_legacy_archives()
+    cutoff = (datetime.now() - timedelta(days=hot_days)).strftime('%Y-%m-%d')
+    summary = {'tickers': 0, 'rows': 0, 'runs': 0}
+
+    # メンテナンスのスレッドと管理画面から同時に実行された場合は、後から実行した方が待つ
+    with _archive_write_lock:
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            query = "SELECT DISTINCT stock_code FROM price_cache WHERE date < ?"
+            params = [cutoff]
+            if max_tickers is not None:
+                query += " LIMIT ?"
+                params.append(max_tickers)
+            stock_codes = [row[0] for row in cursor.execute(query, params).fetchall()]
+
+            for stock_code in stock_codes:
+                rows = cursor.execute("""
+                    SELECT date, price FROM price_cache
+                    WHERE stock_code = ? AND date < ?
+                    ORDER BY date
+                """, (stock_code, cutoff)).fetchall()
+                if not rows:
+                    continue
+
+                summary['runs'] += merge_into_archive(stock_code, rows)
+                cursor.execute(
+                    "DELETE FROM price_cache WHERE stock_code = ? AND date < ?",
+                    (stock_code, cutoff)
+                )
+                conn.commit()
+                summary['tickers'] += 1
+                summary['rows'] += len(rows)
+        finally:
+            conn.close()
+
+    return summary
+
+
+def get_price_storage_status():
+    """
+    ホット層とアーカイブ層の件数を取得
+
+    Returns:
+    dict: hot_rows, hot_tickers, oldest_hot_date, archive_files, archive_runs, archive_bytes
+    """
+    init_price_cache_table()
+    conn = get_connection()
+    try:
+        hot_rows, hot_tickers, oldest_hot_date = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT stock_code), MIN(date) FROM price_cache"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    archive_dir = get_archive_dir()
+    archive_files = 0
+    archive_runs = 0
+    archive_bytes = 0
+    for name in os.listdir(archive_dir):
+        if not name.endswith(ARCHIVE_SUFFIX):
+            continue
+        path = os.path.join(archive_dir, name)
+        archive_files += 1
+        archive_bytes += os.path.getsize(path)
+        archive_runs += int(_read_header(path)['count'])
+
+    return {
+        'hot_rows': hot_rows,
+        'hot_tickers': hot_tickers,
+        'oldest_hot_date': oldest_hot_date,
+        'archive_files': archive_files,
+        'archive_runs': archive_runs,
+        'archive_bytes': archive_bytes,
+    }
@@ -0,0 +1,395 @@
+"""
+起動時間のプロファイリング
+
+環境変数 PROFILE_STARTUP=1 で起動すると、次の時間を記録する（無効時は何もしない）。
+- モジュールごとのimport時間（子モジュールを含む時間と、自身の実行時間）
+- ページごとのモジュールimport時間（初回=コールドかどうか）と show() の実行時間
+- init_db / ChatWorkのOAuthコールバック処理 / サイドバー描画の累積時間
+記録した結果はJSONのレポートとしてDBと同じディレクトリの profiles/ に保存し、
+データベース管理ページの「起動プロファイル」タブに表示する。
+
+ページのコールドimportが予算（PAGE_IMPORT_BUDGET_MS）を超えていないかは、
+ページごとに新しいプロセスでimportして確認できる（CI向け、超過時は終了コード1）。
+    python -m utils.profiler [--budget-ms 2000] [--output profile_budget.json]
+
+アプリの最初のimportより前に読み込むため、このモジュールは標準ライブラリだけを使う。
+"""
+import argparse
+import builtins
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from importlib import import_module
+from importlib.util import resolve_name
+
+PROFILE_ENV = 'PROFILE_STARTUP'
+
+# ページのコールドimport時間の予算（ミリ秒）
+PAGE_IMPORT_BUDGET_MS = float(os.environ.get('PROFILE_PAGE_IMPORT_BUDGET_MS', 2000))
+
+# レポートに載せるimport時間上位のモジュール数
+PROFILE_TOP_IMPORTS = 50
+
+PROFILE_REPORT_NAME = 'startup_profile.json'
+
+# app.pyが起動時に読み込むモジュール（ページのコールドimport計測ではこれらを読み込み済みの状態から測る）
+APP_BASE_MODULES = ('streamlit', 'utils.db', 'utils.maintenance', 'utils.common', 'utils.chatwork')
+
+_lock = threading.Lock()
+_local = threading.local()
+_enabled = False
+_original_import = builtins.__import__
+_started_at = None
+_imports = {}
+_sections = {}
+_pages = {}
+
+
+def is_enabled():
+    return _enabled
+
+
+def _is_env_enabled():
+    return os.environ.get(PROFILE_ENV, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _import_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _timed_load(full_name, load):
+    """
+    新しく読み込まれるモジュールのimport時間を計測する
+
+    入れ子のimportの時間は親の「子を含む時間」に含まれ、「自身の時間」からは差し引く。
+    full_name は記録するモジュール名（from package import a, b で複数のサブモジュールを読み込む場合は "package.a, package.b"）。
+    """
+    stack = _import_stack()
+    frame = {'name': full_name, 'children_ms': 0.0}
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        return load()
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            parent['children_ms'] += elapsed_ms
+        if all(name in sys.modules for name in full_name.split(', ')):
+            with _lock:
+                _imports.setdefault(full_name, {
+                    'module': full_name,
+                    'inclusive_ms': elapsed_ms,
+                    'self_ms': max(elapsed_ms - frame['children_ms'], 0.0),
+                    'parent': parent['name'] if parent else None,
+                    'order': len(_imports),
+                })
+
+
+def _profiling_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level:
+        try:
+            package = (globals or {}).get('__package__') or ''
+            full_name = resolve_name('.' * level + name, package)
+        except (ImportError, ValueError):
+            return _original_import(name, globals, locals, fromlist, level)
+    else:
+        full_name = name
+    module = sys.modules.get(full_name)
+    if module is not None:
+        # from package import submodule は、パッケージが読み込み済みでもサブモジュールが新しければ計測する
+        new_submodules = [
+            f"{full_name}.{item}" for item in fromlist or ()
+            if item != '*' and not hasattr(module, item) and f"{full_name}.{item}" not in sys.modules
+        ]
+        if not new_submodules:
+            return _original_import(name, globals, locals, fromlist, level)
+        full_name = ', '.join(new_submodules)
+    return _timed_load(full_name, lambda: _original_import(name, globals, locals, fromlist, level))
+
+
+def enable():
+    """
+    プロファイリングを有効にし、以降のimport時間の記録を開始する
+    （import文はbuiltins.__import__を経由するため、これを差し替える）
+    """
+    global _enabled, _started_at
+    with _lock:
+        if _enabled:
+            return
+        _enabled = True
+        _started_at = datetime.now()
+    builtins.__import__ = _profiling_import
+
+
+def enable_from_env():
+    """環境変数 PROFILE_STARTUP が有効な場合にプロファイリングを開始する"""
+    if _is_env_enabled():
+        enable()
+    return _enabled
+
+
+def disable():
+    """import時間の記録を止める（記録済みの結果は残す）"""
+    global _enabled
+    builtins.__import__ = _original_import
+    with _lock:
+        _enabled = False
+
+
+def _add_timing(store, key, elapsed_ms):
+    with _lock:
+        entry = store.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+
+@contextmanager
+def _timed_section(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_timing(_sections, name, (time.perf_counter() - start) * 1000)
+
+
+def section(name):
+    """
+    処理の時間を累積して記録するコンテキストマネージャ（無効時は何もしない）
+
+    使用例:
+        with profiler.section('init_db'):
+            init_db()
+    """
+    if not _enabled:
+        return nullcontext()
+    return _timed_section(name)
+
+
+def import_page(page, module_name):
+    """
+    ページのモジュールをimportし、初回（コールド）のimport時間を記録する
+
+    Returns:
+    module: importしたモジュール
+    """
+    if not _enabled or module_name in sys.modules:
+        return import_module(module_name)
+
+    start = time.perf_counter()
+    module = _timed_load(module_name, lambda: import_module(module_name))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    with _lock:
+        _pages.setdefault(page, {})['import_ms'] = elapsed_ms
+    return module
+
+
+@contextmanager
+def _timed_page_show(page):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _lock:
+            entry = _pages.setdefault(page, {})
+            show = entry.setdefault('show', {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            show['count'] += 1
+            show['total_ms'] += elapsed_ms
+            show['max_ms'] = max(show['max_ms'], elapsed_ms)
+            show['last_ms'] = elapsed_ms
+
+
+def page_show(page):
+    """ページの show() の実行時間を記録するコンテキストマネージャ（無効時は何もしない）"""
+    if not _enabled:
+        return nullcontext()
+    return _timed_page_show(page)
+
+
+def check_budget(pages, budget_ms=PAGE_IMPORT_BUDGET_MS):
+    """
+    ページのコールドimport時間が予算を超えていないか確認する
+
+    Parameters:
+    pages (dict): {ページ名: {'import_ms': ミリ秒, ...}}
+    budget_ms (float): 予算（ミリ秒）
+
+    Returns:
+    list: 予算を超えたページ [{'page', 'import_ms', 'budget_ms'}, ...]（import時間の降順）
+    """
+    violations = [
+        {'page': page, 'import_ms': entry['import_ms'], 'budget_ms': budget_ms}
+        for page, entry in pages.items()
+        if entry.get('import_ms') is not None and entry['import_ms'] > budget_ms
+    ]
+    return sorted(violations, key=lambda v: v['import_ms'], reverse=True)
+
+
+def get_report(budget_ms=PAGE_IMPORT_BUDGET_MS):
+    """
+    このプロセスで記録した結果をレポートにまとめる
+
+    Returns:
+    dict: generated_at, started_at, pid, enabled, budget_ms,
+        imports（子を含む時間の降順、上位PROFILE_TOP_IMPORTS件）, import_count, import_total_ms,
+        sections, pages, violations
+    """
+    with _lock:
+        imports = [dict(entry) for entry in _imports.values()]
+        sections = {name: dict(entry) for name, entry in _sections.items()}
+        pages = {
+            page: {key: dict(value) if isinstance(value, dict) else value for key, value in entry.items()}
+            for page, entry in _pages.items()
+        }
+        started_at = _started_at
+
+    # 最上位のimport（親なし）だけを合計すると入れ子を二重に数えない
+    import_total_ms = sum(entry['inclusive_ms'] for entry in imports if entry['parent'] is None)
+    return {
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S') if started_at else None,
+        'pid': os.getpid(),
+        'enabled': _enabled,
+        'budget_ms': budget_ms,
+        'import_count': len(imports),
+        'import_total_ms': import_total_ms,
+        'imports': sorted(imports, key=lambda e: e['inclusive_ms'], reverse=True)[:PROFILE_TOP_IMPORTS],
+        'sections': sections,
+        'pages': pages,
+        'violations': check_budget(pages, budget_ms),
+    }
+
+
+def get_report_path():
+    """レポートの保存先（DBファイルと同じディレクトリ配下のprofiles）"""
+    from utils.db import get_db_path
+    profile_dir = os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, PROFILE_REPORT_NAME)
+
+
+def write_report(path=None):
+    """
+    レポートをJSONで保存する（無効時は何もしない）
+
+    一時ファイルへ書き込んでからリネームするため、表示中に読んでも壊れたJSONにならない。
+
+    Returns:
+    str: 保存したパス、または無効時はNone
+    """
+    if not _enabled:
+        return None
+    path = path or get_report_path()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(get_report(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_report(path=None):
+    """保存済みのレポートを読み込む（なければNone）"""
+    path = path or get_report_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _measure_page_in_subprocess(module_name):
+    """新しいプロセスでアプリの起動時のモジュールを読み込んだ後、ページのコールドimport時間を計測"""
+    code = (
+        "import json, sys, time\n"
+        f"for name in {APP_BASE_MODULES!r}:\n"
+        "    __import__(name)\n"
+        "from utils import profiler\n"
+        "profiler.enable()\n"
+        "start = time.perf_counter()\n"
+        f"profiler.import_page('page', {module_name!r})\n"
+        "elapsed_ms = (time.perf_counter() - start) * 1000\n"
+        "report = profiler.get_report()\n"
+        "print(json.dumps({'import_ms': elapsed_ms, 'imports': report['imports'][:10]}))\n"
+    )
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=root_dir, capture_output=True, text=True,
+        env={**os.environ, PROFILE_ENV: ''}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_page_imports(page_modules, budget_ms=PAGE_IMPORT_BUDGET_MS):
+    """
+    ページごとに新しいプロセスでコールドimport時間を計測し、予算を確認する
+
+    Parameters:
+    page_modules (dict): {ページ名: モジュール名}（app.PAGES と同じ対応）
+
+    Returns:
+    dict: generated_at, budget_ms, pages（{ページ名: {'module', 'import_ms', 'imports'} または {'module', 'error'}}）, violations
+    """
+    pages = {}
+    for page, module_name in page_modules.items():
+        try:
+            pages[page] = {'module': module_name, **_measure_page_in_subprocess(module_name)}
+        except Exception as e:
+            pages[page] = {'module': module_name, 'import_ms': None, 'error': str(e)}
+    return {
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'budget_ms': budget_ms,
+        'pages': pages,
+        'violations': check_budget(pages, budget_ms),
+    }
+
+
+def _discover_page_modules():
+    """pagesディレクトリのページモジュール一覧（app.pyを読み込むとアプリが起動するため、ファイルから求める）"""
+    pages_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pages')
+    return {
+        name[:-3]: f"pages.{name[:-3]}"
+        for name in sorted(os.listdir(pages_dir))
+        if name.endswith('.py') and not name.startswith('_')
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ページのコールドimport時間を計測し、予算を超えていないか確認する')
+    parser.add_argument('--budget-ms', type=float, default=PAGE_IMPORT_BUDGET_MS, help='ページごとのimport時間の予算（ミリ秒）')
+    parser.add_argument('--output', help='結果を保存するJSONファイルのパス')
+    args = parser.parse_args(argv)
+
+    result = measure_page_imports(_discover_page_modules(), args.budget_ms)
+    for page, entry in sorted(result['pages'].items(), key=lambda item: -(item[1].get('import_ms') or 0)):
+        if entry.get('error'):
+            print(f"{page:<24} ERROR {entry['error']}")
+        else:
+            mark = ' OVER' if entry['import_ms'] > args.budget_ms else ''
+            print(f"{page:<24} {entry['import_ms']:>9.1f} ms{mark}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    errors = [page for page, entry in result['pages'].items() if entry.get('error')]
+    if result['violations'] or errors:
+        print(f"予算 {args.budget_ms:.0f} ms を超えたページ: {', '.join(v['page'] for v in result['violations']) or 'なし'}"
+              f" / importに失敗したページ: {', '.join(errors) or 'なし'}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+描画結果（PNG）のディスクキャッシュ
+
+描画に使う入力（投票データ・日付・フォント・画像の種類など）のハッシュをキーに、完成したPNGのバイト列を
+ファイルとして保存する。入力が同じなら再描画せずにファイルを返すため、再実行やプロセスの再起動をまたいで使える。
+合計サイズが上限を超えたら、最後に使われた時刻（ファイルの更新時刻）が古いものから削除する（LRU）。
+"""
+import hashlib
+import json
+import os
+import threading
+from utils import metrics
+
+# キャッシュの合計サイズの上限（バイト）
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# 描画処理を変更したときに上げる（古い画像をキーから外す）
+RENDER_CACHE_VERSION = 1
+
+RENDER_CACHE_SUFFIX = '.png'
+
+_lock = threading.Lock()
+
+
+def get_render_cache_dir():
+    """キャッシュの保存先（DBファイルと同じディレクトリ配下のrender_cache）"""
+    from utils.db import get_db_path
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'render_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def make_key(variant, *parts):
+    """
+    描画の入力からキャッシュのキーを作成
+
+    Parameters:
+    variant (str): 画像の種類（例: 'wordcloud_code'）
+    parts: 描画結果を決める値（JSONにできる値。日付などは文字列にする）
+
+    Returns:
+    str: "種類-SHA256" 形式のキー
+    """
+    payload = json.dumps([RENDER_CACHE_VERSION, variant, *parts], ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    return f"{variant}-{digest}"
+
+
+def font_fingerprint(font_path):
+    """フォントファイルの識別値（パス・サイズ・更新時刻）。フォントがない場合はNone"""
+    if not font_path or not os.path.exists(font_path):
+        return None
+    stat = os.stat(font_path)
+    return [os.path.abspath(font_path), stat.st_size, int(stat.st_mtime)]
+
+
+def _path(key):
+    return os.path.join(get_render_cache_dir(), key + RENDER_CACHE_SUFFIX)
+
+
+def get(key):
+    """キャッシュ済みのPNGを返す（ない場合はNone）。読んだファイルは最近使ったものとして扱う"""
+    path = _path(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        metrics.count_cache('render_cache', False)
+        return None
+    metrics.count_cache('render_cache', True)
+    return data
+
+
+def put(key, data):
+    """PNGを保存し、上限を超えた分を古いものから削除"""
+    path = _path(key)
+    # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    evict()
+
+
+def get_or_render(key, render):
+    """
+    キャッシュ済みのPNGを返し、ない場合は描画して保存する
+
+    Parameters:
+    key (str): make_key で作成したキー
+    render (callable): 引数なしでPNGのバイト列を返す関数
+
+    Returns:
+    bytes: PNGのバイト列
+    """
+    data = get(key)
+    if data is None:
+        data = render()
+        put(key, data)
+    return data
+
+
+def _entries():
+    """[(更新時刻, サイズ, パス), ...]（古い順）"""
+    cache_dir = get_render_cache_dir()
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(RENDER_CACHE_SUFFIX):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    return entries
+
+
+def evict(max_bytes=None):
+    """
+    合計サイズが上限以下になるまで、最後に使われた時刻が古いものから削除
+
+    Returns:
+    int: 削除したファイル数
+    """
+    max_bytes = RENDER_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    removed = 0
+    with _lock:
+        entries = _entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+    return removed
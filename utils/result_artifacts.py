@@ -0,0 +1,397 @@
+"""
+投票結果のダウンロード用ファイル（成果物）の事前作成
+
+投票が保存されると、その日付の成果物（銘柄コードのtxt・票数付txt・CSV・Excel・ワードクラウド2種・ランキング画像）を
+バックグラウンドのスレッドで作成し、DBファイルと同じディレクトリ配下の result_artifacts/<投票日>/ に保存する。
+同じ日付の投票が続いた場合は、最後の投票から RESULT_ARTIFACT_DEBOUNCE 秒待ってから1回だけ作成する。
+結果ページとChatWorkへの投稿は保存済みのファイルを読むだけにする。
+保存時の投票データのバージョン（集計結果のハッシュ）が現在と異なる場合は、その場で作り直す。
+全日付の合計サイズが RESULT_ARTIFACT_MAX_BYTES を超えたら、最後に使われた（マニフェストの更新時刻が古い）日付から削除する。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import streamlit as st
+from utils import exports
+from utils.common import format_vote_data_with_thresh
+from utils.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# 同じ日付の投票が続いたときに作成を待つ時間（秒）
+RESULT_ARTIFACT_DEBOUNCE = 10
+
+# 全日付の成果物の合計サイズの上限（バイト）
+RESULT_ARTIFACT_MAX_BYTES = int(os.environ.get('RESULT_ARTIFACT_MAX_BYTES', 256 * 1024 * 1024))
+
+# 成果物の内容を変更したときに上げる（保存済みの成果物を作り直す）
+RESULT_ARTIFACT_VERSION = 1
+
+RESULT_ARTIFACT_MANIFEST = 'manifest.json'
+
+# 成果物の名前 -> (ファイル名の書式, MIMEタイプ)。ファイル名の {date} は YYYYMMDD
+ARTIFACTS = {
+    'codes_txt': ("投票結果{date}.txt", "text/plain"),
+    'thresh_txt': ("投票結果{date}_票数付.txt", "text/plain"),
+    'csv': ("投票結果{date}.csv", "text/csv"),
+    'excel': ("投票結果{date}.xlsx", exports.EXCEL_MIME),
+    'wordcloud_code': ("銘柄投票{date}.png", "image/png"),
+    'wordcloud_name': ("銘柄名投票{date}.png", "image/png"),
+    'ranking': ("銘柄投票ランキング{date}.png", "image/png"),
+}
+
+# ChatWorkに投稿する成果物（投稿順）
+CHATWORK_ARTIFACTS = ['thresh_txt', 'wordcloud_code', 'ranking']
+
+_build_lock = threading.Lock()
+
+
+def get_vote_summary(selected_date_str):
+    """
+    対象日の投票数の合計・投票ボタンが押された回数・銘柄ごとの投票数（多い順）を取得
+
+    Returns:
+    tuple: (投票数の合計, 投票ボタンが押された回数, [(銘柄コード, 投票数, 銘柄名), ...])
+    """
+    # 投票数の合計と投票ボタンが押された回数を取得
+    conn = get_connection()
+    c = conn.cursor()
+
+    # 投票数の合計を取得
+    c.execute(
+        """
+        SELECT COUNT(*) as total_votes
+        FROM vote
+        WHERE vote_date = ?
+        """,
+        (selected_date_str,)
+    )
+    result = c.fetchone()
+    total_votes = result[0] if result is not None else 0
+
+    # 投票ボタンが押された回数を取得（created_atが同じものを1回としてカウント）
+    c.execute(
+        """
+        SELECT COUNT(DISTINCT created_at) as vote_sessions
+        FROM vote
+        WHERE vote_date = ?
+        """,
+        (selected_date_str,)
+    )
+    vote_sessions_result = c.fetchone()
+    vote_sessions = vote_sessions_result[0] if vote_sessions_result is not None else 0
+
+    # voteテーブルから、対象日の各銘柄の投票数を集計（多い順）
+    c.execute(
+        """
+        SELECT v.stock_code, COUNT(*) as vote_count, m.stock_name
+        FROM vote v
+        LEFT JOIN stock_master m ON v.stock_code = m.stock_code
+        WHERE v.vote_date = ?
+        GROUP BY v.stock_code
+        ORDER BY vote_count DESC
+        """,
+        (selected_date_str,)
+    )
+    results = c.fetchall()
+    conn.close()
+
+    return total_votes, vote_sessions, results
+
+
+def get_data_version(vote_sessions, results):
+    """成果物の元になる集計結果のハッシュ（投票や銘柄名が変わると変わる）"""
+    payload = json.dumps([RESULT_ARTIFACT_VERSION, vote_sessions, [list(row) for row in results]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_artifact_root():
+    """成果物の保存先のルート（DBファイルと同じディレクトリ配下のresult_artifacts）"""
+    from utils.db import get_db_path
+    return os.path.join(os.path.dirname(os.path.abspath(get_db_path())), 'result_artifacts')
+
+
+def get_artifact_dir(vote_date_str):
+    """成果物の保存先（DBファイルと同じディレクトリ配下のresult_artifacts/<投票日>）"""
+    artifact_dir = os.path.join(get_artifact_root(), vote_date_str)
+    os.makedirs(artifact_dir, exist_ok=True)
+    return artifact_dir
+
+
+def build_artifacts(vote_date_str, vote_sessions, results):
+    """
+    成果物を作成する
+
+    Parameters:
+    vote_date_str (str): 投票日（YYYY-MM-DD形式）
+    vote_sessions (int): 投票ボタンが押された回数
+    results (list): [(銘柄コード, 投票数, 銘柄名), ...]（投票数の多い順）
+
+    Returns:
+    dict: {成果物の名前: bytes}（wordcloud/matplotlibがない場合は画像を含まない）
+    """
+    data = {
+        'codes_txt': "\n".join(row[0] for row in results).encode('utf-8'),
+        'csv': exports.build_vote_csv(results, '投票数'),
+        'excel': exports.build_vote_excel(results, '投票数', '投票結果'),
+    }
+    sorted_results_with_thresh = format_vote_data_with_thresh(results)
+    if sorted_results_with_thresh:
+        data['thresh_txt'] = sorted_results_with_thresh.encode('utf-8')
+
+    try:
+        from utils import result_render
+        vote_dict = {row[0]: row[1] for row in results}
+        stock_name_dict = {row[2] or row[0]: row[1] for row in results}  # 銘柄名がNoneの場合は銘柄コードを使用
+        data['wordcloud_code'] = result_render.get_wordcloud_png(vote_dict, vote_date_str, "code")
+        data['wordcloud_name'] = result_render.get_wordcloud_png(stock_name_dict, vote_date_str, "name")
+        data['ranking'] = result_render.get_ranking_png(results, vote_date_str, vote_sessions)
+    except ImportError as e:
+        logger.warning("Result images were not rendered: %s", e)
+    return data
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_artifacts(vote_date_str, version, data):
+    """成果物をファイルに保存し、最後にマニフェストを書き換える（読み込み中に途中の状態が見えないようにする）"""
+    artifact_dir = get_artifact_dir(vote_date_str)
+    date_label = vote_date_str.replace('-', '')
+    files = {}
+    for name, content in data.items():
+        file_format, mime = ARTIFACTS[name]
+        stored_name = f"{name}-{version[:16]}"
+        _write_atomic(os.path.join(artifact_dir, stored_name), content)
+        files[name] = {'file_name': file_format.format(date=date_label), 'mime': mime, 'stored_name': stored_name}
+
+    manifest = {
+        'vote_date': vote_date_str,
+        'version': version,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'files': files,
+    }
+    _write_atomic(
+        os.path.join(artifact_dir, RESULT_ARTIFACT_MANIFEST),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    )
+
+    # 以前のバージョンのファイルを削除
+    keep = {entry['stored_name'] for entry in files.values()} | {RESULT_ARTIFACT_MANIFEST}
+    for name in os.listdir(artifact_dir):
+        if name not in keep and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(artifact_dir, name))
+            except OSError:
+                pass
+
+    evict_artifacts(keep=vote_date_str)
+    return manifest
+
+
+def _date_entries():
+    """[(最後に使われた時刻, サイズ, 投票日), ...]（古い順。マニフェストがない日付はディレクトリの更新時刻）"""
+    root = get_artifact_root()
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    entries = []
+    for vote_date_str in names:
+        artifact_dir = os.path.join(root, vote_date_str)
+        try:
+            last_used = os.stat(artifact_dir).st_mtime
+            size = 0
+            for name in os.listdir(artifact_dir):
+                stat = os.stat(os.path.join(artifact_dir, name))
+                size += stat.st_size
+                if name == RESULT_ARTIFACT_MANIFEST:
+                    last_used = stat.st_mtime
+        except OSError:
+            continue
+        entries.append((last_used, size, vote_date_str))
+    entries.sort()
+    return entries
+
+
+def evict_artifacts(max_bytes=None, keep=None):
+    """
+    全日付の合計サイズが上限以下になるまで、最後に使われた時刻が古い日付の成果物を削除
+
+    削除した日付は次に結果ページが表示されたときに作り直される。
+
+    Parameters:
+    max_bytes (int): 合計サイズの上限（Noneの場合は RESULT_ARTIFACT_MAX_BYTES）
+    keep (str): 削除しない投票日（作成したばかりの日付）
+
+    Returns:
+    int: 削除した日付の数
+    """
+    max_bytes = RESULT_ARTIFACT_MAX_BYTES if max_bytes is None else max_bytes
+    entries = _date_entries()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, vote_date_str in entries:
+        if total <= max_bytes:
+            break
+        if vote_date_str == keep:
+            continue
+        shutil.rmtree(os.path.join(get_artifact_root(), vote_date_str), ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def load_manifest(vote_date_str):
+    """保存済みのマニフェスト（ない場合はNone）"""
+    path = os.path.join(get_artifact_root(), vote_date_str, RESULT_ARTIFACT_MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _touch_manifest(vote_date_str):
+    """成果物を読んだ日付を最近使ったものとして扱う（削除の順番に使う）"""
+    try:
+        os.utime(os.path.join(get_artifact_root(), vote_date_str, RESULT_ARTIFACT_MANIFEST))
+    except OSError:
+        pass
+
+
+def _read_artifacts(vote_date_str, manifest):
+    artifact_dir = os.path.join(get_artifact_root(), vote_date_str)
+    artifacts = {}
+    for name, entry in manifest['files'].items():
+        with open(os.path.join(artifact_dir, entry['stored_name']), 'rb') as f:
+            artifacts[name] = (entry['file_name'], f.read(), entry['mime'])
+    return artifacts
+
+
+def refresh_artifacts(vote_date_str):
+    """
+    投票日の成果物を現在の投票データで作成し直す（バージョンが同じなら何もしない）
+
+    Returns:
+    bool: 作成した場合はTrue
+    """
+    total_votes, vote_sessions, results = get_vote_summary(vote_date_str)
+    if not results:
+        return False
+    version = get_data_version(vote_sessions, results)
+    with _build_lock:
+        manifest = load_manifest(vote_date_str)
+        if manifest is not None and manifest['version'] == version:
+            return False
+        save_artifacts(vote_date_str, version, build_artifacts(vote_date_str, vote_sessions, results))
+    return True
+
+
+def load_or_build_artifacts(vote_date_str, vote_sessions, results):
+    """
+    投票日の成果物を返す
+
+    保存済みの成果物が現在の集計結果と同じバージョンならファイルを読むだけで、
+    異なる場合（バックグラウンドの作成前に表示された場合など）はその場で作成して保存する。
+
+    Parameters:
+    vote_date_str (str): 投票日（YYYY-MM-DD形式）
+    vote_sessions (int): 投票ボタンが押された回数
+    results (list): get_vote_summary の銘柄ごとの投票数
+
+    Returns:
+    dict: {成果物の名前: (ファイル名, bytes, MIMEタイプ)}
+    """
+    version = get_data_version(vote_sessions, results)
+    manifest = load_manifest(vote_date_str)
+    if manifest is None or manifest['version'] != version:
+        with _build_lock:
+            # 待っている間に別のスレッドが作成した場合は読むだけにする
+            manifest = load_manifest(vote_date_str)
+            if manifest is None or manifest['version'] != version:
+                manifest = save_artifacts(vote_date_str, version, build_artifacts(vote_date_str, vote_sessions, results))
+    try:
+        artifacts = _read_artifacts(vote_date_str, manifest)
+    except OSError:
+        # 読み込み中に新しいバージョンで置き換えられた、または上限を超えて削除された場合
+        with _build_lock:
+            manifest = load_manifest(vote_date_str)
+            if manifest is None:
+                manifest = save_artifacts(vote_date_str, version, build_artifacts(vote_date_str, vote_sessions, results))
+            artifacts = _read_artifacts(vote_date_str, manifest)
+    _touch_manifest(vote_date_str)
+    return artifacts
+
+
+class ArtifactPipeline:
+    """投票日ごとに成果物の作成を遅らせてまとめるバックグラウンドスレッド"""
+
+    def __init__(self, debounce=RESULT_ARTIFACT_DEBOUNCE):
+        self.debounce = debounce
+        self.last_built = {}
+        self.last_error = None
+        self._pending = {}  # {投票日: 作成する時刻（monotonic）}
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='result-artifacts', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def schedule(self, vote_date_str):
+        """投票日の成果物の作成を予約（予約済みの場合は作成時刻を後ろにずらす）"""
+        with self._condition:
+            self._pending[vote_date_str] = time.monotonic() + self.debounce
+            self._condition.notify()
+
+    def _next_due(self):
+        """作成時刻になった投票日を取り出す（ない場合は次の作成時刻まで待つ）"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = [date for date, at in self._pending.items() if at <= now]
+                if due:
+                    vote_date_str = min(due, key=self._pending.get)
+                    del self._pending[vote_date_str]
+                    return vote_date_str
+                timeout = min(self._pending.values()) - now if self._pending else None
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            vote_date_str = self._next_due()
+            try:
+                refresh_artifacts(vote_date_str)
+                self.last_built[vote_date_str] = datetime.now()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Building result artifacts for %s failed: %s", vote_date_str, e)
+
+
+@st.cache_resource
+def start_artifact_pipeline():
+    """
+    成果物の作成スレッドを起動する。
+    @st.cache_resourceデコレータにより、プロセスごとに1回のみ起動される。
+    """
+    pipeline = ArtifactPipeline()
+    pipeline.start()
+    return pipeline
+
+
+def schedule_artifacts(vote_date_str):
+    """投票の保存後に呼び出し、投票日の成果物をバックグラウンドで作成する"""
+    start_artifact_pipeline().schedule(vote_date_str)
@@ -0,0 +1,190 @@
+"""
+投票結果の画像（ワードクラウド・ランキング表）の描画（Streamlitに依存しない）
+
+描画結果はPNGのバイト列で返し、utils.render_cache に入力のハッシュをキーとして保存する。
+投票データが変わらない限り、ページの再実行では保存済みのPNGをそのまま使う。
+matplotlibはpyplotを使わずFigureを直接作る（図がプロセス内に残らず、スレッドからも描画できる）。
+"""
+import os
+import platform
+from io import BytesIO
+from utils import render_cache
+
+# ランキング画像に載せる件数
+RANKING_TOP_N = 20
+
+def get_font_path():
+    """
+    環境に応じて日本語フォントのパスを返す関数
+
+    Returns:
+    str: 日本語フォントのパス
+    """
+    # アプリケーション内のフォントファイルのパスを取得
+    app_font_path = os.path.join(os.path.dirname(__file__), "..", "fonts", "NotoSansJP-Regular.otf")
+    if os.path.exists(app_font_path):
+        return app_font_path
+
+    # バックアップとしてシステムフォントをチェック
+    system = platform.system()
+    if system == "Windows":
+        return "C:/Windows/Fonts/msgothic.ttc"
+    elif system == "Darwin":  # macOS
+        # macOS環境で一般的な日本語フォントのパス
+        possible_paths = [
+            "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+            "/System/Library/Fonts/ヒラギノ角ゴ Pro W3.otf",
+            "/System/Library/Fonts/ヒラギノ明朝 ProN W3.otf",
+            "/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+            "/Library/Fonts/ヒラギノ角ゴ Pro W3.otf",
+            "/Library/Fonts/ヒラギノ明朝 ProN W3.otf"
+        ]
+        for path in possible_paths:
+            if os.path.exists(path):
+                return path
+    else:  # Linux
+        system_font_paths = [
+            "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+            "/usr/share/fonts/truetype/noto/NotoSansJP-Regular.otf",
+            "/usr/share/fonts/truetype/ipa/ipag.ttf",
+            "/usr/share/fonts/truetype/ipa/ipagp.ttf"
+        ]
+        for path in system_font_paths:
+            if os.path.exists(path):
+                return path
+    return None
+
+def _figure_to_png(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format="png", bbox_inches='tight', pad_inches=0.1)
+    return buf.getvalue()
+
+def render_wordcloud_png(frequencies, font_path):
+    """
+    ワードクラウドを描画してPNGのバイト列を返す
+
+    Parameters:
+    frequencies (dict): {表示する語: 投票数}
+    font_path (str): 日本語フォントのパス（Noneの場合はwordcloudの既定のフォント）
+    """
+    from wordcloud import WordCloud
+    from matplotlib.figure import Figure
+
+    wc = WordCloud(
+        width=800,
+        height=400,
+        background_color='white',
+        font_path=font_path
+    ).generate_from_frequencies(frequencies)
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot(111)
+    ax.imshow(wc, interpolation='bilinear')
+    ax.axis("off")
+    return _figure_to_png(fig)
+
+def render_ranking_png(results, date_str, vote_sessions, font_path):
+    """
+    投票上位のランキング表を描画してPNGのバイト列を返す
+
+    Parameters:
+    results (list): [(銘柄コード, 投票数, 銘柄名), ...]（投票数の多い順）
+    date_str (str): 投票日（YYYY-MM-DD形式）
+    vote_sessions (int): 投票ボタンが押された回数（割合の分母）
+    font_path (str): 日本語フォントのパス
+    """
+    from matplotlib.figure import Figure
+
+    font_prop = None
+    if font_path:
+        from matplotlib import font_manager
+        font_prop = font_manager.FontProperties(fname=font_path)
+
+    # 上位20位を取得
+    top_20 = results[:RANKING_TOP_N]
+
+    # 表データの作成
+    table_data = []
+    # ヘッダー
+    columns = ["順位", "銘柄コード", "銘柄名", "投票数", "割合"]
+
+    for i, row in enumerate(top_20, 1):
+        stock_code = row[0]
+        vote_count = row[1]
+        stock_name = row[2] or stock_code
+        percentage = (vote_count / vote_sessions * 100) if vote_sessions > 0 else 0
+        table_data.append([
+            str(i),
+            stock_code,
+            stock_name,
+            str(vote_count),
+            f"{percentage:.1f}%"
+        ])
+
+    # 図の作成
+    fig_table = Figure(figsize=(10, len(top_20) * 0.5 + 2))
+    ax = fig_table.add_subplot(111)
+    ax.axis('off')
+    ax.set_title(f"銘柄投票ランキング ({date_str})", fontproperties=font_prop if font_path else None, fontsize=16, pad=20)
+
+    # 表の描画
+    table = ax.table(
+        cellText=table_data,
+        colLabels=columns,
+        loc='center',
+        cellLoc='center',
+        colWidths=[0.1, 0.15, 0.4, 0.15, 0.15]
+    )
+
+    table.auto_set_font_size(False)
+    table.set_fontsize(12)
+    table.scale(1, 1.5)
+
+    # フォント設定
+    if font_path:
+        for cell in table.get_celld().values():
+            cell.set_text_props(fontproperties=font_prop)
+
+        # ヘッダーのスタイル調整
+        for (row, col), cell in table.get_celld().items():
+            if row == 0:
+                cell.set_text_props(weight='bold', fontproperties=font_prop)
+                cell.set_facecolor('#f0f0f0')
+
+    return _figure_to_png(fig_table)
+
+def get_wordcloud_png(frequencies, date_str, variant):
+    """
+    ワードクラウドのPNGを返す（描画済みならキャッシュから返す）
+
+    Parameters:
+    frequencies (dict): {表示する語: 投票数}
+    date_str (str): 投票日（YYYY-MM-DD形式）
+    variant (str): 'code'（銘柄コード）または 'name'（銘柄名）
+
+    Returns:
+    bytes: PNGのバイト列
+    """
+    font_path = get_font_path()
+    key = render_cache.make_key(
+        f"wordcloud_{variant}", date_str, sorted(frequencies.items()), render_cache.font_fingerprint(font_path)
+    )
+    return render_cache.get_or_render(key, lambda: render_wordcloud_png(frequencies, font_path))
+
+def get_ranking_png(results, date_str, vote_sessions):
+    """
+    ランキング表のPNGを返す（描画済みならキャッシュから返す）
+
+    Parameters:
+    results (list): [(銘柄コード, 投票数, 銘柄名), ...]（投票数の多い順）
+    date_str (str): 投票日（YYYY-MM-DD形式）
+    vote_sessions (int): 投票ボタンが押された回数
+
+    Returns:
+    bytes: PNGのバイト列
+    """
+    font_path = get_font_path()
+    top_rows = [list(row) for row in results[:RANKING_TOP_N]]
+    key = render_cache.make_key(
+        "ranking", date_str, top_rows, vote_sessions, render_cache.font_fingerprint(font_path)
+    )
+    return render_cache.get_or_render(key, lambda: render_ranking_png(results, date_str, vote_sessions, font_path))
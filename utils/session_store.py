@@ -0,0 +1,358 @@
+"""
+セッションをまたいで共有する株価データ・チャート画像の保管場所
+
+st.session_state には保管場所のハンドル（内容のハッシュから作るキー）だけを持たせ、
+DataFrameとPNGのバイト列はプロセス内で1つの保管場所に置く。同じデータを取得したセッション同士は同じ実体を共有する。
+各データは参照しているセッションの数を数え、どのセッションからも参照されなくなったものから削除する。
+メモリ上の合計サイズが SESSION_STORE_MAX_BYTES を超えたら、最後に使われたのが古いものから
+ローカルの一時ディレクトリに退避し、次に使われたときに読み戻す。
+Streamlitにはセッション終了の通知がないため、SESSION_STORE_IDLE_SECONDS の間アクセスのないセッションの参照は解放する。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# メモリ上に置くデータの合計サイズの上限（バイト）
+SESSION_STORE_MAX_BYTES = int(os.environ.get('SESSION_STORE_MAX_BYTES', 128 * 1024 * 1024))
+
+# この秒数アクセスのないセッションの参照を解放する
+SESSION_STORE_IDLE_SECONDS = int(os.environ.get('SESSION_STORE_IDLE_SECONDS', 2 * 60 * 60))
+
+# 退避先（プロセスごとのサブディレクトリを作る）
+SESSION_STORE_DIR = os.environ.get(
+    'SESSION_STORE_DIR', os.path.join(tempfile.gettempdir(), 'discover-stocks-session-store')
+)
+
+SESSION_ID_KEY = 'session_store_id'
+
+KINDS = ('frame', 'png')
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # {ハンドル: _Entry}（最後に使われたのが古い順）
+_sessions = {}  # {セッションID: {'handles': set, 'last_seen': float}}
+_memory_bytes = 0
+_spill_dir = None
+
+
+class _Entry:
+    __slots__ = ('kind', 'value', 'nbytes', 'path', 'refs')
+
+    def __init__(self, kind, value, nbytes):
+        self.kind = kind
+        self.value = value  # 退避中はNone
+        self.nbytes = nbytes
+        self.path = None  # 退避先のファイル（退避していない場合はNone）
+        self.refs = set()  # 参照しているセッションID
+
+
+def get_session_id():
+    """現在のStreamlitセッションのID（初回にst.session_stateに作成する）"""
+    import uuid
+    import streamlit as st
+    if SESSION_ID_KEY not in st.session_state:
+        st.session_state[SESSION_ID_KEY] = uuid.uuid4().hex
+    return st.session_state[SESSION_ID_KEY]
+
+
+def _get_spill_dir():
+    """このプロセスの退避先。終了したプロセスが残したディレクトリは最初に削除する"""
+    global _spill_dir
+    if _spill_dir is None:
+        os.makedirs(SESSION_STORE_DIR, exist_ok=True)
+        for name in os.listdir(SESSION_STORE_DIR):
+            if name.isdigit() and int(name) != os.getpid() and not _pid_alive(int(name)):
+                shutil.rmtree(os.path.join(SESSION_STORE_DIR, name), ignore_errors=True)
+        _spill_dir = os.path.join(SESSION_STORE_DIR, str(os.getpid()))
+        os.makedirs(_spill_dir, exist_ok=True)
+    return _spill_dir
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 権限がない場合なども存在はしている
+        return True
+    return True
+
+
+def _sizeof(kind, value):
+    if kind == 'frame':
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return len(value)
+
+
+def _make_handle(kind, value):
+    if kind == 'frame':
+        from utils.exports import fingerprint
+        digest = fingerprint(value)
+    else:
+        digest = hashlib.sha256(value).hexdigest()
+    return f"{kind}-{digest}"
+
+
+def _spill(handle, entry):
+    """メモリ上のデータをファイルに書き出し、メモリから外す（ロック内で呼ぶ）"""
+    global _memory_bytes
+    if entry.path is None:
+        path = os.path.join(_get_spill_dir(), handle)
+        if entry.kind == 'frame':
+            entry.value.to_pickle(path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(entry.value)
+        entry.path = path
+    entry.value = None
+    _memory_bytes -= entry.nbytes
+
+
+def _load(entry):
+    """退避したデータを読み戻す（ロック内で呼ぶ）"""
+    global _memory_bytes
+    if entry.kind == 'frame':
+        import pandas as pd
+        entry.value = pd.read_pickle(entry.path)
+    else:
+        with open(entry.path, 'rb') as f:
+            entry.value = f.read()
+    _memory_bytes += entry.nbytes
+
+
+def _remove(handle):
+    """データを削除する（ロック内で呼ぶ）"""
+    global _memory_bytes
+    entry = _entries.pop(handle)
+    if entry.value is not None:
+        _memory_bytes -= entry.nbytes
+    if entry.path is not None:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _enforce_budget():
+    """
+    メモリ上の合計サイズを上限以下にする（ロック内で呼ぶ）
+
+    参照されていないデータは削除し、参照されているデータは古いものから退避する。
+    """
+    if _memory_bytes <= SESSION_STORE_MAX_BYTES:
+        return
+    for handle in [h for h, e in _entries.items() if not e.refs and e.value is not None]:
+        _remove(handle)
+        if _memory_bytes <= SESSION_STORE_MAX_BYTES:
+            return
+    for handle, entry in list(_entries.items()):
+        if entry.value is not None:
+            _spill(handle, entry)
+            if _memory_bytes <= SESSION_STORE_MAX_BYTES:
+                return
+
+
+def _touch_session(session_id):
+    session = _sessions.get(session_id)
+    if session is None:
+        session = _sessions[session_id] = {'handles': set(), 'last_seen': time.time()}
+    session['last_seen'] = time.time()
+    return session
+
+
+def _release(session_id, handles):
+    """セッションの参照を外し、参照がなくなった退避済みのデータを削除する（ロック内で呼ぶ）"""
+    session = _sessions.get(session_id)
+    for handle in handles:
+        if session is not None:
+            session['handles'].discard(handle)
+        entry = _entries.get(handle)
+        if entry is None:
+            continue
+        entry.refs.discard(session_id)
+        # メモリ上のデータは他のセッションが同じデータを取得したときのために残し、上限を超えたときに削除する
+        if not entry.refs and entry.value is None:
+            _remove(handle)
+
+
+def _release_idle_sessions(now):
+    """アクセスのないセッションの参照を解放する（ロック内で呼ぶ）"""
+    released = 0
+    for session_id, session in list(_sessions.items()):
+        if now - session['last_seen'] > SESSION_STORE_IDLE_SECONDS:
+            _release(session_id, list(session['handles']))
+            del _sessions[session_id]
+            released += 1
+    return released
+
+
+def put(session_id, kind, value):
+    """
+    データを保管してハンドルを返す（同じ内容のデータが保管済みならそれを共有する）
+
+    Parameters:
+    session_id (str): 参照するセッションのID（get_session_id）
+    kind (str): 'frame'（DataFrame）または 'png'（PNGのバイト列）
+    value: 保管するデータ
+
+    Returns:
+    str: ハンドル（st.session_stateに保存する）
+    """
+    global _memory_bytes
+    if kind not in KINDS:
+        raise ValueError(f"Unknown session store kind: {kind}")
+    handle = _make_handle(kind, value)
+    with _lock:
+        _release_idle_sessions(time.time())
+        entry = _entries.get(handle)
+        if entry is None:
+            entry = _entries[handle] = _Entry(kind, value, _sizeof(kind, value))
+            _memory_bytes += entry.nbytes
+        elif entry.value is None:
+            # 退避済みなら今回のデータをそのまま使う（読み戻す必要はない）
+            entry.value = value
+            _memory_bytes += entry.nbytes
+        _entries.move_to_end(handle)
+        entry.refs.add(session_id)
+        _touch_session(session_id)['handles'].add(handle)
+        _enforce_budget()
+    return handle
+
+
+def get(session_id, handle):
+    """
+    ハンドルのデータを返す（退避済みなら読み戻す）
+
+    Returns:
+    DataFrame または bytes（解放済みの場合はNone）
+    """
+    with _lock:
+        _touch_session(session_id)
+        entry = _entries.get(handle)
+        if entry is None:
+            return None
+        if entry.value is None:
+            try:
+                _load(entry)
+            except OSError:
+                _remove(handle)
+                return None
+        _entries.move_to_end(handle)
+        # 解放済みのセッションが再びアクセスした場合に参照し直す
+        entry.refs.add(session_id)
+        _sessions[session_id]['handles'].add(handle)
+        value = entry.value
+        _enforce_budget()
+    return value
+
+
+def contains(handle):
+    """ハンドルのデータが保管されているか（退避済みのものも含む。読み戻しはしない）"""
+    with _lock:
+        return handle in _entries
+
+
+def get_frames(session_id, handles):
+    """{銘柄コード: ハンドル} から {銘柄コード: DataFrame} を作る（解放済みの銘柄は含まない）"""
+    frames = {}
+    for code, handle in handles.items():
+        df = get(session_id, handle)
+        if df is not None:
+            frames[code] = df
+    return frames
+
+
+def release(session_id, handles):
+    """セッションの参照を外す（データの取得し直しなどで不要になったハンドル）"""
+    with _lock:
+        _release(session_id, list(handles))
+
+
+def release_session(session_id):
+    """セッションのすべての参照を外す"""
+    with _lock:
+        session = _sessions.pop(session_id, None)
+        if session is not None:
+            _release(session_id, list(session['handles']))
+
+
+def release_idle_sessions():
+    """
+    SESSION_STORE_IDLE_SECONDS の間アクセスのないセッションの参照を解放する
+
+    Returns:
+    int: 解放したセッション数
+    """
+    with _lock:
+        return _release_idle_sessions(time.time())
+
+
+def spill_all():
+    """
+    メモリ上のデータをすべて退避する（参照されていないものは削除する）
+
+    Returns:
+    int: 退避したデータの件数
+    """
+    spilled = 0
+    with _lock:
+        for handle, entry in list(_entries.items()):
+            if entry.value is None:
+                continue
+            if entry.refs:
+                _spill(handle, entry)
+                spilled += 1
+            else:
+                _remove(handle)
+    return spilled
+
+
+def get_stats():
+    """
+    保管場所全体とセッションごとの使用量
+
+    Returns:
+    dict: {
+        'memory_bytes', 'disk_bytes', 'max_bytes', 'entries', 'spilled', 'unreferenced',
+        'sessions': [{'session_id', 'last_seen', 'handles', 'memory_bytes', 'disk_bytes', 'shared_bytes'}, ...]
+    }
+    sessions の memory_bytes は参照しているデータの合計（他のセッションと共有しているものを含む）で、
+    shared_bytes はそのうち他のセッションも参照している分。
+    """
+    with _lock:
+        sessions = []
+        for session_id, session in _sessions.items():
+            memory_bytes = disk_bytes = shared_bytes = 0
+            for handle in session['handles']:
+                entry = _entries.get(handle)
+                if entry is None:
+                    continue
+                if entry.value is not None:
+                    memory_bytes += entry.nbytes
+                else:
+                    disk_bytes += entry.nbytes
+                if len(entry.refs) > 1:
+                    shared_bytes += entry.nbytes
+            sessions.append({
+                'session_id': session_id,
+                'last_seen': datetime.fromtimestamp(session['last_seen']),
+                'handles': len(session['handles']),
+                'memory_bytes': memory_bytes,
+                'disk_bytes': disk_bytes,
+                'shared_bytes': shared_bytes,
+            })
+        entries = list(_entries.values())
+        return {
+            'memory_bytes': _memory_bytes,
+            'disk_bytes': sum(e.nbytes for e in entries if e.path is not None and e.value is None),
+            'max_bytes': SESSION_STORE_MAX_BYTES,
+            'entries': len(entries),
+            'spilled': sum(1 for e in entries if e.value is None),
+            'unreferenced': sum(1 for e in entries if not e.refs),
+            'sessions': sorted(sessions, key=lambda s: s['memory_bytes'] + s['disk_bytes'], reverse=True),
+        }
@@ -0,0 +1,180 @@
+"""
+SQLiteオンラインバックアップAPIによるスナップショット
+
+sqlite3.Connection.backup でDBファイルをページ単位に少しずつコピーする。
+各ステップの間はロックを解放するため、コピー中も他のユーザーの書き込みを妨げない。
+JSONへの全行シリアライズと比べて、一貫性のあるバイナリコピーを低コストで取得できる。
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime
+from utils.db import get_db_path, get_connection
+
+# 1ステップでコピーするページ数
+SNAPSHOT_PAGES_PER_STEP = 256
+
+# ステップ間の待機時間（秒）。この間に他の接続が書き込みできる
+SNAPSHOT_STEP_INTERVAL = 0.005
+
+# 保持するスナップショットの世代数
+SNAPSHOT_RETENTION = 7
+
+SNAPSHOT_PREFIX = 'survey_'
+SNAPSHOT_SUFFIX = '.db'
+
+
+def get_snapshot_dir():
+    """スナップショットの保存先（DBファイルと同じディレクトリ配下のsnapshots）"""
+    db_dir = os.path.dirname(os.path.abspath(get_db_path()))
+    snapshot_dir = os.path.join(db_dir, 'snapshots')
+    os.makedirs(snapshot_dir, exist_ok=True)
+    return snapshot_dir
+
+
+def _copy_database(source, target, on_progress=None):
+    """
+    sourceの内容をtargetへページ単位でコピーする
+
+    Parameters:
+    source (sqlite3.Connection): コピー元
+    target (sqlite3.Connection): コピー先
+    on_progress (callable): on_progress(コピー済みページ数, 総ページ数) の進捗コールバック
+    """
+    def progress(status, remaining, total):
+        if on_progress is not None:
+            on_progress(total - remaining, total)
+        # 次のステップまでロックを解放して書き込みを通す
+        time.sleep(SNAPSHOT_STEP_INTERVAL)
+
+    source.backup(target, pages=SNAPSHOT_PAGES_PER_STEP, progress=progress)
+
+
+def check_integrity(path):
+    """
+    DBファイルの整合性を検査する
+
+    Returns:
+    tuple: (正常か, PRAGMA integrity_check の結果メッセージのリスト)
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        messages = [row[0] for row in conn.execute("PRAGMA integrity_check;").fetchall()]
+    finally:
+        conn.close()
+    return messages == ['ok'], messages
+
+
+def list_snapshots():
+    """
+    保存済みのスナップショット一覧を新しい順に取得
+
+    Returns:
+    list: [{'name': ファイル名, 'path': パス, 'size': バイト数, 'created_at': datetime}, ...]
+    """
+    snapshot_dir = get_snapshot_dir()
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+            continue
+        path = os.path.join(snapshot_dir, name)
+        stat = os.stat(path)
+        snapshots.append({
+            'name': name,
+            'path': path,
+            'size': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime),
+        })
+    return sorted(snapshots, key=lambda s: s['name'], reverse=True)
+
+
+def rotate_snapshots(keep=SNAPSHOT_RETENTION):
+    """
+    古いスナップショットを削除し、新しいものからkeep世代だけ残す
+
+    Returns:
+    list: 削除したファイル名
+    """
+    removed = []
+    for snapshot in list_snapshots()[keep:]:
+        os.remove(snapshot['path'])
+        removed.append(snapshot['name'])
+    return removed
+
+
+def create_snapshot(label='', on_progress=None, keep=SNAPSHOT_RETENTION):
+    """
+    現在のDBのスナップショットを作成する
+
+    一時ファイルへコピーして整合性を確認した後にリネームするため、
+    途中で失敗しても不完全なスナップショットは残らない。
+
+    Parameters:
+    label (str): ファイル名に付与するラベル（例: 'pre_restore'）
+    on_progress (callable): on_progress(コピー済みページ数, 総ページ数)
+    keep (int): 作成後に残す世代数（Noneの場合はローテーションしない）
+
+    Returns:
+    str: 作成したスナップショットのパス
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    suffix = f"_{label}" if label else ''
+    path = os.path.join(get_snapshot_dir(), f"{SNAPSHOT_PREFIX}{timestamp}{suffix}{SNAPSHOT_SUFFIX}")
+    tmp_path = path + '.tmp'
+
+    source = get_connection()
+    target = sqlite3.connect(tmp_path)
+    try:
+        _copy_database(source, target, on_progress)
+        # WALの付随ファイルを残さず、単一ファイルで完結させる
+        target.execute("PRAGMA journal_mode=DELETE;")
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        ok, messages = check_integrity(tmp_path)
+        if not ok:
+            raise RuntimeError(f"スナップショットの整合性チェックに失敗しました: {'; '.join(messages[:5])}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if keep is not None:
+        rotate_snapshots(keep)
+    return path
+
+
+def restore_snapshot(path, on_progress=None):
+    """
+    スナップショットから現在のDBを復元する
+
+    復元前にスナップショットの整合性を確認し、現在のDBを'pre_restore'として退避する。
+
+    Parameters:
+    path (str): 復元するスナップショットのパス
+    on_progress (callable): on_progress(コピー済みページ数, 総ページ数)
+
+    Returns:
+    str: 退避した復元前スナップショットのパス
+    """
+    ok, messages = check_integrity(path)
+    if not ok:
+        raise RuntimeError(f"スナップショットが破損しています: {'; '.join(messages[:5])}")
+
+    # 復元前の状態を退避（復元元を削除しないよう、世代管理は復元後に行う）
+    backup_path = create_snapshot(label='pre_restore', keep=None)
+
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    target = get_connection()
+    try:
+        _copy_database(source, target, on_progress)
+        # スナップショットはDELETEモードで保存しているため、WALに戻す
+        target.execute("PRAGMA journal_mode=WAL;")
+    finally:
+        target.close()
+        source.close()
+
+    rotate_snapshots()
+    return backup_path
@@ -0,0 +1,195 @@
+"""
+投票結果の推移（pages/result_graph.py）の集計（Streamlitに依存しない）
+
+投票数を 日付 × 銘柄 の行列（無投票の日はNaN）にまとめ、表示期間と表示する銘柄を選んで
+Altair用の縦持ちのデータに戻す。行列は期間・市場ごとに1回だけ作り、ページ側でデータのバージョンをキーにキャッシュする。
+"""
+import pandas as pd
+from utils.db import get_connection
+
+# 市場ごとの銘柄コードのパターン（SQLiteのGLOB。日本株は数字始まり、米国株は英字始まり）
+MARKET_PATTERNS = {
+    'JP': '[0-9]*',
+    'US': '[A-Z]*',
+}
+
+# 銘柄を選択していない場合に表示する銘柄数（期間内の投票数の上位。残りは「その他」にまとめる）
+DEFAULT_TOP_K = 20
+
+# 銘柄を選択していない場合、表示期間がこの日数を超えると週ごとの合計にまとめる
+WEEKLY_BUCKET_AFTER_DAYS = 120
+
+# 週ごとにまとめた場合の値の列名
+WEEKLY_VALUE_COLUMN = "週の投票数"
+
+def get_vote_data_version(start_date_str, end_date_str):
+    """
+    期間内の投票データのバージョンを取得する関数
+
+    投票の追加・削除で変わる値（件数・最大ID・IDの合計）と銘柄マスタの件数を返す。
+    キャッシュのキーに含めると、投票が変わったときだけ集計し直す。
+
+    Parameters:
+    start_date_str (str): 開始日（YYYY-MM-DD形式）
+    end_date_str (str): 終了日（YYYY-MM-DD形式）
+
+    Returns:
+    tuple: (件数, 最大ID, IDの合計, 銘柄マスタの件数)
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), MAX(id), TOTAL(id), (SELECT COUNT(*) FROM stock_master)
+            FROM vote
+            WHERE vote_date BETWEEN ? AND ?
+        """, (start_date_str, end_date_str))
+        return tuple(cursor.fetchone())
+    finally:
+        conn.close()
+
+def load_vote_counts(start_date_str, end_date_str, market):
+    """
+    期間内の日付・銘柄ごとの投票数を取得する関数
+
+    Parameters:
+    start_date_str (str): 開始日（YYYY-MM-DD形式）
+    end_date_str (str): 終了日（YYYY-MM-DD形式）
+    market (str): 'JP' または 'US'
+
+    Returns:
+    DataFrame: 日付（datetime）, 銘柄コード（"銘柄コード 銘柄名"）, 投票数
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT a.vote_date, a.stock_code || ' ' || COALESCE(b.stock_name, ''), count(a.stock_code) AS vote_count
+             FROM vote AS a LEFT OUTER JOIN stock_master AS b ON a.stock_code = b.stock_code
+             WHERE a.vote_date BETWEEN ? AND ?
+             AND a.stock_code GLOB ?
+             GROUP BY a.vote_date, a.stock_code;
+        """, (start_date_str, end_date_str, MARKET_PATTERNS[market]))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame(rows, columns=["日付", "銘柄コード", "投票数"])
+    df["日付"] = pd.to_datetime(df["日付"])  # 日付をDatetime型に変換
+    return df
+
+def load_vote_totals(start_date_str, end_date_str):
+    """
+    期間内の投票日ごとの投票数の合計と投票ボタンが押された回数を取得する関数
+
+    Returns:
+    DataFrame: 日付（datetime）, 投票数の合計, 投票ボタンが押された回数
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT a.vote_date, COUNT(a.id) as total_votes, COUNT(DISTINCT a.created_at) as vote_sessions
+             FROM vote AS a
+             WHERE a.vote_date BETWEEN ? AND ?
+             GROUP BY a.vote_date ORDER BY a.vote_date ASC;
+        """, (start_date_str, end_date_str))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame(rows, columns=["日付", "投票数の合計", "投票ボタンが押された回数"])
+    df["日付"] = pd.to_datetime(df["日付"])
+    return df
+
+def build_vote_matrix(df):
+    """
+    縦持ちの投票数を 日付 × 銘柄 の行列にする関数
+
+    行はいずれかの銘柄に投票があった日だけで、その日に投票がない銘柄はNaNになる
+    （期間がひらいて再度投票された銘柄の線が、無投票の期間をつながないようにするため）。
+
+    Parameters:
+    df (DataFrame): load_vote_counts の結果
+
+    Returns:
+    DataFrame: index=日付（昇順）, columns=銘柄コード, 値=投票数
+    """
+    if df.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="日付"), dtype=float)
+    matrix = df.pivot(index="日付", columns="銘柄コード", values="投票数").sort_index()
+    matrix.columns.name = None
+    return matrix.astype(float)
+
+def slice_vote_matrix(matrix, start_date, end_date):
+    """
+    行列を表示期間で切り出し、期間内に投票がない銘柄の列を除く
+
+    Parameters:
+    matrix (DataFrame): build_vote_matrix の結果
+    start_date, end_date (datetime): 表示期間（両端を含む）
+
+    Returns:
+    DataFrame: 切り出した行列
+    """
+    window = matrix.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+    return window.dropna(axis=1, how="all")
+
+def top_k_codes(window, top_k=DEFAULT_TOP_K):
+    """期間内の投票数の合計が多い順に上位top_k銘柄のコードを返す"""
+    totals = window.sum()
+    # 同数の場合は銘柄コード順にして、再描画のたびに並びが変わらないようにする
+    order = sorted(totals.index, key=lambda code: (-totals[code], code))
+    return order[:top_k]
+
+def melt_vote_matrix(window, codes):
+    """
+    行列の指定した銘柄をAltair用の縦持ちに戻す
+
+    Parameters:
+    window (DataFrame): slice_vote_matrix の結果
+    codes (list): 表示する銘柄コード
+
+    Returns:
+    DataFrame: 日付, 銘柄コード, 投票数（無投票の日はNaN）
+    """
+    codes = [code for code in codes if code in window.columns]
+    if not codes or window.empty:
+        return pd.DataFrame(columns=["日付", "銘柄コード", "投票数"])
+    return (
+        window[codes]
+        .rename_axis("日付")
+        .reset_index()
+        .melt(id_vars="日付", var_name="銘柄コード", value_name="投票数")
+    )
+
+def reduce_vote_matrix(window, top_k=DEFAULT_TOP_K, weekly_after_days=WEEKLY_BUCKET_AFTER_DAYS):
+    """
+    銘柄を選択していない場合の描画用データを作る関数
+
+    上位top_k銘柄以外は「その他」の1系列に合計し、表示期間が weekly_after_days を超える場合は
+    週（月曜始まり）ごとの合計にまとめる。ブラウザに送る点の数を期間・銘柄数によらず抑えるため。
+
+    Parameters:
+    window (DataFrame): slice_vote_matrix の結果
+    top_k (int): 個別に表示する銘柄数
+    weekly_after_days (int): 週ごとにまとめる表示期間の日数
+
+    Returns:
+    tuple: (DataFrame（日付, 銘柄コード, 値の列）, 値の列名, 上位の銘柄コードのリスト)
+        値の列名は日ごとの場合は "投票数"、週ごとの場合は WEEKLY_VALUE_COLUMN
+    """
+    codes = top_k_codes(window, top_k)
+    reduced = window[codes]
+    others = window.columns.difference(codes)
+    if len(others):
+        reduced = reduced.assign(**{f"その他（{len(others)}銘柄）": window[others].sum(axis=1, min_count=1)})
+
+    value_column = "投票数"
+    if not window.empty and (window.index.max() - window.index.min()).days > weekly_after_days:
+        # 投票がない週はNaNにして線をつながない
+        reduced = reduced.resample("W-MON", label="left", closed="left").sum(min_count=1)
+        value_column = WEEKLY_VALUE_COLUMN
+
+    df = melt_vote_matrix(reduced, list(reduced.columns))
+    return df.rename(columns={"投票数": value_column}), value_column, codes